@@ -0,0 +1,108 @@
+from typing import Dict, Any, Optional
+from pydantic import ValidationError
+from ..services.deepseek_adapter import DeepseekAdapter
+from ..schemas.responses import AnalysisResponse, SQLResponse
+from .prompts import get_prompt_cache
+
+class PlannerAgent:
+    """
+    Агент, который за один вызов LLM определяет требуемые данные, тип визуализации,
+    SQL-запрос и подписи (вместо цепочки Analyzer → SQL → Visualizer)
+    """
+
+    def __init__(self, db_metadata):
+        self.db_metadata = db_metadata
+        self.model = DeepseekAdapter(agent="planner")
+
+    def _request_kwargs(self, user_query: str, retry: bool = False) -> Dict[str, Any]:
+        """
+        Формирует параметры запроса к модели
+        
+        Args:
+            user_query: Текстовый запрос пользователя
+            retry: Повторный запрос с более явной инструкцией
+            
+        Returns:
+            Dictionary с аргументами generate_response
+        """
+        system_message = get_prompt_cache().get("planner", self.db_metadata, query=user_query)[1]
+        if not retry:
+            return {"prompt": user_query, "system_message": system_message,
+                    "temperature": 0.2, "json_mode": True}
+        
+        # Повторяем запрос с более явной инструкцией
+        return {
+            "prompt": f"Составь план и SQL-запрос для следующего запроса и верни только JSON: {user_query}",
+            "system_message": system_message + "\nВажно: твой ответ должен содержать все указанные поля в формате JSON.",
+            "temperature": 0.1,
+            "json_mode": True
+        }
+
+    async def plan_async(self, user_query: str) -> Optional[Dict[str, Any]]:
+        """
+        Асинхронная версия метода plan (ожидание ответа модели не занимает поток)
+
+        Args:
+            user_query: Текстовый запрос пользователя
+
+        Returns:
+            Dictionary с планом запроса или None, если корректный план не получен
+        """
+        response = await self.model.generate_response_async(**self._request_kwargs(user_query))
+        plan = self._validate(self.model.extract_json_from_response(response))
+
+        if plan is None:
+            response = await self.model.generate_response_async(**self._request_kwargs(user_query, retry=True))
+            plan = self._validate(self.model.extract_json_from_response(response))
+
+        return plan
+
+    def plan(self, user_query: str) -> Optional[Dict[str, Any]]:
+        """
+        Получает от модели план анализа и SQL-запрос одним ответом
+
+        Args:
+            user_query: Текстовый запрос пользователя
+
+        Returns:
+            Dictionary с полями AnalysisResponse и SQLResponse, а также title, description,
+            x_axis_title и y_axis_title; None, если ответ не прошел проверку
+        """
+        response = self.model.generate_response(**self._request_kwargs(user_query))
+        plan = self._validate(self.model.extract_json_from_response(response))
+
+        if plan is None:
+            response = self.model.generate_response(**self._request_kwargs(user_query, retry=True))
+            plan = self._validate(self.model.extract_json_from_response(response))
+
+        return plan
+
+    @staticmethod
+    def _validate(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Проверяет ответ по схемам AnalysisResponse и SQLResponse
+
+        Args:
+            result: JSON, извлеченный из ответа модели
+
+        Returns:
+            Нормализованный план или None, если ответ не соответствует схемам
+        """
+        # Подсказки и объяснение не обязательны: из-за них план повторно не запрашивается
+        result = {"sql_hints": "", "query_explanation": "", **result}
+        try:
+            analysis = AnalysisResponse.model_validate(result)
+            sql = SQLResponse.model_validate(result)
+        except ValidationError:
+            return None
+
+        # Удаляем потенциальные обратные кавычки, если они были в ответе
+        sql_query = sql.sql_query.strip().strip('`').strip()
+        if not sql_query:
+            return None
+
+        plan = {**analysis.model_dump(), **sql.model_dump(), "sql_query": sql_query}
+        for field in ("title", "description", "x_axis_title", "y_axis_title"):
+            value = result.get(field)
+            plan[field] = value if isinstance(value, str) else ""
+        return plan
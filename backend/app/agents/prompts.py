@@ -0,0 +1,441 @@
+import json
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Tuple, Optional, FrozenSet
+
+from ..services.usage import record_prompt_savings
+from ..utils.column_selector import get_column_selector, estimate_tokens
+
+# Основное представление, столбцы которого отбираются под запрос
+VIEW_NAME = "test_staging.user_metrics_dashboard_optimized"
+
+# Шаблоны системных промптов агентов. Текст не меняется между вызовами,
+# чтобы при одинаковых метаданных промпт был побайтно одинаковым
+# и попадал в кэш префикса на стороне провайдера. Описание представления
+# ({db_info}) стоит в конце: при отборе столбцов под запрос (PROMPT_COLUMN_PRUNING)
+# меняется только оно, а неизменные инструкции остаются общим префиксом.
+ANALYZER_SYSTEM_TEMPLATE = """
+        Ты аналитик данных с фокусом на анализ пользовательской активности на платформе Atlantix.
+
+        Основное представление данных - 'test_staging.user_metrics_dashboard_optimized' (его столбцы описаны в конце).
+
+        ОБРАТИ ВНИМАНИЕ:
+        1. Для любого анализа пользовательской активности ВСЕГДА используй ТОЛЬКО представление 'test_staging.user_metrics_dashboard_optimized'.
+        2. "Подписчик", "Активированный" и "Заинтересованный" - это значения столбца user_type. Также доступны флаги is_subscriber, is_activated_user и is_interested_user для фильтрации.
+        3. cohort_month - это месяц, когда пользователь впервые посетил платформу (timestamp).
+        4. При работе с временными данными всегда используй правильные функции SQL для группировки: DATE_TRUNC('month', cohort_month) или DATE_TRUNC('week', cohort_month).
+
+        Твоя задача - определить:
+        1. Какие данные нужно получить из представления
+        2. Какой тип визуализации лучше всего подходит
+        3. Какие подсказки нужны для SQL-запроса
+
+        Ответ ОБЯЗАТЕЛЬНО в формате JSON:
+        {{
+            "required_data": "подробное описание какие данные нужно получить",
+            "visualization_type": "тип визуализации (bar, line, pie, table)",
+            "sql_hints": "подсказки для SQL-запроса включая рекомендуемые группировки и фильтры"
+        }}
+
+        Рекомендации по типам визуализации:
+        - Для анализа трендов во времени: 'line'
+        - Для сравнения метрик по категориям: 'bar'
+        - Для распределения долей: 'pie'
+        - Для детального просмотра данных: 'table'
+
+        Столбцы представления 'test_staging.user_metrics_dashboard_optimized':
+        {db_info}
+        """
+
+SQL_EXPERT_SYSTEM_TEMPLATE = """
+        Ты SQL-эксперт, специализирующийся на анализе данных пользовательской активности.
+
+        ВАЖНЫЕ ПРАВИЛА:
+        1. ВСЕГДА используй ТОЛЬКО представление 'test_staging.user_metrics_dashboard_optimized' для запросов.
+        2. Никогда не используй JOIN с другими таблицами - все необходимые данные уже в представлении.
+        3. Используй следующие подходы для работы с временными данными:
+        - Группировка по неделям: DATE_TRUNC('week', cohort_month)
+        - Группировка по месяцам: DATE_TRUNC('month', cohort_month)
+        - Фильтрация по периоду: cohort_month BETWEEN '2025-01-01' AND '2025-03-31'
+        4. Для анализа по типам пользователей используй:
+        - Фильтрация по типу: WHERE user_type = 'Подписчик' ИЛИ
+        - Фильтрация по флагу: WHERE is_subscriber = 1
+        5. Оптимизируй запросы для максимальной производительности:
+        - Используй нужные агрегирующие функции (COUNT, AVG, SUM)
+        - Всегда добавляй ORDER BY для временных рядов
+        - Ограничивай выборку данных необходимыми полями
+        
+        Ответ СТРОГО в формате JSON:
+        {{
+            "sql_query": "полный SQL-запрос для выполнения",
+            "query_explanation": "подробное объяснение запроса на русском языке"
+        }}
+
+        Структура представления 'test_staging.user_metrics_dashboard_optimized':
+        {db_info}
+        """
+
+
+PLANNER_SYSTEM_TEMPLATE = """
+        Ты аналитик данных и SQL-эксперт платформы Atlantix. За один ответ ты планируешь анализ
+        запроса пользователя и пишешь SQL-запрос для него.
+
+        ВАЖНЫЕ ПРАВИЛА:
+        1. ВСЕГДА используй ТОЛЬКО представление 'test_staging.user_metrics_dashboard_optimized'. Никогда не используй JOIN с другими таблицами.
+        2. "Подписчик", "Активированный" и "Заинтересованный" - это значения столбца user_type. Также доступны флаги is_subscriber, is_activated_user и is_interested_user.
+        3. Для временных данных используй DATE_TRUNC('month', cohort_month) или DATE_TRUNC('week', cohort_month) и всегда добавляй ORDER BY для временных рядов.
+        4. Для количества уникальных пользователей используй COUNT(DISTINCT user_id).
+        5. Все заголовки, подписи и описания - на РУССКОМ языке.
+
+        Рекомендации по типам визуализации:
+        - Для анализа трендов во времени: 'line'
+        - Для сравнения метрик по категориям: 'bar'
+        - Для распределения долей: 'pie'
+        - Для детального просмотра данных: 'table'
+
+        Ответ СТРОГО в формате JSON:
+        {{
+            "required_data": "подробное описание какие данные нужно получить",
+            "visualization_type": "тип визуализации (bar, line, pie, table)",
+            "sql_hints": "рекомендуемые группировки и фильтры",
+            "sql_query": "полный SQL-запрос для выполнения",
+            "query_explanation": "подробное объяснение запроса на русском языке",
+            "title": "заголовок визуализации",
+            "description": "краткое описание визуализации",
+            "x_axis_title": "подпись оси X",
+            "y_axis_title": "подпись оси Y"
+        }}
+
+        Структура представления 'test_staging.user_metrics_dashboard_optimized':
+        {db_info}
+        """
+
+
+def _prune_lines(lines, dropped: FrozenSet[str]):
+    """Убирает строки, относящиеся только к невыбранным столбцам представления"""
+    if not dropped:
+        return lines
+    return get_column_selector().prune("\n".join(lines), dropped).split("\n")
+
+
+def _render_analyzer_metadata(db_metadata: Dict[str, Any], dropped: FrozenSet[str] = frozenset()) -> str:
+    """
+    Форматирует метаданные базы данных для промпта AnalyzerAgent
+    
+    Args:
+        db_metadata: Метаданные базы данных
+        dropped: Столбцы представления, которые не нужны для запроса
+    
+    Returns:
+        Строка с форматированными метаданными базы данных
+    """
+    tables_info = []
+
+    # Сначала добавляем наше ключевое представление с подробным описанием
+    if "test_staging.user_metrics_dashboard_optimized" in db_metadata:
+        table_data = db_metadata["test_staging.user_metrics_dashboard_optimized"]
+
+        # Если есть отдельное общее описание таблицы, добавляем его
+        if "description" in table_data:
+            tables_info.append(f"{table_data['description']}\n")
+
+        # Добавляем информацию о колонках с их описанием
+        tables_info.append("Детальная информация о колонках представления test_staging.user_metrics_dashboard_optimized:")
+
+        for column in table_data["columns"]:
+            column_info = f"- {column['name']} ({column['type']})"
+            if "description" in column:
+                column_info += f": {column['description']}"
+            tables_info.append(column_info)
+
+        # Добавляем примеры типичных запросов к представлению
+        tables_info.append("\nТипичные запросы к представлению test_staging.user_metrics_dashboard_optimized:")
+        tables_info.append("1. Анализ активности по времени: GROUP BY DATE_TRUNC('week', cohort_month)")
+        tables_info.append("2. Анализ по типам пользователей: GROUP BY user_type")
+        tables_info.append("3. Анализ метрик вовлеченности: AVG(total_sessions), AVG(active_days), AVG(avg_session_minutes)")
+
+        # Описание, колонки и примеры только для столбцов, нужных запросу
+        tables_info = _prune_lines(tables_info, dropped)
+        tables_info.append("")  # Пустая строка для разделения
+
+    # Затем добавляем остальные таблицы с базовым описанием
+    for table_name, table_data in db_metadata.items():
+        if table_name == "test_staging.user_metrics_dashboard_optimized":
+            continue  # Пропускаем, так как уже добавили выше
+
+        # Добавляем базовую информацию о таблице/представлении
+        table_info = f"Таблица/Представление: {table_name}\nКолонки: "
+
+        # Собираем информацию о колонках
+        columns = []
+        for column in table_data["columns"]:
+            column_info = f"{column['name']} ({column['type']})"
+            if "description" in column:
+                column_info += f" - {column['description']}"
+            columns.append(column_info)
+
+        table_info += ", ".join(columns)
+        tables_info.append(table_info)
+
+    return "\n".join(tables_info)
+
+
+def _render_sql_metadata(db_metadata: Dict[str, Any], dropped: FrozenSet[str] = frozenset()) -> str:
+    """
+    Форматирует метаданные базы данных для промпта SQLExpertAgent
+    
+    Args:
+        db_metadata: Метаданные базы данных
+        dropped: Столбцы представления, которые не нужны для запроса
+    
+    Returns:
+        Строка с форматированными метаданными базы данных
+    """
+    tables_info = []
+
+    # Сначала добавляем основное представление для анализа пользователей,
+    # чтобы подчеркнуть его приоритет
+    if "test_staging.user_metrics_dashboard_optimized" in db_metadata:
+        table_data = db_metadata["test_staging.user_metrics_dashboard_optimized"]
+
+        # Если есть отдельное общее описание таблицы, добавляем его
+        if "description" in table_data:
+            tables_info.append(f"{table_data['description']}\n")
+        else:
+            tables_info.append("Представление test_staging.user_metrics_dashboard_optimized - основной источник данных для анализа пользовательской активности.\n")
+
+        # Добавляем подробное описание столбцов с их описанием (если доступно)
+        tables_info.append("Детальное описание колонок представления test_staging.user_metrics_dashboard_optimized:")
+
+        for column in table_data["columns"]:
+            column_info = f"- {column['name']} ({column['type']})"
+            if "description" in column:
+                column_info += f": {column['description']}"
+            tables_info.append(column_info)
+
+        tables_info.append("\nПримеры использования представления test_staging.user_metrics_dashboard_optimized:")
+        tables_info.append("1. Для анализа активности пользователей по времени: GROUP BY DATE_TRUNC('week', cohort_month)")
+        tables_info.append("2. Для сравнения типов пользователей: GROUP BY user_type")
+        tables_info.append("3. Для анализа конверсии: COUNT(is_interested_user), COUNT(is_activated_user), COUNT(is_subscriber)")
+
+        # Описание, колонки и примеры только для столбцов, нужных запросу
+        tables_info = _prune_lines(tables_info, dropped)
+        tables_info.append("")  # Пустая строка для разделения
+
+    # Затем добавляем остальные таблицы/представления
+    for table_name, table_data in db_metadata.items():
+        if table_name == "test_staging.user_metrics_dashboard_optimized":
+            continue  # Пропускаем, так как уже добавили выше
+
+        tables_info.append(f"Таблица/Представление: {table_name}")
+
+        # Добавляем колонки с их описаниями (если доступны)
+        columns_info = []
+        for column in table_data["columns"]:
+            column_info = f"- {column['name']} ({column['type']})"
+            if "description" in column:
+                column_info += f": {column['description']}"
+            columns_info.append(column_info)
+
+        tables_info.append("Колонки:")
+        tables_info.extend(columns_info)
+
+        # Добавляем информацию о первичных ключах, если доступна
+        if "primary_keys" in table_data and table_data["primary_keys"]:
+            primary_keys = ", ".join(table_data["primary_keys"])
+            tables_info.append(f"Первичные ключи: {primary_keys}")
+
+        # Добавляем информацию о внешних ключах, если доступна
+        if "foreign_keys" in table_data and table_data["foreign_keys"]:
+            fk_info = []
+            for fk in table_data["foreign_keys"]:
+                fk_info.append(f"{fk['column']} -> {fk['references_table']}.{fk['references_column']}")
+            foreign_keys = "\n  - ".join(fk_info)
+            tables_info.append(f"Внешние ключи:\n  - {foreign_keys}")
+
+        tables_info.append("")  # Пустая строка для разделения таблиц
+
+    return "\n".join(tables_info)
+
+
+# Сборщики промптов по агентам: (форматирование метаданных, шаблон системного промпта)
+_PROMPT_BUILDERS = {
+    "analyzer": (_render_analyzer_metadata, ANALYZER_SYSTEM_TEMPLATE),
+    "sql_expert": (_render_sql_metadata, SQL_EXPERT_SYSTEM_TEMPLATE),
+    "planner": (_render_sql_metadata, PLANNER_SYSTEM_TEMPLATE)
+}
+
+
+def compute_metadata_version(db_metadata: Dict[str, Any]) -> str:
+    """
+    Вычисляет версию метаданных как хэш их содержимого
+
+    Args:
+        db_metadata: Метаданные базы данных
+
+    Returns:
+        Короткий хэш содержимого метаданных
+    """
+    serialized = json.dumps(db_metadata, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:16]
+
+
+class PromptCache:
+    """
+    Кэш системных промптов агентов, собранных один раз на версию метаданных.
+
+    Версия вычисляется по содержимому метаданных один раз для каждого объекта
+    метаданных (метаданные загружаются при запуске и не изменяются на месте;
+    при изменении передайте новый объект или вызовите invalidate()).
+
+    Если передан запрос пользователя и включен prune_columns, из описания представления
+    убираются столбцы (и примеры), которые запросу не нужны (см. ColumnSelector); промпт
+    собирается один раз на набор убранных столбцов. Это сокращает промпт, но кэш префикса
+    провайдера тогда покрывает только инструкции до описания представления, поэтому
+    по умолчанию отбор выключен.
+    """
+
+    def __init__(self,
+                 max_versions: int = 4,
+                 warn_chars: int = 60000,
+                 prune_columns: bool = False,
+                 max_prompts: int = 256):
+        """
+        Args:
+            max_versions: Сколько версий метаданных хранить одновременно
+            warn_chars: Размер системного промпта (символов), выше которого выводится предупреждение
+            prune_columns: Отбирать ли столбцы представления под запрос
+            max_prompts: Максимальное число собранных промптов (всех агентов, версий и наборов столбцов)
+        """
+        self.max_versions = max_versions
+        self.warn_chars = warn_chars
+        self.prune_columns = prune_columns
+        self.max_prompts = max_prompts
+        self._lock = threading.Lock()
+        # id(метаданных) -> (метаданные, версия); ссылка удерживает id от повторного использования
+        self._versions: "OrderedDict[int, Tuple[Dict[str, Any], str]]" = OrderedDict()
+        # (агент, версия, убранные столбцы) -> (данные о БД, системный промпт)
+        self._prompts: "OrderedDict[Tuple[str, str, FrozenSet[str]], Tuple[str, str]]" = OrderedDict()
+        self.renders = 0
+        self.hits = 0
+        self.pruned = 0
+        self.chars_saved = 0
+
+    def metadata_version(self, db_metadata: Dict[str, Any]) -> str:
+        """Возвращает версию метаданных, вычисляя ее один раз на объект"""
+        key = id(db_metadata)
+        with self._lock:
+            entry = self._versions.get(key)
+            if entry is not None and entry[0] is db_metadata:
+                self._versions.move_to_end(key)
+                return entry[1]
+
+        version = compute_metadata_version(db_metadata)
+        with self._lock:
+            self._versions[key] = (db_metadata, version)
+            while len(self._versions) > self.max_versions:
+                self._versions.popitem(last=False)
+        return version
+
+    def get(self, agent: str, db_metadata: Dict[str, Any], query: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Возвращает данные о БД и системный промпт агента для метаданных
+
+        Args:
+            agent: "analyzer", "sql_expert" или "planner"
+            db_metadata: Метаданные базы данных
+            query: Текст, по которому отбираются столбцы представления
+                (None - промпт со всеми столбцами)
+
+        Returns:
+            Кортеж (форматированные метаданные, системный промпт)
+        """
+        full = self._get(agent, db_metadata, frozenset())
+        if query is None or not self.prune_columns or VIEW_NAME not in db_metadata:
+            return full
+
+        selector = get_column_selector()
+        dropped = selector.dropped(selector.select(query))
+        if not dropped:
+            return full
+
+        prompts = self._get(agent, db_metadata, dropped)
+        chars_saved = len(full[1]) - len(prompts[1])
+        with self._lock:
+            self.pruned += 1
+            self.chars_saved += chars_saved
+        record_prompt_savings(agent, chars_saved)
+        return prompts
+
+    def _get(self, agent: str, db_metadata: Dict[str, Any], dropped: FrozenSet[str]) -> Tuple[str, str]:
+        """Возвращает промпт без указанных столбцов представления, собирая его при первом обращении"""
+        key = (agent, self.metadata_version(db_metadata), dropped)
+        with self._lock:
+            prompts = self._prompts.get(key)
+            if prompts is not None:
+                self.hits += 1
+                self._prompts.move_to_end(key)
+                return prompts
+
+        render_metadata, template = _PROMPT_BUILDERS[agent]
+        db_info = render_metadata(db_metadata, dropped)
+        prompts = (db_info, template.format(db_info=db_info))
+        if self.warn_chars and len(prompts[1]) > self.warn_chars:
+            print(f"Внимание: системный промпт агента {agent} занимает {len(prompts[1])} символов "
+                  f"(версия метаданных {key[1]}, порог {self.warn_chars})")
+
+        with self._lock:
+            self.renders += 1
+            self._prompts[key] = prompts
+            while len(self._prompts) > self.max_prompts:
+                self._prompts.popitem(last=False)
+        return prompts
+
+    def invalidate(self):
+        """Сбрасывает все собранные промпты и версии метаданных"""
+        with self._lock:
+            self._versions.clear()
+            self._prompts.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает размеры собранных промптов и счетчики кэша
+
+        Returns:
+            Dictionary с размерами промптов по агентам и версиям метаданных
+        """
+        with self._lock:
+            # Размеры приводятся для полных промптов; промпты с отобранными столбцами
+            # учитываются счетчиками pruned и chars_saved
+            prompts = {
+                f"{agent}@{version}": {
+                    "db_info_chars": len(db_info),
+                    "system_prompt_chars": len(system_prompt),
+                    "system_prompt_bytes": len(system_prompt.encode("utf-8"))
+                }
+                for (agent, version, dropped), (db_info, system_prompt) in self._prompts.items()
+                if not dropped
+            }
+            return {
+                "renders": self.renders,
+                "hits": self.hits,
+                "pruned": self.pruned,
+                "chars_saved": self.chars_saved,
+                "tokens_saved_est": estimate_tokens(self.chars_saved),
+                "cached_variants": len(self._prompts),
+                "prompts": prompts
+            }
+
+
+# Общий для процесса кэш промптов
+_prompt_cache = PromptCache(
+    warn_chars=int(os.getenv("PROMPT_SIZE_WARN_CHARS", "60000")),
+    prune_columns=os.getenv("PROMPT_COLUMN_PRUNING", "false").lower() in ("1", "true", "yes")
+)
+
+
+def get_prompt_cache() -> PromptCache:
+    """Возвращает общий кэш системных промптов агентов"""
+    return _prompt_cache
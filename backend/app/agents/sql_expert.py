@@ -1,91 +1,93 @@
-import asyncio
 import datetime
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from ..services.deepseek_adapter import DeepseekAdapter
+from .prompts import get_prompt_cache
 
 class SQLExpertAgent:
     """Агент для генерации SQL-запросов"""
     
     def __init__(self, db_metadata):
         self.db_metadata = db_metadata
-        self.model = DeepseekAdapter()
+        self.model = DeepseekAdapter(agent="sql_expert")
     
     def _prepare_db_metadata(self) -> str:
         """
         Подготавливает метаданные базы данных для включения в запрос
+        (собираются один раз на версию метаданных)
         
         Returns:
             Строка с форматированными метаданными базы данных
         """
-        tables_info = []
+        return get_prompt_cache().get("sql_expert", self.db_metadata)[0]
+    
+
+    # Поля, которые должен содержать ответ модели
+    REQUIRED_FIELDS = ["sql_query", "query_explanation"]
+    # Поля, без которых ответ повторно запрашивается у модели
+    # (объяснение запроса дополняется значением по умолчанию в _postprocess)
+    ESSENTIAL_FIELDS = ["sql_query"]
+    
+    @staticmethod
+    def _build_user_message(analysis_result: Dict[str, Any]) -> str:
+        """Формирует запрос к модели по результату анализа"""
+        return f"""
+        Мне нужен SQL-запрос для визуализации: {analysis_result['required_data']}
+        Тип визуализации: {analysis_result['visualization_type']}
+        Подсказки для SQL: {analysis_result['sql_hints']}
         
-        # Сначала добавляем основное представление для анализа пользователей,
-        # чтобы подчеркнуть его приоритет
-        if "test_staging.user_metrics_dashboard_optimized" in self.db_metadata:
-            table_data = self.db_metadata["test_staging.user_metrics_dashboard_optimized"]
-            
-            # Если есть отдельное общее описание таблицы, добавляем его
-            if "description" in table_data:
-                tables_info.append(f"{table_data['description']}\n")
-            else:
-                tables_info.append("Представление test_staging.user_metrics_dashboard_optimized - основной источник данных для анализа пользовательской активности.\n")
-            
-            # Добавляем подробное описание столбцов с их описанием (если доступно)
-            tables_info.append("Детальное описание колонок представления test_staging.user_metrics_dashboard_optimized:")
-            
-            for column in table_data["columns"]:
-                column_info = f"- {column['name']} ({column['type']})"
-                if "description" in column:
-                    column_info += f": {column['description']}"
-                tables_info.append(column_info)
-            
-            tables_info.append("\nПримеры использования представления test_staging.user_metrics_dashboard_optimized:")
-            tables_info.append("1. Для анализа активности пользователей по времени: GROUP BY DATE_TRUNC('week', cohort_month)")
-            tables_info.append("2. Для сравнения типов пользователей: GROUP BY user_type")
-            tables_info.append("3. Для анализа конверсии: COUNT(is_interested_user), COUNT(is_activated_user), COUNT(is_subscriber)")
-            
-            tables_info.append("")  # Пустая строка для разделения
+        Используй представление 'test_staging.user_metrics_dashboard_optimized' для запросов о пользователях и их активности.
+        Если запрос связан с анализом активности пользователей по времени, обязательно используй:
+        - DATE_TRUNC для правильной группировки по временным интервалам
+        - Сортировку по времени для корректного отображения тренда
+        - Фильтр по периоду, если указан конкретный диапазон дат
         
-        # Затем добавляем остальные таблицы/представления
-        for table_name, table_data in self.db_metadata.items():
-            if table_name == "test_staging.user_metrics_dashboard_optimized":
-                continue  # Пропускаем, так как уже добавили выше
-                
-            tables_info.append(f"Таблица/Представление: {table_name}")
-            
-            # Добавляем колонки с их описаниями (если доступны)
-            columns_info = []
-            for column in table_data["columns"]:
-                column_info = f"- {column['name']} ({column['type']})"
-                if "description" in column:
-                    column_info += f": {column['description']}"
-                columns_info.append(column_info)
-            
-            tables_info.append("Колонки:")
-            tables_info.extend(columns_info)
-            
-            # Добавляем информацию о первичных ключах, если доступна
-            if "primary_keys" in table_data and table_data["primary_keys"]:
-                primary_keys = ", ".join(table_data["primary_keys"])
-                tables_info.append(f"Первичные ключи: {primary_keys}")
+        ВАЖНО: Придерживайся описания и назначения каждого поля представления. Например:
+        - Для анализа количества уникальных пользователей используй COUNT(DISTINCT user_id)
+        - Для анализа активности по типам пользователей используй поле user_type
+        - Для анализа вовлеченности используй поля с метриками (total_sessions, active_days и т.д.)
+        """
+        
+    @staticmethod
+    def _column_query(analysis_result: Dict[str, Any]) -> str:
+        """Текст, по которому отбираются столбцы для промпта (без общих инструкций запроса)"""
+        return f"{analysis_result.get('required_data', '')} {analysis_result.get('sql_hints', '')}"
+    
+    def _request_kwargs(self,
+                        user_message: str,
+                        retry: bool = False,
+                        column_query: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Формирует параметры запроса к модели
+        
+        Args:
+            user_message: Запрос к модели, сформированный по результату анализа
+            retry: Повторный запрос с более явной инструкцией
+            column_query: Текст для отбора столбцов представления (None - все столбцы)
             
-            # Добавляем информацию о внешних ключах, если доступна
-            if "foreign_keys" in table_data and table_data["foreign_keys"]:
-                fk_info = []
-                for fk in table_data["foreign_keys"]:
-                    fk_info.append(f"{fk['column']} -> {fk['references_table']}.{fk['references_column']}")
-                foreign_keys = "\n  - ".join(fk_info)
-                tables_info.append(f"Внешние ключи:\n  - {foreign_keys}")
-                
-            tables_info.append("")  # Пустая строка для разделения таблиц
+        Returns:
+            Dictionary с аргументами generate_response
+        """
+        system_message = get_prompt_cache().get("sql_expert", self.db_metadata, query=column_query)[1]
+        if not retry:
+            return {"prompt": user_message, "system_message": system_message,
+                    "temperature": 0.2, "json_mode": True}
         
-        return "\n".join(tables_info)
+        # Если запрос не содержит всех полей, пытаемся исправить
+        return {
+            "prompt": f"Сгенерируй SQL-запрос и объяснение к нему в JSON формате для: {user_message}",
+            "system_message": system_message + "\nВажно: твой ответ должен содержать точно SQL-запрос и его объяснение в JSON формате.",
+            "temperature": 0.1,
+            "json_mode": True
+        }
     
+    def _is_complete(self, result: Dict[str, Any]) -> bool:
+        """Проверяет наличие обязательных полей в ответе модели"""
+        return all(result.get(field) for field in self.ESSENTIAL_FIELDS)
 
     async def generate_sql_async(self, analysis_result: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Асинхронная версия метода generate_sql
+        Асинхронная версия метода generate_sql (ожидание ответа модели не занимает поток)
         
         Args:
             analysis_result: Результат анализа запроса пользователя
@@ -93,9 +95,18 @@ class SQLExpertAgent:
         Returns:
             Dictionary с SQL-запросом и его объяснением
         """
-        # Используем asyncio.to_thread для выполнения синхронного метода в отдельном потоке
-        return await asyncio.to_thread(self.generate_sql, analysis_result)
-
+        user_message = self._build_user_message(analysis_result)
+        column_query = self._column_query(analysis_result)
+        response = await self.model.generate_response_async(**self._request_kwargs(user_message, column_query=column_query))
+        result = self.model.extract_json_from_response(response)
+        
+        if not self._is_complete(result):
+            response = await self.model.generate_response_async(
+                **self._request_kwargs(user_message, retry=True, column_query=column_query)
+            )
+            result = self.model.extract_json_from_response(response)
+        
+        return self._postprocess(result, user_message)
         
     def generate_sql(self, analysis_result: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -107,76 +118,37 @@ class SQLExpertAgent:
         Returns:
             Dictionary с SQL-запросом и его объяснением
         """
-        db_info = self._prepare_db_metadata()
-        system_message = f"""
-        Ты SQL-эксперт, специализирующийся на анализе данных пользовательской активности.
-
-        Структура представления 'test_staging.user_metrics_dashboard_optimized':
-        {db_info}
-
-        ВАЖНЫЕ ПРАВИЛА:
-        1. ВСЕГДА используй ТОЛЬКО представление 'test_staging.user_metrics_dashboard_optimized' для запросов.
-        2. Никогда не используй JOIN с другими таблицами - все необходимые данные уже в представлении.
-        3. Используй следующие подходы для работы с временными данными:
-        - Группировка по неделям: DATE_TRUNC('week', cohort_month)
-        - Группировка по месяцам: DATE_TRUNC('month', cohort_month)
-        - Фильтрация по периоду: cohort_month BETWEEN '2025-01-01' AND '2025-03-31'
-        4. Для анализа по типам пользователей используй:
-        - Фильтрация по типу: WHERE user_type = 'Подписчик' ИЛИ
-        - Фильтрация по флагу: WHERE is_subscriber = 1
-        5. Оптимизируй запросы для максимальной производительности:
-        - Используй нужные агрегирующие функции (COUNT, AVG, SUM)
-        - Всегда добавляй ORDER BY для временных рядов
-        - Ограничивай выборку данных необходимыми полями
-        
-        Ответ СТРОГО в формате JSON:
-        {{
-            "sql_query": "полный SQL-запрос для выполнения",
-            "query_explanation": "подробное объяснение запроса на русском языке"
-        }}
-        """
-        
-        user_message = f"""
-        Мне нужен SQL-запрос для визуализации: {analysis_result['required_data']}
-        Тип визуализации: {analysis_result['visualization_type']}
-        Подсказки для SQL: {analysis_result['sql_hints']}
-        
-        Используй представление 'test_staging.user_metrics_dashboard_optimized' для запросов о пользователях и их активности.
-        Если запрос связан с анализом активности пользователей по времени, обязательно используй:
-        - DATE_TRUNC для правильной группировки по временным интервалам
-        - Сортировку по времени для корректного отображения тренда
-        - Фильтр по периоду, если указан конкретный диапазон дат
-        
-        ВАЖНО: Придерживайся описания и назначения каждого поля представления. Например:
-        - Для анализа количества уникальных пользователей используй COUNT(DISTINCT user_id)
-        - Для анализа активности по типам пользователей используй поле user_type
-        - Для анализа вовлеченности используй поля с метриками (total_sessions, active_days и т.д.)
-        """
+        user_message = self._build_user_message(analysis_result)
+        column_query = self._column_query(analysis_result)
         
         # Получение ответа от DeepSeek
-        response = self.model.generate_response(
-            prompt=user_message,
-            system_message=system_message,
-            temperature=0.2
-        )
+        response = self.model.generate_response(**self._request_kwargs(user_message, column_query=column_query))
         
         # Извлечение структурированных данных из ответа
         result = self.model.extract_json_from_response(response)
         
         # Проверка наличия всех необходимых полей
-        required_fields = ["sql_query", "query_explanation"]
-        if not all(field in result for field in required_fields):
-            # Если запрос не содержит всех полей, пытаемся исправить
-            system_message += "\nВажно: твой ответ должен содержать точно SQL-запрос и его объяснение в JSON формате."
+        if not self._is_complete(result):
             response = self.model.generate_response(
-                prompt=f"Сгенерируй SQL-запрос и объяснение к нему в JSON формате для: {user_message}",
-                system_message=system_message,
-                temperature=0.1
+                **self._request_kwargs(user_message, retry=True, column_query=column_query)
             )
             result = self.model.extract_json_from_response(response)
+        
+        return self._postprocess(result, user_message)
+    
+    def _postprocess(self, result: Dict[str, Any], user_message: str) -> Dict[str, Any]:
+        """
+        Дополняет ответ модели значениями по умолчанию и проверяет SQL-запрос
+        
+        Args:
+            result: JSON, извлеченный из ответа модели
+            user_message: Запрос к модели, сформированный по результату анализа
             
+        Returns:
+            Dictionary с SQL-запросом и его объяснением
+        """
         # Если все равно не получили нужные поля, создадим значения по умолчанию
-        for field in required_fields:
+        for field in self.REQUIRED_FIELDS:
             if field not in result:
                 result[field] = ""
                 
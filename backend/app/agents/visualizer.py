@@ -1,13 +1,57 @@
-from typing import Dict, Any, Optional
+import os
+from typing import Dict, Any, Optional, Tuple
 import pandas as pd
 from ..services.deepseek_adapter import DeepseekAdapter
+from ..metadata.dashboard_schema import COLUMN_DESCRIPTIONS, COLUMN_LABELS
+from ..utils.sql_projection import extract_select_columns, referenced_columns
+from ..utils.label_engine import get_label_engine
 import json
 
 class VisualizerAgent:
     """Агент для генерации визуализаций"""
     
+    # Русские названия колонок представления и типичных столбцов результата
+    COLUMN_TRANSLATIONS = COLUMN_LABELS
+    
+    # Системный промпт для подбора подписей до получения данных
+    LABELS_SYSTEM_MESSAGE = """
+        Ты подбираешь подписи для визуализаций платформы Atlantix по описанию будущих данных.
+        Данные еще не получены: известны запрос пользователя, тип визуализации и столбцы результата SQL-запроса.
+
+        Все подписи ДОЛЖНЫ быть на русском языке, краткими и отражать бизнес-смысл данных.
+        Ось X - первый столбец результата (период или категория), ось Y - основной показатель.
+
+        Ответ СТРОГО в формате JSON:
+        {
+            "title": "заголовок визуализации",
+            "description": "краткое описание визуализации",
+            "x_axis_title": "название оси X",
+            "y_axis_title": "название оси Y"
+        }
+        """
+    
     def __init__(self):
-        self.model = DeepseekAdapter()
+        self.model = DeepseekAdapter(agent="visualizer")
+        self.label_engine = get_label_engine()
+        # Минимальная уверенность подписей LabelEngine, при которой модель не вызывается
+        self.label_confidence = float(os.getenv("VISUALIZER_LABEL_CONFIDENCE", "0.7"))
+    
+    async def generate_visualization_code_async(self,
+                                                data: pd.DataFrame,
+                                                visualization_type: str,
+                                                user_query: str) -> Dict[str, Any]:
+        """
+        Асинхронная версия метода generate_visualization_code (ожидание ответа модели не занимает поток)
+        """
+        result = self._labelled_visualization(data, visualization_type, user_query)
+        if result is not None:
+            return result
+        
+        response = await self.model.generate_response_async(
+            **self._visualization_request(data, visualization_type, user_query)
+        )
+        result = self.model.extract_json_from_response(response)
+        return self._complete_visualization(result, data, visualization_type, user_query)
         
     def generate_visualization_code(self, 
                                    data: pd.DataFrame, 
@@ -24,6 +68,44 @@ class VisualizerAgent:
         Returns:
             Dictionary с кодом для визуализации и его конфигурацией
         """
+        result = self._labelled_visualization(data, visualization_type, user_query)
+        if result is not None:
+            return result
+        
+        # Получение ответа от DeepSeek
+        response = self.model.generate_response(**self._visualization_request(data, visualization_type, user_query))
+        
+        # Извлечение структурированных данных из ответа
+        result = self.model.extract_json_from_response(response)
+        return self._complete_visualization(result, data, visualization_type, user_query)
+    
+    def _labelled_visualization(self,
+                                data: pd.DataFrame,
+                                visualization_type: str,
+                                user_query: str) -> Optional[Dict[str, Any]]:
+        """
+        Строит график без вызова модели, если подписи однозначно определяются по столбцам
+        
+        Returns:
+            Dictionary с визуализацией или None, если нужна модель
+        """
+        labels = self.label_engine.label([(col, None) for col in data.columns], visualization_type)
+        if labels["confidence"] >= self.label_confidence and visualization_type in ("line", "bar"):
+            result = self._generate_fallback_visualization(data, visualization_type, user_query, self.COLUMN_TRANSLATIONS)
+            if result.get("figure_json", {}).get("data"):
+                return self._apply_labels(result, labels)
+        return None
+    
+    def _visualization_request(self,
+                               data: pd.DataFrame,
+                               visualization_type: str,
+                               user_query: str) -> Dict[str, Any]:
+        """
+        Формирует параметры запроса к модели для построения визуализации
+        
+        Returns:
+            Dictionary с аргументами generate_response
+        """
         system_message = """
         Ты визуализатор данных для платформы Atlantix, работающий с Plotly.
 
@@ -70,32 +152,8 @@ class VisualizerAgent:
         data_shape = data.shape
         columns_info = {col: str(data[col].dtype) for col in data.columns}
         
-        # Определяем русские названия для колонок (если они есть в данных)
-        column_translations = {
-            "user_id": "ID пользователя",
-            "cohort_month": "Когортный месяц",
-            "user_type": "Тип пользователя",
-            "technology_views": "Просмотры технологий",
-            "technology_sessions": "Сессии с просмотром технологий",
-            "business_plan_clicks": "Клики по бизнес-планам",
-            "custom_business_plan_views": "Просмотры кастомных бизнес-планов",
-            "discovery_views": "Просмотры страницы 'Discover'",
-            "collection_views": "Просмотры коллекций",
-            "search_queries": "Поисковые запросы",
-            "total_sessions": "Всего сессий",
-            "active_days": "Активные дни",
-            "avg_session_minutes": "Среднее время сессии (мин)",
-            "total_platform_minutes": "Всего времени на платформе (мин)",
-            "total_discover_minutes": "Всего времени на 'Discover' (мин)",
-            "minutes_to_first_tech_view": "Минут до первого просмотра технологии",
-            "minutes_to_first_favorites": "Минут до первого добавления в избранное",
-            "is_interested_user": "Заинтересованный пользователь",
-            "is_activated_user": "Активированный пользователь",
-            "is_subscriber": "Подписчик",
-            "creation_week": "Неделя",
-            "user_count": "Количество пользователей",
-            "count": "Количество"
-        }
+        # Русские названия для колонок (если они есть в данных)
+        column_translations = self.COLUMN_TRANSLATIONS
         
         # Определяем бизнес-контекст для колонок в данных
         column_contexts = {}
@@ -132,16 +190,26 @@ class VisualizerAgent:
         Используй русские названия для подписей осей и легенд, если это возможно.
         """
         
-        # Получение ответа от DeepSeek
-        response = self.model.generate_response(
-            prompt=user_message,
-            system_message=system_message,
-            temperature=0.3,
-            max_tokens=3000
-        )
+        return {
+            "prompt": user_message,
+            "system_message": system_message,
+            "temperature": 0.3,
+            "max_tokens": 3000,
+            "json_mode": True
+        }
+    
+    def _complete_visualization(self,
+                                result: Dict[str, Any],
+                                data: pd.DataFrame,
+                                visualization_type: str,
+                                user_query: str) -> Dict[str, Any]:
+        """
+        Дополняет ответ модели резервной визуализацией и проверяет язык заголовка
         
-        # Извлечение структурированных данных из ответа
-        result = self.model.extract_json_from_response(response)
+        Returns:
+            Dictionary с кодом для визуализации и его конфигурацией
+        """
+        column_translations = self.COLUMN_TRANSLATIONS
         
         # Проверка наличия всех необходимых полей
         required_fields = ["plotly_code", "figure_json", "title", "description"]
@@ -163,6 +231,146 @@ class VisualizerAgent:
         
         return result
     
+    async def generate_labels_async(self,
+                                    analysis: Dict[str, Any],
+                                    sql_query: str,
+                                    user_query: str) -> Dict[str, Any]:
+        """
+        Асинхронная версия метода generate_labels (ожидание ответа модели не занимает поток)
+        """
+        labels, request = self._labels_request(analysis, sql_query, user_query)
+        if request is None:
+            return labels
+        
+        response = await self.model.generate_response_async(**request)
+        return self._complete_labels(self.model.extract_json_from_response(response), labels, user_query)
+    
+    def generate_labels(self,
+                        analysis: Dict[str, Any],
+                        sql_query: str,
+                        user_query: str) -> Dict[str, Any]:
+        """
+        Подбирает заголовок, описание и подписи осей до выполнения SQL-запроса
+        (по результату анализа, столбцам SQL-запроса и описаниям колонок),
+        чтобы вызов модели выполнялся одновременно с запросом к базе данных
+        
+        Args:
+            analysis: Результат анализа запроса пользователя
+            sql_query: Сгенерированный SQL-запрос
+            user_query: Исходный запрос пользователя
+            
+        Returns:
+            Dictionary с полями title, description, x_axis_title и y_axis_title
+        """
+        labels, request = self._labels_request(analysis, sql_query, user_query)
+        if request is None:
+            return labels
+        
+        response = self.model.generate_response(**request)
+        return self._complete_labels(self.model.extract_json_from_response(response), labels, user_query)
+    
+    def _labels_request(self,
+                        analysis: Dict[str, Any],
+                        sql_query: str,
+                        user_query: str) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Подбирает подписи по столбцам SQL-запроса и при низкой уверенности
+        формирует параметры запроса к модели
+        
+        Returns:
+            Кортеж (подписи LabelEngine, аргументы generate_response или None, если модель не нужна)
+        """
+        columns = extract_select_columns(sql_query)
+        
+        # Подписи по словарю колонок; модель вызывается только при низкой уверенности
+        labels = self.label_engine.label(columns, analysis.get('visualization_type', ''))
+        confidence = labels.pop("confidence")
+        if confidence >= self.label_confidence:
+            return labels, None
+        
+        columns_info = []
+        for name, expression in columns:
+            column_info = f"- {name}: {expression}"
+            if name in self.COLUMN_TRANSLATIONS:
+                column_info += f" ({self.COLUMN_TRANSLATIONS[name]})"
+            for source in referenced_columns(expression, COLUMN_DESCRIPTIONS):
+                if source != name:
+                    column_info += f"; {source} - {self.COLUMN_TRANSLATIONS.get(source, source)}"
+            columns_info.append(column_info)
+        columns_text = "\n        ".join(columns_info)
+        
+        user_message = f"""
+        Запрос пользователя: {user_query}
+        Тип визуализации: {analysis.get('visualization_type', '')}
+        Требуемые данные: {analysis.get('required_data', '')}
+        
+        Столбцы результата (имя: выражение):
+        {columns_text}
+        """
+        
+        return labels, {
+            "prompt": user_message,
+            "system_message": self.LABELS_SYSTEM_MESSAGE,
+            "temperature": 0.3,
+            "max_tokens": 500,
+            "json_mode": True
+        }
+    
+    def _complete_labels(self,
+                         extracted: Dict[str, Any],
+                         labels: Dict[str, Any],
+                         user_query: str) -> Dict[str, Any]:
+        """
+        Проверяет подписи из ответа модели и дополняет недостающие подписями LabelEngine
+        
+        Returns:
+            Dictionary с полями title, description, x_axis_title и y_axis_title
+        """
+        
+        result = {}
+        for field in ("title", "description", "x_axis_title", "y_axis_title"):
+            value = extracted.get(field)
+            if isinstance(value, str) and value.strip():
+                result[field] = value.strip()
+        
+        # Убедимся, что заголовок визуализации на русском
+        if "title" in result and not any(char in result["title"] for char in 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'):
+            translated_title = self._translate_title(result["title"], user_query)
+            if translated_title:
+                result["title"] = translated_title
+        
+        # Недостающие подписи дополняем подобранными по столбцам
+        for field, value in labels.items():
+            if field not in result and value:
+                result[field] = value
+        
+        return result
+    
+    @staticmethod
+    def _apply_labels(result: Dict[str, Any], labels: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Заменяет подписи визуализации и ее фигуры на подобранные LabelEngine
+        
+        Args:
+            result: Результат построения визуализации
+            labels: Подписи из LabelEngine.label
+            
+        Returns:
+            Результат с обновленными подписями
+        """
+        for field in ("title", "description", "x_axis_title", "y_axis_title"):
+            if labels.get(field):
+                result[field] = labels[field]
+        
+        layout = result.get("figure_json", {}).get("layout")
+        if isinstance(layout, dict):
+            layout["title"] = {**(layout.get("title") or {}), "text": result["title"]}
+            for axis, field in (("xaxis", "x_axis_title"), ("yaxis", "y_axis_title")):
+                if result.get(field):
+                    layout[axis] = layout.get(axis) or {}
+                    layout[axis]["title"] = {**(layout[axis].get("title") or {}), "text": result[field]}
+        return result
+    
     def _translate_title(self, title: str, user_query: str) -> Optional[str]:
         """
         Пытается перевести заголовок на русский язык, если он на английском
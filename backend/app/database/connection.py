@@ -0,0 +1,375 @@
+import os
+import time
+import asyncio
+import threading
+import importlib.util
+from collections import deque
+from typing import Dict, Any, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+# Профили пулов соединений: "interactive" - запросы /analyze (короткие аналитические
+# запросы, много параллельных пользователей), "admin" - метаданные и /execute-sql.
+# size + max_overflow - бюджет соединений профиля на процесс: при асинхронном выполнении
+# (asyncpg) он делится между пулом SQLAlchemy (доля sync_share) и пулом asyncpg.
+# Любой параметр переопределяется переменной окружения DB_POOL_<ПРОФИЛЬ>_<ПАРАМЕТР>,
+# например DB_POOL_INTERACTIVE_SIZE=20 или DB_POOL_ADMIN_STATEMENT_TIMEOUT_MS=600000
+POOL_PROFILES: Dict[str, Dict[str, Any]] = {
+    "interactive": {
+        "size": 10,
+        "max_overflow": 20,
+        # Запросы /analyze выполняются через asyncpg, в потоках - только резервный путь
+        "sync_share": 0.25,
+        "timeout": 10.0,
+        "recycle": 1800,
+        "pre_ping": True,
+        "statement_timeout_ms": 30000,
+        "work_mem": "64MB",
+        "jit": "off"
+    },
+    "admin": {
+        "size": 2,
+        "max_overflow": 3,
+        # Метаданные и водяные знаки кэша читаются синхронно
+        "sync_share": 0.4,
+        "timeout": 30.0,
+        "recycle": 1800,
+        "pre_ping": True,
+        "statement_timeout_ms": 120000,
+        "work_mem": "16MB",
+        "jit": "off"
+    }
+}
+
+# Сколько последних ожиданий хранить для перцентилей
+_WAIT_SAMPLES = 1024
+
+
+def get_database_url() -> str:
+    """Формирует URL базы данных PostgreSQL из переменных окружения"""
+    return (
+        f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@"
+        f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    )
+
+
+def get_pool_profile(name: str) -> Dict[str, Any]:
+    """
+    Возвращает параметры профиля пула с учетом переменных окружения
+
+    Args:
+        name: Имя профиля ("interactive" или "admin")
+
+    Returns:
+        Dictionary с параметрами пула и настройками сессии
+    """
+    if name not in POOL_PROFILES:
+        raise Exception(f"Неизвестный профиль пула соединений: {name}")
+
+    profile = dict(POOL_PROFILES[name])
+    for key, default in POOL_PROFILES[name].items():
+        value = os.getenv(f"DB_POOL_{name.upper()}_{key.upper()}")
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            profile[key] = value.lower() in ("1", "true", "yes")
+        elif isinstance(default, (int, float)):
+            profile[key] = type(default)(value)
+        else:
+            profile[key] = value
+    return profile
+
+
+class PoolMetrics:
+    """Счетчики ожидания свободного соединения в пуле"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=_WAIT_SAMPLES)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self._waits.append(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            attempts = self.checkouts + self.timeouts
+
+        def percentile(q: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 2)
+
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.wait_total / attempts * 1000, 2) if attempts else 0.0,
+            "p50_wait_ms": percentile(0.5),
+            "p95_wait_ms": percentile(0.95),
+            "max_wait_ms": round(self.wait_max * 1000, 2)
+        }
+
+
+def _metered_pool_class(metrics: PoolMetrics) -> type:
+    """
+    Создает подкласс QueuePool, измеряющий ожидание соединения. Класс (а не экземпляр)
+    хранит счетчики, поэтому они сохраняются при пересоздании пула в engine.dispose()
+    """
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            connection = QueuePool._do_get(self)
+        except PoolTimeoutError:
+            metrics.record(time.monotonic() - started, timed_out=True)
+            raise
+        metrics.record(time.monotonic() - started)
+        return connection
+
+    return type(f"MeteredQueuePool_{metrics.name}", (QueuePool,), {"_do_get": _do_get})
+
+
+def split_pool_budget(profile: Dict[str, Any], async_enabled: bool) -> Dict[str, int]:
+    """
+    Делит бюджет соединений профиля (size + max_overflow) между пулом SQLAlchemy
+    и пулом asyncpg, чтобы вместе они не открывали больше соединений, чем задано
+
+    Args:
+        profile: Параметры профиля пула
+        async_enabled: Будет ли для профиля создаваться пул asyncpg
+
+    Returns:
+        Dictionary с полями size и max_overflow пула SQLAlchemy и async_max_size пула asyncpg
+    """
+    total = profile["size"] + profile["max_overflow"]
+    if not async_enabled or total < 2:
+        return {"size": profile["size"], "max_overflow": profile["max_overflow"], "async_max_size": 0}
+    sync_total = min(total - 1, max(1, round(total * profile["sync_share"])))
+    sync_size = min(profile["size"], sync_total)
+    return {"size": sync_size, "max_overflow": sync_total - sync_size, "async_max_size": total - sync_total}
+
+
+def _session_options(profile: Dict[str, Any]) -> str:
+    """Параметры сессии PostgreSQL, передаваемые при подключении (без отдельных SET)"""
+    settings = {
+        "statement_timeout": profile["statement_timeout_ms"],
+        "work_mem": profile["work_mem"],
+        "jit": profile["jit"]
+    }
+    return " ".join(f"-c {key}={value}" for key, value in settings.items() if value not in (None, ""))
+
+
+# Созданные движки, счетчики и бюджеты соединений пулов по именам профилей
+_engines: Dict[str, Any] = {}
+_pool_metrics: Dict[str, PoolMetrics] = {}
+_pool_budgets: Dict[str, Dict[str, int]] = {}
+_engines_lock = threading.Lock()
+
+
+def create_pool_engine(name: str = "interactive", url: Optional[str] = None):
+    """
+    Создает движок SQLAlchemy с пулом соединений по профилю
+
+    Args:
+        name: Имя профиля пула ("interactive" или "admin")
+        url: URL базы данных (по умолчанию из переменных окружения)
+
+    Returns:
+        Движок SQLAlchemy
+    """
+    profile = get_pool_profile(name)
+    url = url or get_database_url()
+
+    metrics = _pool_metrics.get(name)
+    if metrics is None:
+        metrics = _pool_metrics[name] = PoolMetrics(name)
+
+    budget = split_pool_budget(profile, url.startswith("postgresql") and async_driver_enabled())
+
+    connect_args = {}
+    if url.startswith("postgresql"):
+        connect_args = {
+            "options": _session_options(profile),
+            "application_name": f"data_agent_{name}"
+        }
+
+    engine = create_engine(
+        url,
+        poolclass=_metered_pool_class(metrics),
+        pool_size=budget["size"],
+        max_overflow=budget["max_overflow"],
+        pool_timeout=profile["timeout"],
+        pool_recycle=profile["recycle"],
+        pool_pre_ping=profile["pre_ping"],
+        # Последнее возвращенное соединение выдается первым: при спаде нагрузки
+        # лишние соединения простаивают и закрываются по pool_recycle
+        pool_use_lifo=True,
+        connect_args=connect_args
+    )
+    with _engines_lock:
+        _engines[name] = engine
+        _pool_budgets[name] = budget
+    return engine
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Возвращает состояние пулов соединений и время ожидания соединения
+
+    Returns:
+        Dictionary по именам профилей
+    """
+    with _engines_lock:
+        engines = dict(_engines)
+    stats = {}
+    for name, metrics in _pool_metrics.items():
+        entry = metrics.stats()
+        engine = engines.get(name)
+        if engine is not None:
+            pool = engine.pool
+            entry.update({
+                "async_max_size": _pool_budgets.get(name, {}).get("async_max_size", 0),
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "idle": pool.checkedin()
+            })
+        stats[name] = entry
+    return stats
+
+
+def dispose_engines():
+    """Закрывает соединения всех созданных пулов"""
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.dispose()
+
+
+# Асинхронные пулы asyncpg по именам профилей: (цикл событий, пул)
+_async_pools: Dict[str, Any] = {}
+
+
+def async_driver_enabled() -> bool:
+    """
+    Проверяет, включено ли асинхронное выполнение запросов и установлен ли asyncpg
+
+    Returns:
+        True, если запросы можно выполнять через asyncpg
+    """
+    if os.getenv("DB_ASYNC_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return False
+    # asyncpg - необязательная зависимость: без нее запросы выполняются в потоках
+    return importlib.util.find_spec("asyncpg") is not None
+
+
+def engine_profile(engine) -> Optional[str]:
+    """Возвращает имя профиля, по которому создан движок (None - движок создан не здесь)"""
+    with _engines_lock:
+        for name, candidate in _engines.items():
+            if candidate is engine:
+                return name
+    return None
+
+
+async def get_async_pool(engine):
+    """
+    Возвращает асинхронный пул asyncpg для той же базы и профиля, что и движок
+
+    Пул создается при первом обращении в текущем цикле событий с долей бюджета соединений
+    профиля, оставшейся после пула движка (split_pool_budget), и настройками сессии профиля;
+    ожидание соединения учитывается в тех же счетчиках, что и для движка.
+
+    Args:
+        engine: Движок SQLAlchemy, созданный create_pool_engine
+
+    Returns:
+        Пул asyncpg или None, если асинхронное выполнение недоступно
+        (asyncpg не установлен, база не PostgreSQL или движок создан не через create_pool_engine)
+    """
+    name = engine_profile(engine)
+    if name is None or engine.url.get_backend_name() != "postgresql" or not async_driver_enabled():
+        return None
+    max_size = _pool_budgets.get(name, {}).get("async_max_size", 0)
+    if not max_size:
+        # Движок создан без доли бюджета для asyncpg (например, до установки DB_ASYNC_ENABLED)
+        return None
+
+    loop = asyncio.get_running_loop()
+    entry = _async_pools.get(name)
+    if entry is not None and entry[0] is loop:
+        return entry[1]
+
+    import asyncpg
+
+    profile = get_pool_profile(name)
+    settings = {
+        "statement_timeout": str(profile["statement_timeout_ms"]),
+        "work_mem": profile["work_mem"],
+        "jit": profile["jit"],
+        "application_name": f"data_agent_{name}_async"
+    }
+    url = engine.url.set(drivername="postgresql")
+    pool = await asyncpg.create_pool(
+        dsn=url.render_as_string(hide_password=False),
+        min_size=1,
+        max_size=max_size,
+        max_inactive_connection_lifetime=profile["recycle"],
+        server_settings={key: value for key, value in settings.items() if value not in (None, "")}
+    )
+    # Пул мог быть создан параллельно другой задачей - оставляем первый
+    entry = _async_pools.get(name)
+    if entry is not None and entry[0] is loop:
+        await pool.close()
+        return entry[1]
+    _async_pools[name] = (loop, pool)
+    return pool
+
+
+async def acquire_async_connection(engine, pool):
+    """
+    Берет соединение из асинхронного пула с учетом времени ожидания профиля
+
+    Args:
+        engine: Движок SQLAlchemy, по профилю которого создан пул
+        pool: Пул asyncpg из get_async_pool
+
+    Returns:
+        Соединение asyncpg (вернуть в пул через pool.release)
+    """
+    name = engine_profile(engine)
+    metrics = _pool_metrics.get(name)
+    started = time.monotonic()
+    try:
+        connection = await pool.acquire(timeout=get_pool_profile(name)["timeout"])
+    except asyncio.TimeoutError:
+        if metrics is not None:
+            metrics.record(time.monotonic() - started, timed_out=True)
+        raise
+    if metrics is not None:
+        metrics.record(time.monotonic() - started)
+    return connection
+
+
+async def close_async_pools():
+    """Закрывает асинхронные пулы (в том цикле событий, где они созданы)"""
+    loop = asyncio.get_running_loop()
+    for name, (pool_loop, pool) in list(_async_pools.items()):
+        if pool_loop is loop:
+            await pool.close()
+        del _async_pools[name]
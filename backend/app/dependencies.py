@@ -1,8 +1,9 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import os
+import threading
 import psycopg2
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from .database.connection import create_pool_engine
 from .tools.db_tool import DatabaseTool
 from .agents.analyzer import AnalyzerAgent
 from .agents.sql_expert import SQLExpertAgent
@@ -13,12 +14,14 @@ from .services.data_analysis_service import DataAnalysisService
 from .services.dashboard_service import DashboardService
 
 # Создание соединения с базой данных
-def get_db_connection():
-    """Создает соединение с базой данных PostgreSQL"""
-    return create_engine(
-        f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@"
-        f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-    )
+def get_db_connection(pool: str = "interactive"):
+    """
+    Создает движок базы данных PostgreSQL с пулом соединений
+
+    Args:
+        pool: Профиль пула ("interactive" - запросы анализа, "admin" - метаданные и /execute-sql)
+    """
+    return create_pool_engine(pool)
 
 # Обновленное описание представления user_metrics_dashboard_optimized
 USER_METRICS_DASHBOARD_DESCRIPTION = """
@@ -60,10 +63,15 @@ USER_METRICS_DASHBOARD_DESCRIPTION = """
 """
 
 # Получение метаданных базы данных при запуске приложения
-def get_db_metadata() -> Dict[str, Any]:
-    """Получает и кэширует метаданные базы данных"""
+def get_db_metadata(engine=None) -> Dict[str, Any]:
+    """
+    Получает метаданные базы данных
+
+    Args:
+        engine: Движок SQLAlchemy (по умолчанию создается новый)
+    """
     # Создание экземпляра DatabaseTool
-    db_tool = DatabaseTool(get_db_connection())
+    db_tool = DatabaseTool(engine if engine is not None else get_db_connection())
     
     # Получение метаданных
     metadata = db_tool.get_metadata()
@@ -135,49 +143,120 @@ def get_db_metadata() -> Dict[str, Any]:
 # Глобальная переменная для хранения метаданных
 DB_METADATA = None
 
+
+class ServiceContainer:
+    """
+    Общие ресурсы процесса: движки БД с пулами соединений ("interactive" для анализа,
+    "admin" для метаданных и /execute-sql), метаданные, адаптер DeepSeek, агенты и сервисы. Создаются один раз при запуске приложения (lifespan в main.py)
+    и используются всеми запросами, поэтому пул соединений и кэши сервисов
+    сохраняются между запросами.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.admin_engine = None
+        self.db_metadata: Optional[Dict[str, Any]] = None
+        self.deepseek_adapter: Optional[DeepseekAdapter] = None
+        self.db_tool: Optional[DatabaseTool] = None
+        self.dashboard_service: Optional[DashboardService] = None
+        self.data_analysis_service: Optional[DataAnalysisService] = None
+
+    @property
+    def started(self) -> bool:
+        return self.engine is not None
+
+    def start(self):
+        """Создает движок БД, загружает метаданные и собирает сервисы и агентов"""
+        global DB_METADATA
+        engine = get_db_connection("interactive")
+        admin_engine = get_db_connection("admin")
+        try:
+            self.db_metadata = get_db_metadata(admin_engine)
+            self.deepseek_adapter = DeepseekAdapter()
+            self.db_tool = DatabaseTool(admin_engine)
+            self.data_analysis_service = DataAnalysisService(
+                engine, self.deepseek_adapter, db_metadata=self.db_metadata
+            )
+            # Тот же экземпляр, что использует анализ: выученные шаблоны выполняются через SQLGuard
+            self.dashboard_service = self.data_analysis_service.dashboard_service
+            self.data_analysis_service._ensure_agents_initialized(self.db_metadata)
+        except Exception:
+            engine.dispose()
+            admin_engine.dispose()
+            raise
+        self.engine = engine
+        self.admin_engine = admin_engine
+        DB_METADATA = self.db_metadata
+
+    def shutdown(self):
+        """Закрывает соединения пулов БД и освобождает сервисы"""
+        for engine in (self.engine, self.admin_engine):
+            if engine is not None:
+                engine.dispose()
+        self.engine = None
+        self.admin_engine = None
+        self.db_metadata = None
+        self.deepseek_adapter = None
+        self.db_tool = None
+        self.dashboard_service = None
+        self.data_analysis_service = None
+
+
+# Общий контейнер процесса
+_container = ServiceContainer()
+_container_lock = threading.Lock()
+
+
+def get_container() -> ServiceContainer:
+    """
+    Возвращает общий контейнер сервисов; если приложение запущено без lifespan
+    (скрипты, консоль), контейнер собирается при первом обращении
+    """
+    if not _container.started:
+        with _container_lock:
+            if not _container.started:
+                _container.start()
+    return _container
+
+
+def shutdown_container():
+    """Освобождает ресурсы общего контейнера при остановке приложения"""
+    with _container_lock:
+        _container.shutdown()
+
+
 # Функция для инициализации метаданных
 def initialize_metadata():
     """Инициализирует метаданные базы данных"""
     global DB_METADATA
-    DB_METADATA = get_db_metadata()
+    DB_METADATA = get_container().db_metadata
 
 # Зависимости для инъекции в эндпоинты
 def get_db():
-    """Предоставляет инструмент для работы с базой данных"""
-    db_connection = get_db_connection()
-    db_tool = DatabaseTool(db_connection)
-    return db_tool
+    """Предоставляет инструмент для работы с базой данных (пул "admin")"""
+    return get_container().db_tool
 
 def get_analyzer_agent():
     """Предоставляет агента для анализа запросов"""
-    global DB_METADATA
-    if DB_METADATA is None:
-        initialize_metadata()
-    return AnalyzerAgent(DB_METADATA)
+    return get_container().data_analysis_service.analyzer_agent
 
 def get_sql_agent():
     """Предоставляет агента для генерации SQL-запросов"""
-    global DB_METADATA
-    if DB_METADATA is None:
-        initialize_metadata()
-    return SQLExpertAgent(DB_METADATA)
+    return get_container().data_analysis_service.sql_agent
 
 def get_viz_agent():
     """Предоставляет агента для генерации визуализаций"""
-    return VisualizerAgent()
+    return get_container().data_analysis_service.viz_agent
 
 # Новые зависимости для оптимизированных сервисов
 def get_deepseek_adapter():
     """Предоставляет адаптер для работы с DeepSeek API"""
-    return DeepseekAdapter()
+    return get_container().deepseek_adapter
 
 def get_dashboard_service():
     """Предоставляет сервис для работы с представлением dashboard"""
-    db_connection = get_db_connection()
-    return DashboardService(db_connection)
+    return get_container().dashboard_service
 
 def get_data_analysis_service():
     """Предоставляет сервис для анализа данных и генерации визуализаций"""
-    db_connection = get_db_connection()
-    deepseek_adapter = get_deepseek_adapter()
-    return DataAnalysisService(db_connection, deepseek_adapter)
\ No newline at end of file
+    return get_container().data_analysis_service
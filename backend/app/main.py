@@ -1,17 +1,42 @@
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from .dependencies import get_db, get_analyzer_agent, get_sql_agent, get_viz_agent, initialize_metadata, get_data_analysis_service
+from .dependencies import get_container, shutdown_container
 from .routers import api
 from .schemas.requests import QueryRequest
 from .services.auth import configure_auth_router, get_current_active_user, User
+from .services.http_client import init_http_client, close_http_client
+from .database.connection import close_async_pools
+
+# Общие ресурсы создаются при запуске приложения и освобождаются при остановке
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Движок БД, метаданные, агенты и сервисы - один раз на процесс
+    # (загрузка метаданных блокирует, поэтому выполняется в отдельном потоке)
+    await asyncio.to_thread(get_container)
+    print("✅ Метаданные представления успешно инициализированы")
+    
+    # Создаем общий пул соединений с DeepSeek и прогреваем его
+    warmed = await init_http_client()
+    print(f"✅ Пул соединений DeepSeek инициализирован (прогрето соединений: {warmed})")
+    
+    try:
+        yield
+    finally:
+        await close_http_client()
+        await close_async_pools()
+        shutdown_container()
+        print("✅ Соединения с БД и DeepSeek закрыты")
 
 # Инициализация приложения FastAPI
 app = FastAPI(
     title="Atlantix Data Agent API",
     description="API для анализа пользовательской активности с использованием ИИ",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Добавление сжатия ответов
@@ -56,12 +81,6 @@ async def health_check():
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
 
-# Инициализация метаданных при запуске приложения
-@app.on_event("startup")
-async def startup_event():
-    initialize_metadata()
-    print("✅ Метаданные представления успешно инициализированы")
-
 # Запуск приложения
 if __name__ == "__main__":
     import uvicorn
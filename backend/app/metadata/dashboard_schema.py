@@ -201,6 +201,55 @@ COLUMN_DESCRIPTIONS = {
     }
 }
 
+# Русские названия колонок представления и типичных столбцов результата запросов
+# (подписи осей, легенд и заголовков визуализаций)
+COLUMN_LABELS = {
+    "user_id": "ID пользователя",
+    "cohort_month": "Когортный месяц",
+    "user_type": "Тип пользователя",
+    "technology_views": "Просмотры технологий",
+    "technology_sessions": "Сессии с просмотром технологий",
+    "business_plan_clicks": "Клики по бизнес-планам",
+    "custom_business_plan_views": "Просмотры кастомных бизнес-планов",
+    "discovery_views": "Просмотры страницы 'Discover'",
+    "collection_views": "Просмотры коллекций",
+    "search_queries": "Поисковые запросы",
+    "total_sessions": "Всего сессий",
+    "active_days": "Активные дни",
+    "avg_session_minutes": "Среднее время сессии (мин)",
+    "total_platform_minutes": "Всего времени на платформе (мин)",
+    "total_discover_minutes": "Всего времени на 'Discover' (мин)",
+    "minutes_to_first_tech_view": "Минут до первого просмотра технологии",
+    "minutes_to_first_favorites": "Минут до первого добавления в избранное",
+    "is_interested_user": "Заинтересованный пользователь",
+    "is_activated_user": "Активированный пользователь",
+    "is_subscriber": "Подписчик",
+    "creation_week": "Неделя",
+    "user_count": "Количество пользователей",
+    "count": "Количество",
+    "month": "Месяц",
+    "week": "Неделя",
+    "day": "День",
+    "quarter": "Квартал",
+    "year": "Год",
+    "time_period": "Период",
+    "period": "Период",
+    "date": "Дата",
+    "active_users": "Активные пользователи",
+    "users": "Пользователи",
+    "subscribers": "Подписчики",
+    "avg_time": "Среднее время сессии (мин)",
+    "avg_sessions": "Среднее количество сессий",
+    "avg_active_days": "Среднее количество активных дней",
+    "avg_session_time": "Среднее время сессии (мин)",
+    "average_value": "Среднее значение",
+    "avg_discover_minutes_per_session": "Среднее время на 'Discover' за сессию (мин)",
+    "avg_discover_minutes_per_month": "Среднее время на 'Discover' в месяц (мин)",
+    "avg_tech_views_per_session": "Просмотры технологий за сессию",
+    "avg_business_plan_clicks_per_session": "Просмотры бизнес-планов за сессию",
+    "avg_search_queries_per_session": "Поисковые запросы за сессию"
+}
+
 # Описание представления для использования в промптах
 VIEW_DESCRIPTION = """
 Представление test_staging.user_metrics_dashboard_optimized содержит детальную информацию о пользовательской активности на платформе Atlantix (https://platform.atlantix.cc). 
@@ -220,7 +269,12 @@ COMMON_QUERIES = [
             ORDER BY month
         """,
         "visualization_type": "line",
-        "keywords": ["активные пользователи", "месяц", "динамика", "количество"]
+        "keywords": ["активные пользователи", "месяц", "динамика", "количество"],
+        "examples": [
+            "Покажи количество активных пользователей по месяцам",
+            "Динамика активных пользователей помесячно",
+            "Сколько активных пользователей было каждый месяц"
+        ]
     },
     {
         "name": "Распределение пользователей по типам",
@@ -232,7 +286,12 @@ COMMON_QUERIES = [
             ORDER BY user_count DESC
         """,
         "visualization_type": "pie",
-        "keywords": ["тип", "пользователи", "распределение", "доля"]
+        "keywords": ["тип", "пользователи", "распределение", "доля"],
+        "examples": [
+            "Распределение пользователей по типам",
+            "Доля подписчиков, активированных и заинтересованных пользователей",
+            "Сколько пользователей каждого типа"
+        ]
     },
     {
         "name": "Среднее время сессии по месяцам",
@@ -245,7 +304,12 @@ COMMON_QUERIES = [
             ORDER BY month
         """,
         "visualization_type": "line",
-        "keywords": ["время", "сессия", "средний", "минут"]
+        "keywords": ["время", "сессия", "средний", "минут"],
+        "examples": [
+            "Среднее время сессии по месяцам",
+            "Средняя продолжительность сессии в минутах помесячно",
+            "Сколько минут в среднем длится сессия"
+        ]
     },
     {
         "name": "Вовлеченность по типам пользователей",
@@ -260,7 +324,11 @@ COMMON_QUERIES = [
             ORDER BY user_type
         """,
         "visualization_type": "bar",
-        "keywords": ["вовлеченность", "сравнение", "тип пользователей"]
+        "keywords": ["вовлеченность", "сравнение", "тип пользователей"],
+        "examples": [
+            "Сравнение вовлеченности по типам пользователей",
+            "Среднее количество сессий и активных дней по типам пользователей"
+        ]
     }
 ]
 
@@ -294,19 +362,5 @@ USER_METRICS_DASHBOARD_SCHEMA = {
         {"name": "active_days", "type": "bigint", "nullable": True, 
          "description": "Количество уникальных дней, в которые пользователь был активен"},
     ],
-    "common_queries": [
-        {
-            "name": "Активные пользователи по месяцам",
-            "sql": """
-                SELECT DATE_TRUNC('month', cohort_month) AS month,
-                       COUNT(DISTINCT user_id) AS active_users
-                FROM test_staging.user_metrics_dashboard_optimized
-                WHERE cohort_month BETWEEN '{start_date}' AND '{end_date}'
-                GROUP BY month
-                ORDER BY month
-            """,
-            "visualization_type": "line",
-            "keywords": ["активные пользователи", "месяц", "динамика"]
-        },
-    ]
-}
\ No newline at end of file
+    "common_queries": COMMON_QUERIES
+}
@@ -1,11 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Dict, Any, Optional
-from ..dependencies import get_db, get_analyzer_agent, get_sql_agent, get_viz_agent, DB_METADATA
+from ..dependencies import get_db, get_container
 from ..schemas.requests import QueryRequest, MetadataRequest, SQLRequest
 from ..schemas.responses import QueryResponse, MetadataResponse
 from ..schemas.pagination import PaginationParams, paginate
 from ..dependencies import get_data_analysis_service
-from ..services.data_analysis_service import DataAnalysisService
+from ..services.data_analysis_service import DataAnalysisService, get_analysis_cache
+from ..services.deepseek_adapter import DeepseekAdapter
+from ..services.template_store import get_template_store
+from ..agents.prompts import get_prompt_cache
+from ..database.connection import get_pool_stats
+from ..services.sql_cache import get_sql_result_cache
 
 router = APIRouter()
 
@@ -56,19 +61,41 @@ async def get_metadata(
     Returns:
         Метаданные таблиц
     """
-    global DB_METADATA
+    db_metadata = get_container().db_metadata
     
-    if DB_METADATA is None:
+    if db_metadata is None:
         raise HTTPException(status_code=500, detail="Метаданные базы данных не инициализированы")
     
     # Если указано имя таблицы, возвращаем только её метаданные
     if table_name:
-        if table_name in DB_METADATA:
-            return {"tables": {table_name: DB_METADATA[table_name]}}
+        if table_name in db_metadata:
+            return {"tables": {table_name: db_metadata[table_name]}}
         else:
             raise HTTPException(status_code=404, detail=f"Таблица {table_name} не найдена")
     
-    return {"tables": DB_METADATA}
+    return {"tables": db_metadata}
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Возвращает внутренние метрики сервиса
+    
+    Returns:
+        Статистика кэшей (результатов анализа и SQL), вызовов DeepSeek, размеров промптов
+        агентов, выученных шаблонов, пулов соединений с БД и проверки стоимости SQL
+    """
+    template_store = get_template_store()
+    sql_cache = get_sql_result_cache()
+    sql_guard = get_container().data_analysis_service.sql_guard
+    return {
+        "llm": DeepseekAdapter.get_stats(),
+        "analysis_cache": get_analysis_cache().stats(),
+        "prompts": get_prompt_cache().stats(),
+        "learned_templates": template_store.stats() if template_store else None,
+        "db_pools": get_pool_stats(),
+        "sql_cache": sql_cache.stats() if sql_cache else None,
+        "sql_guard": sql_guard.stats() if sql_guard else None
+    }
 
 @router.post("/execute-sql")
 async def execute_sql(
@@ -87,7 +114,8 @@ async def execute_sql(
     Returns:
         Результаты выполнения SQL-запроса
     """
-    result = db.execute_query(request.sql_query)
+    # Произвольные запросы не кэшируются: водяной знак отслеживает только данные представления
+    result = await db.execute_query_async(request.sql_query, use_cache=False)
     
     if not result["success"]:
         raise HTTPException(status_code=500, detail=result["error"])
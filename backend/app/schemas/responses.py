@@ -36,6 +36,9 @@ class QueryResponse(BaseModel):
     title: str = Field(..., description="Заголовок результатов")
     description: str = Field(..., description="Описание результатов")
     pagination: Optional[Dict[str, Any]] = Field(None, description="Информация о пагинации")
+    performance: Optional[Dict[str, Any]] = Field(None, description="Время обработки и расход токенов/задержки вызовов LLM")
+    degraded: bool = Field(False, description="Ответ получен без LLM по типовым шаблонам (DeepSeek недоступен)")
+    cost_estimate: Optional[Dict[str, Any]] = Field(None, description="Оценка стоимости плана SQL-запроса (EXPLAIN) и добавленный LIMIT")
     
     class Config:
         schema_extra = {
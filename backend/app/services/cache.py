@@ -0,0 +1,696 @@
+import os
+import json
+import sys
+import asyncio
+import sqlite3
+import time
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Iterable, List
+
+try:
+    import redis
+except ImportError:  # Redis - необязательная зависимость
+    redis = None
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Оценивает объем значения в байтах для учета бюджета кэша
+
+    Args:
+        value: Значение для оценки
+
+    Returns:
+        Приблизительный размер в байтах
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением по количеству записей,
+    суммарному объему и времени жизни записей (TTL)
+    """
+
+    def __init__(self,
+                 max_entries: int = 1000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl: Optional[float] = 3600,
+                 size_fn: Optional[Callable[[Any], int]] = None):
+        """
+        Args:
+            max_entries: Максимальное количество записей
+            max_bytes: Максимальный суммарный объем значений в байтах
+            ttl: Время жизни записи в секундах (None - без ограничения)
+            size_fn: Функция оценки размера значения
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._size_fn = size_fn or estimate_size
+
+        # key -> (value, size, expires_at)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Счетчики для наблюдаемости
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Возвращает значение из кэша и отмечает его как недавно использованное
+
+        Args:
+            key: Ключ записи
+            default: Значение, возвращаемое при промахе
+
+        Returns:
+            Закэшированное значение или default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                # Запись устарела - удаляем и считаем промахом
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        Сохраняет значение в кэш с вытеснением самых старых записей
+
+        Args:
+            key: Ключ записи
+            value: Значение для сохранения
+            ttl: Время жизни записи (по умолчанию - ttl кэша)
+        """
+        size = self._size_fn(value)
+        # Значение больше всего бюджета кэшировать бессмысленно
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+
+            while self._data and (
+                (self.max_entries and len(self._data) > self.max_entries) or
+                (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                oldest_key = next(iter(self._data))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Возвращает найденные в кэше значения для набора ключей"""
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        """Сохраняет несколько значений в кэш"""
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    async def get_async(self, key: str, default: Any = None) -> Any:
+        """Версия get для асинхронного кода (кэш в памяти не блокирует цикл событий)"""
+        return self.get(key, default)
+
+    async def set_async(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Версия set для асинхронного кода"""
+        self.set(key, value, ttl)
+
+    def delete(self, key: str):
+        """Удаляет запись из кэша"""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        """Очищает кэш (счетчики сохраняются)"""
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str):
+        """Удаляет запись без блокировки (вызывается под self._lock)"""
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and (entry[2] is None or entry[2] > time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику использования кэша
+
+        Returns:
+            Dictionary со счетчиками и текущим заполнением
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class SQLiteCache:
+    """
+    Персистентный кэш на SQLite: переживает перезапуски и деплои.
+    Размер ограничивается количеством записей и объемом, устаревшие
+    и давно неиспользуемые записи удаляются при компактизации.
+    """
+
+    # Обновлять время последнего доступа не чаще, чем раз в указанное число секунд,
+    # чтобы чтения почти никогда не превращались в записи
+    ACCESS_UPDATE_INTERVAL = 60
+
+    def __init__(self,
+                 path: str,
+                 max_entries: int = 100000,
+                 max_bytes: int = 512 * 1024 * 1024,
+                 ttl: Optional[float] = 7 * 24 * 3600,
+                 compact_every: int = 500):
+        """
+        Args:
+            path: Путь к файлу базы SQLite
+            max_entries: Максимальное количество записей
+            max_bytes: Максимальный суммарный объем значений в байтах
+            ttl: Время жизни записи в секундах (None - без ограничения)
+            compact_every: Запускать компактизацию после указанного числа записей
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compact_every = compact_every
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes_since_compact = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.compactions = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        # auto_vacuum должен быть установлен до создания таблиц
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL,"
+            " accessed_at REAL NOT NULL"
+            ")"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (accessed_at)")
+        conn.commit()
+        self.compact()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока (соединения SQLite не разделяются между потоками)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA mmap_size=268435456")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Возвращает значение из кэша
+
+        Args:
+            key: Ключ записи
+            default: Значение, возвращаемое при промахе
+
+        Returns:
+            Закэшированное значение или default
+        """
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        now = time.time()
+
+        if row is None or (row[1] is not None and row[1] <= now):
+            self.misses += 1
+            return default
+
+        if now - row[2] > self.ACCESS_UPDATE_INTERVAL:
+            conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        Сохраняет значение в кэш
+
+        Args:
+            key: Ключ записи
+            value: JSON-сериализуемое значение
+            ttl: Время жизни записи (по умолчанию - ttl кэша)
+        """
+        blob = json.dumps(value, ensure_ascii=False, default=str).encode("utf-8")
+        if self.max_bytes and len(blob) > self.max_bytes:
+            return
+
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl else None
+
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, size, expires_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, blob, len(blob), expires_at, now)
+        )
+
+        with self._lock:
+            self._writes_since_compact += 1
+            need_compact = self._writes_since_compact >= self.compact_every
+            if need_compact:
+                self._writes_since_compact = 0
+        if need_compact:
+            self.compact()
+
+    def delete(self, key: str):
+        """Удаляет запись из кэша"""
+        self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def clear(self):
+        """Удаляет все записи из кэша"""
+        conn = self._connection()
+        conn.execute("DELETE FROM cache_entries")
+        conn.execute("PRAGMA incremental_vacuum")
+
+    def compact(self):
+        """
+        Удаляет устаревшие записи, вытесняет давно неиспользуемые записи сверх
+        лимитов (с запасом 10%) и возвращает освободившиеся страницы файлу
+        """
+        conn = self._connection()
+        with self._lock:
+            conn.execute("DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                         (time.time(),))
+
+            count, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+            ).fetchone()
+
+            if (self.max_entries and count > self.max_entries) or (self.max_bytes and total > self.max_bytes):
+                target_entries = int(self.max_entries * 0.9) if self.max_entries else count
+                target_bytes = int(self.max_bytes * 0.9) if self.max_bytes else total
+
+                evicted = []
+                for key, size in conn.execute("SELECT key, size FROM cache_entries ORDER BY accessed_at"):
+                    if count <= target_entries and total <= target_bytes:
+                        break
+                    evicted.append((key,))
+                    count -= 1
+                    total -= size
+
+                conn.executemany("DELETE FROM cache_entries WHERE key = ?", evicted)
+                self.evictions += len(evicted)
+
+            conn.execute("PRAGMA incremental_vacuum")
+            self.compactions += 1
+
+    def __contains__(self, key: str) -> bool:
+        row = self._connection().execute(
+            "SELECT expires_at FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику использования кэша
+
+        Returns:
+            Dictionary со счетчиками и текущим заполнением
+        """
+        count, total = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": count,
+            "bytes": total,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "compactions": self.compactions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class TieredCache:
+    """
+    Двухуровневый кэш: быстрый кэш в памяти процесса перед общим
+    или персистентным кэшем. Попадания второго уровня поднимаются в первый.
+    """
+
+    def __init__(self, front: LRUCache, back):
+        """
+        Args:
+            front: Кэш в памяти процесса
+            back: Кэш второго уровня (например, SQLiteCache)
+        """
+        self.front = front
+        self.back = back
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.front.get(key)
+        if value is not None:
+            return value
+        value = self.back.get(key)
+        if value is None:
+            return default
+        self.front.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.front.set(key, value, ttl)
+        self.back.set(key, value, ttl)
+
+    async def get_async(self, key: str, default: Any = None) -> Any:
+        """
+        Версия get для асинхронного кода: первый уровень проверяется сразу,
+        а обращение ко второму (сеть или диск) выполняется в потоке,
+        чтобы не блокировать цикл событий
+        """
+        value = self.front.get(key)
+        if value is not None:
+            return value
+        value = await asyncio.to_thread(self.back.get, key)
+        if value is None:
+            return default
+        self.front.set(key, value)
+        return value
+
+    async def set_async(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Версия set для асинхронного кода (запись второго уровня - в потоке)"""
+        self.front.set(key, value, ttl)
+        await asyncio.to_thread(self.back.set, key, value, ttl)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        found = self.front.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing and hasattr(self.back, "get_many"):
+            from_back = self.back.get_many(missing)
+        else:
+            from_back = {}
+            for key in missing:
+                value = self.back.get(key)
+                if value is not None:
+                    from_back[key] = value
+        if from_back:
+            self.front.set_many(from_back)
+            found.update(from_back)
+        return found
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        self.front.set_many(items, ttl)
+        if hasattr(self.back, "set_many"):
+            self.back.set_many(items, ttl)
+        else:
+            for key, value in items.items():
+                self.back.set(key, value, ttl)
+
+    def delete(self, key: str):
+        self.front.delete(key)
+        self.back.delete(key)
+
+    def clear(self):
+        self.front.clear()
+        self.back.clear()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.front or key in self.back
+
+    def __len__(self) -> int:
+        return len(self.back)
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику обоих уровней кэша"""
+        tier = "shared" if isinstance(self.back, RedisCache) else "persistent"
+        return {
+            "memory": self.front.stats(),
+            tier: self.back.stats()
+        }
+
+
+class RedisCache:
+    """
+    Общий кэш в Redis для всех воркеров и реплик.
+    Значения хранятся в JSON (как в SQLiteCache), крупные значения сжимаются zlib:
+    содержимое Redis не исполняется при чтении. Ошибки Redis и записи, которые
+    не удалось декодировать, не прерывают обработку запроса и считаются промахами.
+    """
+
+    # Значения крупнее порога сжимаются
+    COMPRESS_THRESHOLD = 1024
+    _RAW = b"j"
+    _COMPRESSED = b"z"
+
+    def __init__(self,
+                 url: str = "redis://localhost:6379/0",
+                 namespace: str = "cache",
+                 ttl: Optional[float] = 3600,
+                 client=None):
+        """
+        Args:
+            url: URL подключения к Redis
+            namespace: Префикс ключей, разделяющий разные кэши
+            ttl: Время жизни записи в секундах (None - без ограничения)
+            client: Готовый клиент Redis (например, локальная замена для тестов)
+        """
+        if client is None:
+            if redis is None:
+                raise ImportError("Для CACHE_BACKEND=redis необходимо установить пакет redis")
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+        self._errors = (redis.RedisError,) if redis is not None else (Exception,)
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    @classmethod
+    def _dumps(cls, value: Any) -> bytes:
+        """Сериализует значение в JSON (со сжатием крупных значений)"""
+        data = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        if len(data) > cls.COMPRESS_THRESHOLD:
+            return cls._COMPRESSED + zlib.compress(data, 1)
+        return cls._RAW + data
+
+    @classmethod
+    def _loads(cls, blob: bytes) -> Any:
+        """
+        Восстанавливает значение из сохраненного вида
+
+        Raises:
+            ValueError: Запись повреждена или сохранена в другом формате
+        """
+        marker, data = blob[:1], blob[1:]
+        if marker == cls._COMPRESSED:
+            try:
+                data = zlib.decompress(data)
+            except zlib.error as e:
+                raise ValueError(str(e)) from e
+        elif marker != cls._RAW:
+            raise ValueError("Неизвестный формат записи кэша")
+        # UnicodeDecodeError и JSONDecodeError - подклассы ValueError
+        return json.loads(data.decode("utf-8"))
+
+    def _decode(self, blob: bytes) -> Any:
+        """Декодирует запись; нечитаемая запись считается промахом (None)"""
+        try:
+            return self._loads(blob)
+        except ValueError:
+            self.errors += 1
+            return None
+
+    def _expire_seconds(self, ttl: Optional[float]) -> Optional[int]:
+        ttl = self.ttl if ttl is None else ttl
+        return max(1, int(ttl)) if ttl else None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            blob = self.client.get(self._key(key))
+        except self._errors:
+            self.errors += 1
+            return default
+        value = self._decode(blob) if blob is not None else None
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        try:
+            self.client.set(self._key(key), self._dumps(value), ex=self._expire_seconds(ttl))
+        except self._errors:
+            self.errors += 1
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Получает несколько значений за один запрос к Redis"""
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            blobs = self.client.mget([self._key(key) for key in keys])
+        except self._errors:
+            self.errors += 1
+            return {}
+
+        found = {}
+        for key, blob in zip(keys, blobs):
+            value = self._decode(blob) if blob is not None else None
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                found[key] = value
+        return found
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        """Сохраняет несколько значений одним конвейером (pipeline)"""
+        if not items:
+            return
+        expire = self._expire_seconds(ttl)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, value in items.items():
+                pipe.set(self._key(key), self._dumps(value), ex=expire)
+            pipe.execute()
+        except self._errors:
+            self.errors += 1
+
+    def delete(self, key: str):
+        try:
+            self.client.delete(self._key(key))
+        except self._errors:
+            self.errors += 1
+
+    def clear(self):
+        """Удаляет все ключи пространства имен"""
+        try:
+            keys: List[bytes] = list(self.client.scan_iter(match=f"{self.namespace}:*", count=500))
+            if keys:
+                self.client.delete(*keys)
+        except self._errors:
+            self.errors += 1
+
+    def __contains__(self, key: str) -> bool:
+        try:
+            return bool(self.client.exists(self._key(key)))
+        except self._errors:
+            self.errors += 1
+            return False
+
+    def __len__(self) -> int:
+        """Число ключей пространства имен (SCAN: DBSIZE учитывает всю базу Redis)"""
+        try:
+            return sum(1 for _ in self.client.scan_iter(match=f"{self.namespace}:*", count=500))
+        except self._errors:
+            self.errors += 1
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "namespace": self.namespace,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def get_shared_cache_backend(namespace: str, ttl: Optional[float]) -> Optional[RedisCache]:
+    """
+    Возвращает общий кэш Redis, если он включен через CACHE_BACKEND=redis
+
+    Args:
+        namespace: Префикс ключей кэша
+        ttl: Время жизни записей в секундах
+
+    Returns:
+        Экземпляр RedisCache или None, если используется только кэш процесса
+    """
+    if os.getenv("CACHE_BACKEND", "memory").strip().lower() != "redis":
+        return None
+    return RedisCache(os.getenv("REDIS_URL", "redis://localhost:6379/0"), namespace=namespace, ttl=ttl)
@@ -0,0 +1,271 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Callable
+
+# Приоритеты вызовов LLM: меньшее значение обслуживается раньше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_llm_priority: contextvars.ContextVar = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(priority: int):
+    """
+    Задает приоритет всех вызовов LLM внутри блока (включая вызовы
+    в asyncio.to_thread, которые наследуют контекст)
+
+    Args:
+        priority: PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND или любое целое
+    """
+    token = _llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        _llm_priority.reset(token)
+
+
+def current_llm_priority() -> int:
+    """Возвращает приоритет вызовов LLM в текущем контексте"""
+    return _llm_priority.get()
+
+
+class QueueTimeoutError(Exception):
+    """Не удалось дождаться свободного слота для вызова LLM"""
+
+
+class _Waiter:
+    """Ожидающий слот вызов (синхронный или асинхронный)"""
+
+    __slots__ = ("priority", "wake", "granted", "cancelled")
+
+    def __init__(self, priority: int, wake: Callable[[], None]):
+        self.priority = priority
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Адаптивный ограничитель параллельных вызовов (AIMD) с очередью по приоритетам.
+
+    Лимит растет на 1 за каждое «окно» успешных вызовов с нормальной задержкой
+    (аддитивное увеличение) и уменьшается в разы при ответах 429 или задержке
+    выше целевой (мультипликативное уменьшение). Вызовы сверх лимита ждут
+    в очереди, более приоритетные выходят из нее первыми.
+    """
+
+    def __init__(self,
+                 initial_limit: int = 8,
+                 min_limit: int = 1,
+                 max_limit: int = 64,
+                 latency_target: float = 20.0,
+                 throttle_backoff: float = 0.5,
+                 latency_backoff: float = 0.9,
+                 queue_timeout: Optional[float] = 60.0):
+        """
+        Args:
+            initial_limit: Начальный лимит параллельных вызовов
+            min_limit: Минимальный лимит
+            max_limit: Максимальный лимит
+            latency_target: Задержка вызова (сек), выше которой лимит снижается
+            throttle_backoff: Множитель лимита при ответе 429
+            latency_backoff: Множитель лимита при превышении целевой задержки
+            queue_timeout: Максимальное время ожидания в очереди (сек)
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.throttle_backoff = throttle_backoff
+        self.latency_backoff = latency_backoff
+        self.queue_timeout = queue_timeout
+
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+        # Метрики
+        self.acquired = 0
+        self.queued = 0
+        self.timeouts = 0
+        self.throttled = 0
+        self.slow_calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @classmethod
+    def from_env(cls) -> "AdaptiveConcurrencyLimiter":
+        """Создает ограничитель с настройками из переменных окружения DEEPSEEK_CONCURRENCY_*"""
+        queue_timeout = float(os.getenv("DEEPSEEK_QUEUE_TIMEOUT", "60"))
+        return cls(
+            initial_limit=int(os.getenv("DEEPSEEK_CONCURRENCY_INITIAL", "8")),
+            min_limit=int(os.getenv("DEEPSEEK_CONCURRENCY_MIN", "1")),
+            max_limit=int(os.getenv("DEEPSEEK_CONCURRENCY_MAX", "64")),
+            latency_target=float(os.getenv("DEEPSEEK_LATENCY_TARGET", "20")),
+            queue_timeout=queue_timeout if queue_timeout > 0 else None
+        )
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _has_capacity(self) -> bool:
+        return self._in_flight < int(self._limit)
+
+    def _enqueue(self, waiter: _Waiter):
+        """Ставит вызов в очередь (вызывается под self._lock)"""
+        heapq.heappush(self._queue, (waiter.priority, next(self._seq), waiter))
+        self.queued += 1
+
+    def _grant_waiting(self):
+        """Выдает освободившиеся слоты ожидающим по приоритету (вызывается под self._lock)"""
+        while self._queue and self._has_capacity():
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            waiter.granted = True
+            self._in_flight += 1
+            waiter.wake()
+
+    def _record_wait(self, waited: float):
+        self.acquired += 1
+        self.total_wait += waited
+        if waited > self.max_wait:
+            self.max_wait = waited
+
+    def acquire(self, priority: Optional[int] = None):
+        """
+        Синхронно занимает слот, при необходимости ожидая в очереди
+
+        Args:
+            priority: Приоритет вызова (по умолчанию - из контекста)
+
+        Raises:
+            QueueTimeoutError: Если слот не освободился за queue_timeout
+        """
+        priority = current_llm_priority() if priority is None else priority
+        started = time.monotonic()
+        event = threading.Event()
+        waiter = _Waiter(priority, event.set)
+
+        with self._lock:
+            if not self._queue and self._has_capacity():
+                self._in_flight += 1
+                self._record_wait(0.0)
+                return
+            self._enqueue(waiter)
+
+        if not event.wait(self.queue_timeout):
+            with self._lock:
+                if not waiter.granted:
+                    waiter.cancelled = True
+                    self.timeouts += 1
+                    raise QueueTimeoutError("Превышено время ожидания в очереди запросов к DeepSeek")
+
+        with self._lock:
+            self._record_wait(time.monotonic() - started)
+
+    async def acquire_async(self, priority: Optional[int] = None):
+        """
+        Асинхронно занимает слот, не блокируя цикл событий
+
+        Args:
+            priority: Приоритет вызова (по умолчанию - из контекста)
+
+        Raises:
+            QueueTimeoutError: Если слот не освободился за queue_timeout
+        """
+        priority = current_llm_priority() if priority is None else priority
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(priority, wake)
+
+        with self._lock:
+            if not self._queue and self._has_capacity():
+                self._in_flight += 1
+                self._record_wait(0.0)
+                return
+            self._enqueue(waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if waiter.granted:
+                    # Слот выдан одновременно с отменой - возвращаем его
+                    self._in_flight -= 1
+                    self._grant_waiting()
+                else:
+                    waiter.cancelled = True
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise QueueTimeoutError("Превышено время ожидания в очереди запросов к DeepSeek")
+            raise
+
+        with self._lock:
+            self._record_wait(time.monotonic() - started)
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False, failed: bool = False):
+        """
+        Освобождает слот и корректирует лимит по результату вызова
+
+        Args:
+            latency: Длительность вызова в секундах
+            throttled: Получен ответ 429 (Too Many Requests)
+            failed: Вызов завершился другой ошибкой (лимит не увеличивается)
+        """
+        with self._lock:
+            self._in_flight -= 1
+
+            if throttled:
+                self.throttled += 1
+                self._limit = max(self.min_limit, self._limit * self.throttle_backoff)
+            elif latency is not None and self.latency_target and latency > self.latency_target:
+                self.slow_calls += 1
+                self._limit = max(self.min_limit, self._limit * self.latency_backoff)
+            elif not failed:
+                # +1 к лимиту примерно за каждые limit успешных вызовов
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+
+            self._grant_waiting()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает состояние ограничителя и метрики очереди
+
+        Returns:
+            Dictionary с лимитом, глубиной очереди и временем ожидания
+        """
+        with self._lock:
+            depth_by_priority: Dict[int, int] = {}
+            for priority, _, waiter in self._queue:
+                if not waiter.cancelled:
+                    depth_by_priority[priority] = depth_by_priority.get(priority, 0) + 1
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "queue_depth": sum(depth_by_priority.values()),
+                "queue_depth_by_priority": depth_by_priority,
+                "acquired": self.acquired,
+                "queued": self.queued,
+                "queue_timeouts": self.timeouts,
+                "throttled": self.throttled,
+                "slow_calls": self.slow_calls,
+                "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 2) if self.acquired else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 2)
+            }
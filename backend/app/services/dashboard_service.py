@@ -1,3 +1,6 @@
+import os
+import asyncio
+import threading
 from typing import Dict, Any, List, Optional
 import pandas as pd
 from datetime import datetime, timedelta
@@ -6,13 +9,61 @@ import hashlib
 import time
 
 from ..metadata.dashboard_schema import USER_METRICS_DASHBOARD_SCHEMA
+from ..tools.db_tool import DatabaseTool
+from ..utils.template_index import TemplateIndex
+from ..utils.query_normalizer import normalize_query, period_bounds
+from .template_store import get_template_store, has_period_parameters
 
 class DashboardService:
     """Сервис для работы с представлением test_staging.user_metrics_dashboard_optimized"""
     
-    def __init__(self, db_connection):
+    # Общий для всех экземпляров индекс встроенных и выученных шаблонов
+    # (строится при первом обращении) и версия списка выученных шаблонов в нем
+    _template_index: Optional[TemplateIndex] = None
+    _template_index_version: Optional[int] = None
+    _template_index_built_at = 0.0
+    _template_index_lock = threading.Lock()
+    
+    def __init__(self, db_connection, sql_guard=None):
         self.db_connection = db_connection
+        self.db_tool = DatabaseTool(db_connection)
+        # Проверка стоимости для выученных шаблонов: их SQL сгенерирован LLM (None - отключена)
+        self.sql_guard = sql_guard
         self.metadata = USER_METRICS_DASHBOARD_SCHEMA
+        # Минимальная близость запроса к шаблону по индексу n-грамм
+        self.match_threshold = float(os.getenv("TEMPLATE_MATCH_THRESHOLD", "0.45"))
+    
+    @classmethod
+    def _index_is_current(cls, version: int) -> bool:
+        """
+        Проверяет, можно ли использовать построенный индекс. Новые выученные шаблоны
+        добавляются пакетами: индекс перестраивается не чаще раза
+        в TEMPLATE_INDEX_REBUILD_INTERVAL секунд
+        """
+        if cls._template_index is None:
+            return False
+        if cls._template_index_version == version:
+            return True
+        interval = float(os.getenv("TEMPLATE_INDEX_REBUILD_INTERVAL", "30"))
+        return time.monotonic() - cls._template_index_built_at < interval
+    
+    @classmethod
+    def get_template_index(cls) -> TemplateIndex:
+        """
+        Возвращает индекс встроенных шаблонов схемы и шаблонов, выученных по ответам LLM
+        (список выученных шаблонов принадлежит LearnedTemplateStore)
+        """
+        store = get_template_store()
+        learned, version = store.templates() if store is not None else ([], 0)
+        if not cls._index_is_current(version):
+            with cls._template_index_lock:
+                if not cls._index_is_current(version):
+                    cls._template_index = TemplateIndex(
+                        USER_METRICS_DASHBOARD_SCHEMA["common_queries"] + learned
+                    )
+                    cls._template_index_version = version
+                    cls._template_index_built_at = time.monotonic()
+        return cls._template_index
     
     def get_active_users_by_period(self, period: str = 'month', start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> pd.DataFrame:
         """Получает количество активных пользователей по периодам"""
@@ -80,11 +131,78 @@ class DashboardService:
         
         return pd.read_sql(query, self.db_connection)
     
+    def rank_templates(self, user_query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Ранжирует шаблоны запросов по близости к запросу пользователя
+        
+        Args:
+            user_query: Текстовый запрос пользователя
+            top_k: Максимальное число шаблонов в ответе
+            
+        Returns:
+            Список словарей с полями template и score (по убыванию score)
+        """
+        return [
+            {"template": template, "score": score}
+            for template, score in self.get_template_index().search(user_query, top_k)
+        ]
+    
+    @staticmethod
+    def _is_compatible(template: Dict[str, Any], normalized_query: Dict[str, Any]) -> bool:
+        """
+        Проверяет, что шаблон не противоречит запросу: интервал и разрез, явно указанные
+        в запросе, совпадают с шаблоном, а тип запроса, показатели и прочие значимые слова
+        запроса есть в формулировках шаблона (n-граммы близки у «по месяцам» и «по неделям»,
+        а у «сравни вовлеченность» и «распределение по типам» есть общие слова, а результат разный)
+        """
+        normalized_template = normalize_query(template.get("name", ""))
+        if normalized_query["grain"] and normalized_query["grain"] != normalized_template["grain"]:
+            return False
+        if normalized_query["filters"] and normalized_query["filters"] != normalized_template["filters"]:
+            return False
+        
+        phrasings = [" ".join(template.get("keywords", []))] + template.get("examples", [])
+        template_intents = set(normalized_template["intent"].split("+"))
+        template_metrics = set(normalized_template["metrics"])
+        template_terms = set(normalized_template["terms"])
+        for phrasing in phrasings:
+            normalized_phrasing = normalize_query(phrasing)
+            template_intents.update(normalized_phrasing["intent"].split("+"))
+            template_metrics.update(normalized_phrasing["metrics"])
+            template_terms.update(normalized_phrasing["terms"])
+        
+        # Запрос без явного типа ("general") подходит шаблону любого типа
+        query_intents = set(normalized_query["intent"].split("+")) - {"general"}
+        return (query_intents <= template_intents
+                and set(normalized_query["metrics"]) <= template_metrics
+                and set(normalized_query["terms"]) <= template_terms)
+    
+    @staticmethod
+    def _period_fits(template: Dict[str, Any], normalized_query: Dict[str, Any]) -> bool:
+        """Шаблон без параметров периода подходит только запросу без периода"""
+        return has_period_parameters(template["sql"]) or not normalized_query["period"]
+    
     def find_matching_query(self, user_query: str) -> Optional[Dict[str, Any]]:
-        """Находит подходящий предопределенный запрос на основе запроса пользователя"""
+        """
+        Находит подходящий предопределенный запрос на основе запроса пользователя.
+        Шаблон задает один непрерывный период, поэтому запрос с несколькими периодами
+        или периодом без начала обрабатывается LLM
+        """
+        normalized_query = normalize_query(user_query)
+        if self._template_period(user_query) is None:
+            return None
+        
+        # Сначала ищем по индексу n-грамм (перефразированные запросы)
+        for candidate in self.rank_templates(user_query):
+            if candidate["score"] < self.match_threshold:
+                break
+            if (self._is_compatible(candidate["template"], normalized_query)
+                    and self._period_fits(candidate["template"], normalized_query)):
+                return candidate["template"]
+        
         user_query_lower = user_query.lower()
         
-        # Проверяем каждый предопределенный запрос на соответствие
+        # Проверяем каждый предопределенный запрос на соответствие ключевым словам
         for query_template in self.metadata["common_queries"]:
             match_score = 0
             
@@ -94,25 +212,31 @@ class DashboardService:
                     match_score += 1
             
             # Если найдено достаточное совпадение, возвращаем запрос
-            if match_score >= 2:  # Минимум 2 ключевых слова должны совпадать
+            if (match_score >= 2 and self._is_compatible(query_template, normalized_query)
+                    and self._period_fits(query_template, normalized_query)):
                 return query_template
                 
         return None
     
-    def execute_optimized_query(self, user_query: str) -> Dict[str, Any]:
-        """Выполняет оптимизированный запрос на основе запроса пользователя"""
+    def execute_optimized_query(self, user_query: str, matching_query: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Выполняет оптимизированный запрос на основе запроса пользователя
+        
+        Args:
+            user_query: Текстовый запрос пользователя
+            matching_query: Уже найденный шаблон (если не указан, ищется по запросу)
+        """
         # Извлекаем временной период из запроса
         start_date, end_date = self._extract_time_period(user_query)
         
         # Ищем соответствующий шаблон запроса
-        matching_query = self.find_matching_query(user_query)
-        
-        # Если найден подходящий шаблон, используем его
-        if matching_query:
-            sql = matching_query["sql"].format(
-                start_date=start_date.strftime('%Y-%m-%d'),
-                end_date=end_date.strftime('%Y-%m-%d')
-            )
+        if matching_query is None:
+            matching_query = self.find_matching_query(user_query)
+        
+        # Если найден подходящий шаблон, используем его. Выученные шаблоны (SQL от LLM)
+        # выполняются только асинхронно через проверку SQLGuard
+        if matching_query and not matching_query.get("learned"):
+            sql = self._template_sql(user_query, matching_query)
             
             # Выполняем SQL-запрос
             data = pd.read_sql(sql, self.db_connection)
@@ -157,6 +281,77 @@ class DashboardService:
                 "sql_query": "-- Запрос на активных пользователей по месяцам"
             }
     
+    async def execute_optimized_query_async(self,
+                                            user_query: str,
+                                            matching_query: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Асинхронная версия метода execute_optimized_query: запрос по шаблону выполняется
+        через DatabaseTool.execute_query_async (выученный шаблон - через SQLGuard),
+        остальные случаи - в потоке
+        
+        Args:
+            user_query: Текстовый запрос пользователя
+            matching_query: Уже найденный шаблон (если не указан, ищется по запросу)
+        """
+        if matching_query is None:
+            matching_query = self.find_matching_query(user_query)
+        if not matching_query:
+            return await asyncio.to_thread(self.execute_optimized_query, user_query, None)
+        
+        sql = self._template_sql(user_query, matching_query)
+        cost_estimate = None
+        if matching_query.get("learned") and self.sql_guard is not None:
+            db_result = await self.sql_guard.execute_async(sql)
+            sql, cost_estimate = db_result["sql_query"], db_result["cost_estimate"]
+        else:
+            db_result = await self.db_tool.execute_query_async(sql)
+        if not db_result["success"]:
+            return {"success": False, "error": db_result["error"]}
+        
+        result = {
+            "success": True,
+            "data": db_result["data"],
+            "visualization_type": matching_query["visualization_type"],
+            "title": matching_query["name"],
+            "sql_query": sql
+        }
+        if cost_estimate is not None:
+            result["cost_estimate"] = cost_estimate
+        return result
+    
+    def _template_sql(self, user_query: str, matching_query: Dict[str, Any]) -> str:
+        """
+        Подставляет период из запроса пользователя в SQL-шаблон. Кроме первого
+        и последнего дня периода доступны соседние дни для строгих границ
+        выученных шаблонов (см. parameterize_sql)
+        """
+        start_date, end_date = self._template_period(user_query) or self._extract_time_period(user_query)
+        return matching_query["sql"].format(
+            start_date=start_date.strftime('%Y-%m-%d'),
+            end_date=end_date.strftime('%Y-%m-%d'),
+            start_date_prev=(start_date - timedelta(days=1)).strftime('%Y-%m-%d'),
+            end_date_next=(end_date + timedelta(days=1)).strftime('%Y-%m-%d')
+        )
+    
+    def _template_period(self, user_query: str) -> Optional[tuple]:
+        """
+        Определяет период для параметров {start_date}/{end_date} шаблона по периоду,
+        найденному normalize_query (без периода в запросе - период по умолчанию)
+        
+        Returns:
+            Кортеж (начало, конец) или None, если период запроса нельзя задать
+            одной парой дат
+        """
+        periods = normalize_query(user_query)["period"]
+        if not periods:
+            return self._extract_time_period(user_query)
+        if len(periods) > 1:
+            return None
+        bounds = period_bounds(periods[0])
+        if bounds is None:
+            return None
+        return tuple(datetime.combine(day, datetime.min.time()) for day in bounds)
+    
     def _extract_time_period(self, query_text: str) -> tuple:
         """Определяет временной период из запроса пользователя"""
         today = datetime.now()
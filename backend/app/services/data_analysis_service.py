@@ -1,3 +1,4 @@
+import os
 import hashlib
 import time
 import asyncio
@@ -8,15 +9,27 @@ from datetime import datetime
 
 from ..tools.db_tool import DatabaseTool
 from ..tools.viz_tool import VisualizationTool
+from ..tools.sql_guard import SQLGuard
 from ..agents.analyzer import AnalyzerAgent
 from ..agents.sql_expert import SQLExpertAgent
 from ..agents.visualizer import VisualizerAgent
+from ..agents.planner import PlannerAgent
+from ..agents.prompts import get_prompt_cache
 from ..schemas.pagination import PaginationParams, paginate
 from ..services.dashboard_service import DashboardService
 from ..services.deepseek_adapter import DeepseekAdapter
+from ..services.resilience import DeepseekAPIError, CircuitOpenError
+from ..services.concurrency import llm_priority, PRIORITY_BACKGROUND, QueueTimeoutError
+from ..services.usage import llm_route, track_llm_usage, record_prompt_savings
+from ..services.cache import LRUCache, TieredCache, get_shared_cache_backend
+from ..services.template_store import get_template_store
 from ..metadata.dashboard_schema import USER_METRICS_DASHBOARD_SCHEMA
+from ..utils.query_normalizer import normalize_query, make_cache_key
+from ..utils.column_selector import get_column_selector
 
-# Оптимизированный системный промпт для DeepSeek
+# Оптимизированный системный промпт для DeepSeek. Описание столбцов стоит в конце:
+# при отборе столбцов под запрос меняется только оно, а правила и примеры остаются
+# общим префиксом для кэша на стороне провайдера
 OPTIMIZED_SYSTEM_PROMPT = """
 Ты специалист по анализу данных, работающий с представлением test_staging.user_metrics_dashboard_optimized.
 
@@ -29,6 +42,21 @@ OPTIMIZED_SYSTEM_PROMPT = """
 6. Избегай подзапросов, если можно обойтись без них.
 7. Обязательно добавляй ORDER BY для запросов с группировкой.
 
+Примеры оптимальных SQL-запросов:
+1. Для анализа активных пользователей по месяцам:
+   SELECT DATE_TRUNC('month', cohort_month) AS month, COUNT(DISTINCT user_id) AS user_count
+   FROM test_staging.user_metrics_dashboard_optimized
+   WHERE cohort_month BETWEEN '2025-01-01' AND '2025-03-31'
+   GROUP BY month
+   ORDER BY month
+
+2. Для распределения по типам пользователей:
+   SELECT user_type, COUNT(DISTINCT user_id) AS user_count
+   FROM test_staging.user_metrics_dashboard_optimized
+   WHERE cohort_month BETWEEN '2025-01-01' AND '2025-03-31'
+   GROUP BY user_type
+   ORDER BY user_count DESC
+
 Описание столбцов представления test_staging.user_metrics_dashboard_optimized:
 - user_id (text): Уникальный идентификатор зарегистрированного пользователя
 - cohort_month (timestamp): Месяц, когда пользователь впервые посетил платформу
@@ -43,41 +71,71 @@ OPTIMIZED_SYSTEM_PROMPT = """
 - is_interested_user (integer): Флаг "заинтересованного" пользователя (1/null)
 - is_activated_user (integer): Флаг "активированного" пользователя (1/null)
 - is_subscriber (integer): Флаг подписчика (1/null)
+"""
 
-Примеры оптимальных SQL-запросов:
-1. Для анализа активных пользователей по месяцам:
-   SELECT DATE_TRUNC('month', cohort_month) AS month, COUNT(DISTINCT user_id) AS user_count
-   FROM test_staging.user_metrics_dashboard_optimized
-   WHERE cohort_month BETWEEN '2025-01-01' AND '2025-03-31'
-   GROUP BY month
-   ORDER BY month
+# Общий кэш результатов анализа (создается при первом обращении)
+_analysis_cache = None
 
-2. Для распределения по типам пользователей:
-   SELECT user_type, COUNT(DISTINCT user_id) AS user_count
-   FROM test_staging.user_metrics_dashboard_optimized
-   WHERE cohort_month BETWEEN '2025-01-01' AND '2025-03-31'
-   GROUP BY user_type
-   ORDER BY user_count DESC
-"""
+def get_analysis_cache():
+    """
+    Возвращает общий кэш результатов анализа: кэш в памяти процесса,
+    а при CACHE_BACKEND=redis - с общим для всех воркеров уровнем в Redis
+    """
+    global _analysis_cache
+    if _analysis_cache is None:
+        ttl = float(os.getenv("ANALYSIS_CACHE_TTL", "3600"))
+        memory_cache = LRUCache(
+            max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "500")),
+            max_bytes=int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+            ttl=ttl
+        )
+        shared_cache = get_shared_cache_backend("analyze", ttl)
+        _analysis_cache = TieredCache(memory_cache, shared_cache) if shared_cache else memory_cache
+    return _analysis_cache
 
 class DataAnalysisService:
     """
     Сервис для анализа данных и визуализации представления test_staging.user_metrics_dashboard_optimized
     """
     
-    def __init__(self, db_connection, deepseek_adapter=None):
+    def __init__(self, db_connection, deepseek_adapter=None, cache=None, db_metadata=None):
         self.db_connection = db_connection
+        # Метаданные БД для агентов, если они не переданы в process_query
+        self.db_metadata = db_metadata
         self.db_tool = DatabaseTool(db_connection)
-        self.dashboard_service = DashboardService(db_connection)
+        # Проверка стоимости SQL-запросов LLM перед выполнением (None - отключена)
+        self.sql_guard = SQLGuard.from_env(self.db_tool)
+        self.dashboard_service = DashboardService(db_connection, sql_guard=self.sql_guard)
         self.deepseek_adapter = deepseek_adapter or DeepseekAdapter()
         
         # Инициализация агентов
         self.analyzer_agent = None
         self.sql_agent = None
         self.viz_agent = None
+        self.planner_agent = None
+        
+        # Режим LLM-конвейера: "agents" - цепочка Analyzer → SQL → Visualizer,
+        # "plan" - план и SQL-запрос за один вызов модели (PlannerAgent)
+        self.pipeline_mode = os.getenv("ANALYSIS_PIPELINE_MODE", "agents").lower()
+        
+        # Режим визуализатора в цепочке агентов: "labels" - подписи подбираются
+        # одновременно с выполнением SQL, "data" - визуализация по полученным данным
+        self.visualizer_mode = os.getenv("VISUALIZER_MODE", "labels").lower()
+        # Сколько секунд после получения данных ждать подписи визуализации
+        self.labels_wait = float(os.getenv("VISUALIZER_LABELS_WAIT", "10"))
         
-        # Кэш для запросов
-        self.cache = {}  # Простой встроенный кэш
+        # Потоковое получение ответов DeepSeek в пути _process_with_deepseek
+        self.streaming_enabled = os.getenv("DEEPSEEK_STREAMING", "true").lower() in ("1", "true", "yes")
+        
+        # Кэш для запросов (по умолчанию - общий кэш результатов анализа)
+        self.cache = cache if cache is not None else get_analysis_cache()
+        
+        # Ключ кэша по нормализованному запросу (показатели, интервал, период и т.д.)
+        # вместо точного текста запроса
+        self.normalize_cache_keys = os.getenv("ANALYSIS_CACHE_NORMALIZE", "true").lower() in ("1", "true", "yes")
+        
+        # Хранилище шаблонов, выученных по успешным ответам LLM (None - обучение отключено)
+        self.template_store = get_template_store()
     
     def _ensure_agents_initialized(self, db_metadata=None):
         """
@@ -91,6 +149,9 @@ class DataAnalysisService:
             
         if not self.viz_agent:
             self.viz_agent = VisualizerAgent()
+        
+        if not self.planner_agent and db_metadata and self.pipeline_mode == "plan":
+            self.planner_agent = PlannerAgent(db_metadata)
     
     async def process_query(self, query_text: str, db_metadata=None, use_cache=True, 
                             pagination: Optional[PaginationParams] = None):
@@ -107,9 +168,9 @@ class DataAnalysisService:
             Результаты запроса с визуализацией
         """
         # Проверяем кэш
-        cache_key = hashlib.md5(query_text.encode()).hexdigest()
-        if use_cache and cache_key in self.cache:
-            cached_result = self.cache[cache_key]
+        cache_key = self._make_cache_key(query_text)
+        cached_result = await self.cache.get_async(cache_key) if use_cache else None
+        if cached_result is not None:
             
             # Если запрошена пагинация, применяем её к кэшированным данным
             if pagination and 'data' in cached_result:
@@ -126,92 +187,169 @@ class DataAnalysisService:
                 }
                 return result
             
-            return cached_result
+            # Копия, чтобы изменения ответа вызывающим кодом (например, пагинация
+            # в роутере) не затрагивали запись кэша
+            return {**cached_result}
         
         start_time = time.time()
         
-        try:
-            # Убеждаемся, что агенты инициализированы
-            self._ensure_agents_initialized(db_metadata)
-            
-            # Решаем, какой путь обработки использовать
-            if self.dashboard_service and hasattr(self.dashboard_service, 'find_matching_query'):
-                # Сначала проверяем, соответствует ли запрос типовым шаблонам
-                matching_query = self.dashboard_service.find_matching_query(query_text)
+        # Учитываем токены и задержки всех вызовов LLM этого запроса
+        with track_llm_usage() as llm_usage:
+            try:
+                # Убеждаемся, что агенты инициализированы
+                self._ensure_agents_initialized(db_metadata or self.db_metadata)
                 
-                if matching_query:
-                    # Быстрый путь: используем предопределенный шаблон запроса
-                    result = await self._process_with_dashboard_service(query_text, matching_query)
-                elif self.analyzer_agent and self.sql_agent and self.viz_agent:
-                    # Полный путь с агентами: анализ → SQL → визуализация
-                    result = await self._process_with_agents(query_text)
+                # Решаем, какой путь обработки использовать
+                if self.dashboard_service and hasattr(self.dashboard_service, 'find_matching_query'):
+                    # Сначала проверяем, соответствует ли запрос типовым шаблонам
+                    matching_query = self.dashboard_service.find_matching_query(query_text)
+                    
+                    if matching_query:
+                        # Быстрый путь: используем предопределенный шаблон запроса
+                        result = await self._process_with_dashboard_service(query_text, matching_query)
+                    else:
+                        result = await self._process_with_llm(query_text)
                 else:
-                    # Стандартный путь: используем DeepSeek для анализа
-                    result = await self._process_with_deepseek(query_text)
-            elif self.analyzer_agent and self.sql_agent and self.viz_agent:
-                # Полный путь с агентами: анализ → SQL → визуализация
-                result = await self._process_with_agents(query_text)
-            else:
-                # Стандартный путь: используем DeepSeek для анализа
-                result = await self._process_with_deepseek(query_text)
-            
-            # Применяем пагинацию, если она указана
-            if pagination and 'data' in result:
-                data_records = result['data']
-                paginated_data = paginate(data_records, pagination)
+                    result = await self._process_with_llm(query_text)
                 
-                result['data'] = paginated_data['items']
-                result['pagination'] = {
-                    'total': paginated_data['total'],
-                    'page': paginated_data['page'],
-                    'page_size': paginated_data['page_size'],
-                    'total_pages': paginated_data['total_pages']
+                # Полный набор данных для кэша (сервис общий для всех запросов,
+                # поэтому данные не хранятся в атрибутах экземпляра)
+                original_data = result.get('data')
+                
+                # Применяем пагинацию, если она указана
+                if pagination and 'data' in result:
+                    data_records = result['data']
+                    paginated_data = paginate(data_records, pagination)
+                    
+                    result['data'] = paginated_data['items']
+                    result['pagination'] = {
+                        'total': paginated_data['total'],
+                        'page': paginated_data['page'],
+                        'page_size': paginated_data['page_size'],
+                        'total_pages': paginated_data['total_pages']
+                    }
+                
+                # 4. Добавляем метрики производительности
+                processing_time = time.time() - start_time
+                result["performance"] = {
+                    "processing_time_ms": round(processing_time * 1000, 2),
+                    "llm": llm_usage.summary()
                 }
+                
+                # 5. Кэшируем результат (сохраняем оригинальные данные без пагинации);
+                # ответы деградированного режима не кэшируются, чтобы после
+                # восстановления DeepSeek запрос был обработан полноценно
+                if use_cache and not result.get("degraded"):
+                    # Если была применена пагинация, сохраняем в кэш версию без пагинации
+                    if 'pagination' in result:
+                        cache_result = {**result}
+                        del cache_result['pagination']
+                        # Восстанавливаем полный набор данных из оригинального запроса
+                        if original_data is not None:
+                            cache_result['data'] = original_data
+                        await self.cache.set_async(cache_key, cache_result)
+                    else:
+                        await self.cache.set_async(cache_key, {**result})
+                
+                return result
             
-            # 4. Добавляем метрики производительности
-            processing_time = time.time() - start_time
-            result["performance"] = {
-                "processing_time_ms": round(processing_time * 1000, 2),
-            }
-            
-            # 5. Кэшируем результат (сохраняем оригинальные данные без пагинации)
-            if use_cache:
-                # Если была применена пагинация, сохраняем в кэш версию без пагинации
-                if 'pagination' in result:
-                    cache_result = {**result}
-                    del cache_result['pagination']
-                    # Восстанавливаем полный набор данных из оригинального запроса
-                    if hasattr(self, '_original_data') and self._original_data is not None:
-                        cache_result['data'] = self._original_data
-                    self.cache[cache_key] = cache_result
-                else:
-                    self.cache[cache_key] = result
-            
-            return result
+            except Exception as e:
+                # Обработка ошибок с детальной информацией
+                import traceback
+                error_result = {
+                    "success": False,
+                    "error": str(e),
+                    "traceback": traceback.format_exc(),
+                    "performance": {
+                        "processing_time_ms": round((time.time() - start_time) * 1000, 2),
+                        "error_source": type(e).__name__,
+                        "llm": llm_usage.summary()
+                    }
+                }
+                return error_result
+    
+    def _make_cache_key(self, query_text: str) -> str:
+        """
+        Формирует ключ кэша результатов анализа. Относительные периоды («прошлый месяц»)
+        разрешаются в абсолютные, поэтому на границе месяца ключ меняется.
+        """
+        if self.normalize_cache_keys:
+            return make_cache_key(normalize_query(query_text))
+        return hashlib.md5(query_text.encode()).hexdigest()
+    
+    async def _process_with_llm(self, query_text):
+        """
+        Обрабатывает запрос с помощью LLM. Если DeepSeek недоступен (выключатель
+        разомкнут или исчерпаны повторы), запрос обрабатывается по шаблонам
+        и эвристикам DashboardService, а результат помечается как degraded.
+        """
+        if not DeepseekAdapter.is_available():
+            return await self._process_degraded(query_text)
         
+        try:
+            result = None
+            if self.planner_agent and self.pipeline_mode == "plan":
+                # Один вызов модели: план анализа и SQL-запрос одним ответом
+                with llm_route("plan"):
+                    result = await self._process_with_plan(query_text)
+            if result is None and self.analyzer_agent and self.sql_agent and self.viz_agent:
+                # Полный путь с агентами: анализ → SQL → визуализация
+                with llm_route("agents"):
+                    result = await self._process_with_agents(query_text)
+            if result is None:
+                # Стандартный путь: используем DeepSeek для анализа
+                with llm_route("deepseek"):
+                    result = await self._process_with_deepseek(query_text)
+        except DeepseekAPIError as e:
+            if not (e.retryable or isinstance(e, CircuitOpenError)):
+                raise
+            return await self._process_degraded(query_text)
+        except QueueTimeoutError:
+            # Очередь к DeepSeek переполнена - та же перегрузка, что и при открытом автомате
+            return await self._process_degraded(query_text)
+        
+        await self._learn_template(query_text, result)
+        return result
+    
+    async def _learn_template(self, query_text, result):
+        """
+        Передает успешный ответ LLM в хранилище выученных шаблонов; шаблон,
+        достигший порога повторений, добавляется в быстрый путь DashboardService
+        """
+        if self.template_store is None or not result.get("success") or not result.get("data"):
+            return
+        try:
+            template = await asyncio.to_thread(
+                self.template_store.observe,
+                query_text,
+                result.get("sql_query", ""),
+                result.get("visualization_type", ""),
+                result.get("title", "")
+            )
+            if template:
+                print(f"Шаблон '{template['name']}' добавлен в быстрый путь по ответам LLM")
         except Exception as e:
-            # Обработка ошибок с детальной информацией
-            import traceback
-            error_result = {
-                "success": False,
-                "error": str(e),
-                "traceback": traceback.format_exc(),
-                "performance": {
-                    "processing_time_ms": round((time.time() - start_time) * 1000, 2),
-                    "error_source": type(e).__name__
-                }
-            }
-            return error_result
+            # Ошибка обучения не должна влиять на ответ пользователю
+            print(f"Ошибка при сохранении выученного шаблона: {str(e)}")
+    
+    async def _process_degraded(self, query_text):
+        """
+        Обрабатывает запрос без обращения к LLM (деградированный режим)
+        """
+        result = await self._process_with_dashboard_service(query_text, None)
+        result["degraded"] = True
+        result["explanation"] = (
+            "Сервис анализа временно недоступен, показан результат типового запроса. "
+            + result["explanation"]
+        )
+        return result
     
     async def _process_with_dashboard_service(self, query_text, matching_query):
         """
         Обрабатывает запрос с использованием сервиса Dashboard для типовых запросов
         """
         # Выполняем оптимизированный запрос через Dashboard Service
-        result = await asyncio.to_thread(
-            self.dashboard_service.execute_optimized_query, 
-            query_text
-        )
+        result = await self.dashboard_service.execute_optimized_query_async(query_text, matching_query)
         
         # Проверяем успешность запроса
         if not result.get("success", False):
@@ -220,9 +358,9 @@ class DataAnalysisService:
         # Получаем данные из результата
         data = result.get("data")
         if isinstance(data, pd.DataFrame):
-            self._original_data = data.to_dict(orient="records")
+            records = data.to_dict(orient="records")
         else:
-            self._original_data = data
+            records = data
         
         # Обеспечиваем наличие всех необходимых полей в результате
         if "visualization" not in result:
@@ -240,9 +378,18 @@ class DataAnalysisService:
             )
             result["visualization"] = viz_data.get("figure", {})
         
+        # Отдаем данные в виде списка записей, как и в остальных путях обработки
+        result["data"] = records
+        
         # Добавляем отсутствующие поля, если их нет
         if "explanation" not in result:
-            result["explanation"] = f"Запрос выполнен на основе предопределенного шаблона '{matching_query.get('name')}'"
+            if matching_query:
+                result["explanation"] = f"Запрос выполнен на основе предопределенного шаблона '{matching_query.get('name')}'"
+            else:
+                result["explanation"] = f"Запрос выполнен по правилам типовых запросов: {result.get('title', '')}"
+        
+        if "description" not in result:
+            result["description"] = result.get("title", "")
         
         if "success" not in result:
             result["success"] = True
@@ -263,22 +410,50 @@ class DataAnalysisService:
         if not sql_result.get("sql_query"):
             raise Exception("Не удалось сгенерировать SQL-запрос")
         
-        # Шаг 3: Выполнение SQL-запроса
-        db_result = await asyncio.to_thread(self.db_tool.execute_query, sql_result["sql_query"])
-        
-        if not db_result["success"]:
-            raise Exception(f"Ошибка базы данных: {db_result['error']}")
-        
-        # Получение данных из результата запроса
-        data = db_result["data"]
-        self._original_data = data.to_dict(orient="records")
-        
-        # Шаг 4: Генерация визуализации
-        viz_result = await self.viz_agent.generate_visualization_code_async(
-            data=data,
-            visualization_type=analysis["visualization_type"],
-            user_query=query_text
+        # Шаг 3: Выполнение SQL-запроса; в режиме "labels" подписи визуализации
+        # подбираются по анализу и столбцам SQL-запроса одновременно с ним
+        db_task = asyncio.create_task(
+            self._execute_generated_sql(sql_result["sql_query"])
         )
+        labels_task = None
+        if self.visualizer_mode == "labels":
+            # Подписи необязательны (есть значения по умолчанию), поэтому вызов модели
+            # для них идет с фоновым приоритетом и не занимает очередь раньше
+            # основных вызовов других запросов
+            with llm_priority(PRIORITY_BACKGROUND):
+                labels_task = asyncio.create_task(
+                    self.viz_agent.generate_labels_async(analysis, sql_result["sql_query"], query_text)
+                )
+        
+        try:
+            db_result = await db_task
+            
+            if not db_result["success"]:
+                raise Exception(f"Ошибка базы данных: {db_result['error']}")
+            
+            # Получение данных из результата запроса
+            data = db_result["data"]
+            records = data.to_dict(orient="records")
+            
+            # Шаг 4: Генерация визуализации (или ожидание подобранных подписей)
+            if labels_task is not None:
+                try:
+                    # Данные уже получены: подписи ждем не дольше labels_wait секунд
+                    viz_result = await asyncio.wait_for(labels_task, self.labels_wait)
+                except Exception:
+                    # Без подписей модели используем значения по умолчанию
+                    viz_result = {}
+            else:
+                viz_result = await self.viz_agent.generate_visualization_code_async(
+                    data=data,
+                    visualization_type=analysis["visualization_type"],
+                    user_query=query_text
+                )
+        except BaseException:
+            for task in (db_task, labels_task):
+                if task is not None and not task.done():
+                    task.cancel()
+            raise
         
         # Создание визуализации с помощью инструмента
         viz_tool = VisualizationTool()
@@ -298,16 +473,98 @@ class DataAnalysisService:
         # Формирование итогового результата
         result = {
             "success": True,
-            "data": self._original_data,
+            "data": records,
             "visualization": viz_data.get("figure", {}),
-            "sql_query": sql_result["sql_query"],
+            "sql_query": db_result["sql_query"],
             "explanation": sql_result.get("query_explanation", ""),
             "title": viz_result.get("title", "Результаты анализа"),
-            "description": viz_result.get("description", "")
+            "description": viz_result.get("description", ""),
+            "visualization_type": analysis["visualization_type"],
+            "cost_estimate": db_result["cost_estimate"]
         }
         
         return result
     
+    async def _execute_generated_sql(self, sql_query):
+        """
+        Выполняет SQL-запрос, сгенерированный LLM, после проверки стоимости плана
+        
+        Returns:
+            Результат DatabaseTool.execute_query_async с полями sql_query
+            (выполненный запрос, возможно с добавленным LIMIT) и cost_estimate
+        """
+        if self.sql_guard is None:
+            result = await self.db_tool.execute_query_async(sql_query)
+            return {**result, "sql_query": sql_query, "cost_estimate": None}
+        return await self.sql_guard.execute_async(sql_query)
+    
+    async def _process_with_plan(self, query_text):
+        """
+        Обрабатывает запрос за один вызов LLM (PlannerAgent): план, SQL-запрос
+        и подписи визуализации приходят одним структурированным ответом
+        
+        Returns:
+            Результат обработки или None, если модель не вернула корректный план
+            (тогда запрос обрабатывается цепочкой агентов)
+        """
+        plan = await self.planner_agent.plan_async(query_text)
+        if plan is None:
+            return None
+        
+        # Выполнение SQL-запроса
+        db_result = await self._execute_generated_sql(plan["sql_query"])
+        
+        if not db_result["success"]:
+            raise Exception(f"Ошибка базы данных: {db_result['error']}")
+        
+        data = db_result["data"]
+        records = data.to_dict(orient="records")
+        
+        # Создание визуализации без отдельного вызова VisualizerAgent
+        title = plan["title"] or "Результаты анализа"
+        viz_tool = VisualizationTool()
+        viz_data = await asyncio.to_thread(
+            viz_tool.create_visualization,
+            {
+                "data": data,
+                "type": plan["visualization_type"],
+                "config": {
+                    "title": title,
+                    "xaxis_title": plan["x_axis_title"] or None,
+                    "yaxis_title": plan["y_axis_title"] or None
+                }
+            }
+        )
+        
+        result = {
+            "success": True,
+            "data": records,
+            "visualization": viz_data.get("figure", {}),
+            "sql_query": db_result["sql_query"],
+            "explanation": plan["query_explanation"],
+            "title": title,
+            "description": plan["description"] or plan["required_data"],
+            "visualization_type": plan["visualization_type"],
+            "cost_estimate": db_result["cost_estimate"]
+        }
+        
+        return result
+    
+    def _deepseek_system_prompt(self, query_text):
+        """
+        Возвращает OPTIMIZED_SYSTEM_PROMPT без описаний и примеров столбцов,
+        которые не нужны для запроса (при PROMPT_COLUMN_PRUNING=true)
+        """
+        if not get_prompt_cache().prune_columns:
+            return OPTIMIZED_SYSTEM_PROMPT
+        selector = get_column_selector()
+        dropped = selector.dropped(selector.select(query_text))
+        if not dropped:
+            return OPTIMIZED_SYSTEM_PROMPT
+        system_prompt = selector.prune(OPTIMIZED_SYSTEM_PROMPT, dropped)
+        record_prompt_savings(self.deepseek_adapter.agent, len(OPTIMIZED_SYSTEM_PROMPT) - len(system_prompt))
+        return system_prompt
+    
     async def _process_with_deepseek(self, query_text):
         """
         Обрабатывает запрос с использованием DeepSeek для анализа
@@ -326,29 +583,56 @@ class DataAnalysisService:
             "visualization_type": "line или bar или pie или table"
         }}
         """
-        
-        # Запрашиваем анализ от DeepSeek
-        deepseek_response = await self.deepseek_adapter.generate_response_async(
-            prompt=prompt,
-            system_message=OPTIMIZED_SYSTEM_PROMPT,
-            temperature=0.2
-        )
-        
-        # Извлекаем JSON из ответа
-        result_data = self.deepseek_adapter.extract_json_from_response(deepseek_response)
+        system_prompt = self._deepseek_system_prompt(query_text)
+        
+        if self.streaming_enabled:
+            # Получаем ответ потоком: SQL-запрос начинает выполняться, как только
+            # поле sql_query получено полностью, пока модель дописывает остальные поля
+            result_data = {}
+            db_task = None
+            try:
+                async for field, value in self.deepseek_adapter.stream_json_fields_async(
+                    prompt=prompt,
+                    system_message=system_prompt,
+                    temperature=0.2,
+                    json_mode=True
+                ):
+                    result_data[field] = value
+                    if field == "sql_query" and value and db_task is None:
+                        db_task = asyncio.create_task(
+                            self._execute_generated_sql(value)
+                        )
+            except BaseException:
+                if db_task is not None:
+                    db_task.cancel()
+                raise
+        else:
+            # Запрашиваем анализ от DeepSeek
+            deepseek_response = await self.deepseek_adapter.generate_response_async(
+                prompt=prompt,
+                system_message=system_prompt,
+                temperature=0.2,
+                json_mode=True
+            )
+            
+            # Извлекаем JSON из ответа
+            result_data = self.deepseek_adapter.extract_json_from_response(deepseek_response)
+            db_task = None
         
         if not result_data.get("sql_query"):
             raise Exception("Не удалось сгенерировать SQL-запрос")
         
-        # Выполняем SQL-запрос
-        db_result = await asyncio.to_thread(self.db_tool.execute_query, result_data["sql_query"])
+        # Выполняем SQL-запрос (или дожидаемся уже запущенного)
+        if db_task is None:
+            db_task = self._execute_generated_sql(result_data["sql_query"])
+        db_result = await db_task
         
         if not db_result["success"]:
             raise Exception(f"Ошибка базы данных: {db_result['error']}")
         
         # Получаем данные из результата
         data = db_result["data"]
-        self._original_data = data.to_dict(orient="records")
+        records = data.to_dict(orient="records")
         
         # Определяем тип визуализации, если он не указан
         visualization_type = result_data.get("visualization_type", "line")
@@ -376,12 +660,14 @@ class DataAnalysisService:
         # Формируем итоговый результат
         result = {
             "success": True,
-            "data": self._original_data,
+            "data": records,
             "visualization": viz_data.get("figure", {}),
-            "sql_query": result_data["sql_query"],
+            "sql_query": db_result["sql_query"],
             "explanation": result_data.get("description", ""),
             "title": result_data.get("title", "Анализ данных"),
-            "description": result_data.get("description", "")
+            "description": result_data.get("description", ""),
+            "visualization_type": visualization_type,
+            "cost_estimate": db_result["cost_estimate"]
         }
         
         return result
@@ -410,8 +696,8 @@ class DataAnalysisService:
             Результаты выполнения SQL-запроса
         """
         try:
-            # Выполняем запрос
-            db_result = await asyncio.to_thread(self.db_tool.execute_query, sql_query)
+            # Выполняем запрос (произвольный SQL - без кэша результатов)
+            db_result = await self.db_tool.execute_query_async(sql_query, use_cache=False)
             
             if not db_result["success"]:
                 return {
@@ -423,9 +709,6 @@ class DataAnalysisService:
             data = db_result["data"]
             data_records = data.to_dict(orient="records")
             
-            # Сохраняем оригинальные данные для кэша
-            self._original_data = data_records
-            
             # Применяем пагинацию, если она указана
             if pagination:
                 paginated_data = paginate(data_records, pagination)
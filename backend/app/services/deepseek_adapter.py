@@ -1,48 +1,204 @@
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Union, AsyncIterator, Tuple
 import requests
 import json
 import hashlib
+import time
 import asyncio
 import httpx
 
+from .http_client import get_http_client, get_http_session, get_http_timeouts
+from .cache import LRUCache, SQLiteCache, TieredCache, get_shared_cache_backend
+from .singleflight import SingleFlight
+from .concurrency import AdaptiveConcurrencyLimiter, llm_priority, PRIORITY_BACKGROUND
+from .resilience import (
+    DeepseekAPIError, CircuitBreaker, RetryPolicy, HedgePolicy, LatencyTracker,
+    RETRYABLE_STATUSES, parse_retry_after
+)
+from .usage import get_usage_stats, record_llm_call, record_llm_tokens
+from ..utils.json_stream import IncrementalJSONParser, parse_json_object
+
 class DeepseekAdapter:
-    # Добавляем кэширование запросов
-    _cache = {}
+    # Модели, которые не поддерживают response_format={"type": "json_object"}
+    JSON_MODE_UNSUPPORTED = {"deepseek-reasoner"}
+    # Общий для всех адаптеров ограниченный кэш ответов (создается при первом обращении)
+    _cache: Optional[Union[LRUCache, TieredCache]] = None
+    # Объединение одновременных одинаковых запросов к API
+    _inflight = SingleFlight()
+    # Адаптивный лимит параллельных вызовов API (создается при первом обращении)
+    _limiter: Optional[AdaptiveConcurrencyLimiter] = None
+    # Политики повторов и хеджирования запросов (создаются при первом обращении)
+    _retry_policy: Optional[RetryPolicy] = None
+    _hedge_policy: Optional[HedgePolicy] = None
+    # Автоматический выключатель вызовов API (создается при первом обращении)
+    _breaker: Optional[CircuitBreaker] = None
+    
+    @classmethod
+    def get_cache(cls) -> Union[LRUCache, TieredCache]:
+        """
+        Возвращает общий кэш ответов DeepSeek, создавая его при первом обращении.
+        При CACHE_BACKEND=redis вторым уровнем служит общий для всех воркеров Redis,
+        а если задан DEEPSEEK_CACHE_PATH - персистентный кэш на SQLite.
+        
+        Returns:
+            Экземпляр LRUCache или TieredCache с лимитами из переменных окружения
+        """
+        if cls._cache is None:
+            cache_ttl = float(os.getenv("DEEPSEEK_CACHE_TTL", "3600"))
+            memory_cache = LRUCache(
+                max_entries=int(os.getenv("DEEPSEEK_CACHE_MAX_ENTRIES", "1000")),
+                max_bytes=int(os.getenv("DEEPSEEK_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+                ttl=cache_ttl
+            )
+            shared_cache = get_shared_cache_backend("llm", cache_ttl)
+            cache_path = os.getenv("DEEPSEEK_CACHE_PATH")
+            if shared_cache is not None:
+                cls._cache = TieredCache(memory_cache, shared_cache)
+            elif cache_path:
+                disk_cache = SQLiteCache(
+                    cache_path,
+                    max_entries=int(os.getenv("DEEPSEEK_DISK_CACHE_MAX_ENTRIES", "100000")),
+                    max_bytes=int(os.getenv("DEEPSEEK_DISK_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+                    ttl=float(os.getenv("DEEPSEEK_DISK_CACHE_TTL", str(7 * 24 * 3600)))
+                )
+                cls._cache = TieredCache(memory_cache, disk_cache)
+            else:
+                cls._cache = memory_cache
+        return cls._cache
+    
+    @classmethod
+    def get_limiter(cls) -> AdaptiveConcurrencyLimiter:
+        """
+        Возвращает общий для процесса ограничитель параллельных вызовов API
+        
+        Returns:
+            Экземпляр AdaptiveConcurrencyLimiter с настройками из переменных окружения
+        """
+        if cls._limiter is None:
+            cls._limiter = AdaptiveConcurrencyLimiter.from_env()
+        return cls._limiter
+    
+    @classmethod
+    def get_retry_policy(cls) -> RetryPolicy:
+        """Возвращает общую политику повторов запросов к API"""
+        if cls._retry_policy is None:
+            cls._retry_policy = RetryPolicy.from_env()
+        return cls._retry_policy
+    
+    @classmethod
+    def get_hedge_policy(cls) -> HedgePolicy:
+        """Возвращает общую политику хеджирования медленных запросов"""
+        if cls._hedge_policy is None:
+            cls._hedge_policy = HedgePolicy.from_env(LatencyTracker())
+        return cls._hedge_policy
+    
+    @classmethod
+    def get_breaker(cls) -> CircuitBreaker:
+        """Возвращает общий автоматический выключатель вызовов API"""
+        if cls._breaker is None:
+            cls._breaker = CircuitBreaker.from_env()
+        return cls._breaker
+    
+    @classmethod
+    def is_available(cls) -> bool:
+        """Проверяет, принимает ли сейчас DeepSeek API вызовы (выключатель не разомкнут)"""
+        return not cls.get_breaker().is_open()
     
-    def __init__(self):
+    @classmethod
+    def get_cache_stats(cls) -> Dict[str, Any]:
+        """Возвращает счетчики попаданий, промахов и вытеснений кэша"""
+        return cls.get_cache().stats()
+    
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """
+        Возвращает сводную статистику адаптеров DeepSeek
+        
+        Returns:
+            Dictionary со статистикой кэша, объединения запросов, очереди вызовов,
+            повторов, хеджирования, выключателя и расхода токенов
+        """
+        return {
+            "cache": cls.get_cache_stats(),
+            "singleflight": cls._inflight.stats(),
+            "concurrency": cls.get_limiter().stats(),
+            "retries": cls.get_retry_policy().stats(),
+            "hedging": cls.get_hedge_policy().stats(),
+            "circuit_breaker": cls.get_breaker().stats(),
+            "usage": get_usage_stats().summary()
+        }
+    
+    def __init__(self, agent: str = "deepseek"):
+        """
+        Args:
+            agent: Имя агента, к которому относятся вызовы (для учета токенов и задержек)
+        """
+        self.agent = agent
         self.api_key = os.getenv("DEEPSEEK_API_KEY")
         self.api_base = os.getenv("DEEPSEEK_API_BASE")
         self.model = os.getenv("DEEPSEEK_MODEL", "deepseek-reasoner")
+        # Запрос ответов в режиме JSON для вызовов с json_mode=True (если модель его поддерживает)
+        self.json_mode_enabled = os.getenv("DEEPSEEK_JSON_MODE", "true").lower() in ("1", "true", "yes")
         
-        # Настройка сессии HTTP для повторного использования соединений
-        self.session = requests.Session()
+        # Общая сессия HTTP процесса для повторного использования соединений
+        self.session = get_http_session()
         
         if not self.api_key or not self.api_base:
             raise ValueError("DEEPSEEK_API_KEY и DEEPSEEK_API_BASE должны быть установлены в .env")
     
-    def generate_response(self, 
-                         prompt: str, 
-                         system_message: Optional[str] = None,
-                         temperature: float = 0.7,
-                         max_tokens: int = 2000) -> Dict[str, Any]:
+    def _make_cache_key(self,
+                        prompt: str,
+                        system_message: Optional[str],
+                        temperature: float,
+                        max_tokens: int,
+                        json_mode: bool = False) -> str:
         """
-        Отправляет запрос к DeepSeek API и возвращает ответ с кэшированием
+        Формирует ключ кэша с учетом модели и всех параметров генерации
         """
-        # Формируем ключ кэша
-        cache_key = hashlib.md5((
-            f"{prompt}|{system_message}|{temperature}|{max_tokens}"
+        json_suffix = "|json" if self._use_json_mode(json_mode) else ""
+        return hashlib.sha256((
+            f"{self.model}|{temperature}|{max_tokens}|{system_message}|{prompt}{json_suffix}"
         ).encode()).hexdigest()
-        
-        # Проверяем кэш
-        if cache_key in self._cache:
-            return self._cache[cache_key]
-            
-        headers = {
+    
+    def _use_json_mode(self, json_mode: bool) -> bool:
+        """
+        Проверяет, можно ли запросить ответ в режиме JSON (response_format):
+        deepseek-reasoner этот режим не поддерживает
+        """
+        return json_mode and self.json_mode_enabled and self.model not in self.JSON_MODE_UNSUPPORTED
+    
+    @staticmethod
+    def _compact_response(response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Оставляет в ответе только поля, которые используются приложением,
+        чтобы не хранить в кэше полные сырые ответы API
+        """
+        choices = []
+        for choice in response.get("choices", []):
+            message = choice.get("message", {})
+            choices.append({"message": {"role": message.get("role", "assistant"),
+                                        "content": message.get("content", "")}})
+        compact = {"choices": choices}
+        if "model" in response:
+            compact["model"] = response["model"]
+        if "usage" in response:
+            compact["usage"] = response["usage"]
+        return compact
+    
+    def _build_headers(self) -> Dict[str, str]:
+        """Формирует заголовки запроса к DeepSeek API"""
+        return {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
-        
+    
+    def _build_payload(self,
+                       prompt: str,
+                       system_message: Optional[str],
+                       temperature: float,
+                       max_tokens: int,
+                       json_mode: bool = False) -> Dict[str, Any]:
+        """Формирует тело запроса к chat/completions"""
         messages = []
         if system_message:
             messages.append({"role": "system", "content": system_message})
@@ -55,75 +211,432 @@ class DeepseekAdapter:
             "temperature": temperature,
             "max_tokens": max_tokens
         }
+        if self._use_json_mode(json_mode):
+            # Модель гарантированно возвращает корректный JSON-объект
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+    
+    def generate_response(self, 
+                         prompt: str, 
+                         system_message: Optional[str] = None,
+                         temperature: float = 0.7,
+                         max_tokens: int = 2000,
+                         json_mode: bool = False) -> Dict[str, Any]:
+        """
+        Отправляет запрос к DeepSeek API и возвращает ответ с кэшированием.
+        Одновременные одинаковые запросы объединяются в один вызов API.
+        """
+        # Формируем ключ кэша
+        cache_key = self._make_cache_key(prompt, system_message, temperature, max_tokens, json_mode)
+        
+        started = time.monotonic()
+        prompt_chars = len(prompt) + len(system_message or "")
+        
+        # Проверяем кэш
+        cached = self.get_cache().get(cache_key)
+        if cached is not None:
+            record_llm_call(self.agent, time.monotonic() - started, "cache", prompt_chars)
+            return cached
+        
+        payload = self._build_payload(prompt, system_message, temperature, max_tokens, json_mode)
+        sent = False
+        
+        def request():
+            # Вызывается только для первого из одновременных одинаковых запросов
+            nonlocal sent
+            sent = True
+            return self._request(payload, cache_key)
         
+        source = "error"
         try:
-            response = self.session.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            # Сохраняем в кэш
-            self._cache[cache_key] = result
-            
+            result = self._inflight.do(cache_key, request)
+            source = "api" if sent else "coalesced"
             return result
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Ошибка при запросе к DeepSeek API: {str(e)}")
+        finally:
+            record_llm_call(self.agent, time.monotonic() - started, source, prompt_chars)
+    
+    @staticmethod
+    def _status_error(status_code: int, headers, body: str, kind: str = "") -> DeepseekAPIError:
+        """Формирует ошибку по HTTP-статусу ответа API"""
+        return DeepseekAPIError(
+            f"Ошибка при {kind}запросе к DeepSeek API: HTTP {status_code}: {body[:500]}",
+            status_code=status_code,
+            retryable=status_code in RETRYABLE_STATUSES,
+            retry_after=parse_retry_after(headers.get("Retry-After"))
+        )
+    
+    def _request(self, payload: Dict[str, Any], cache_key: str) -> Dict[str, Any]:
+        """
+        Выполняет синхронный запрос к API с повторами и сохраняет ответ в кэш
+        """
+        cache = self.get_cache()
+        # Ответ мог появиться в кэше, пока мы ждали завершения предыдущего вызова
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        attempt = 0
+        while True:
+            try:
+                result = self._send(payload)
+                break
+            except DeepseekAPIError as e:
+                if not self.get_retry_policy().should_retry(e, attempt):
+                    raise
+                time.sleep(self.get_retry_policy().delay(attempt, e.retry_after))
+                attempt += 1
+        
+        record_llm_tokens(self.agent, result.get("model", self.model), result.get("usage"))
+        
+        # Сохраняем в кэш
+        cache.set(cache_key, result)
+        
+        return result
+    
+    def _send(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Выполняет одну синхронную попытку запроса к API
+        """
+        # При разомкнутом выключателе вызов отклоняется сразу
+        breaker = self.get_breaker()
+        probe = breaker.before_call()
+        limiter = self.get_limiter()
+        healthy = None
+        latency = None
+        try:
+            # Ждем свободный слот с учетом приоритета вызова
+            limiter.acquire()
+            started = time.monotonic()
+            throttled = False
+            failed = True
+            try:
+                try:
+                    response = self.session.post(
+                        f"{self.api_base}/chat/completions",
+                        headers=self._build_headers(),
+                        json=payload,
+                        timeout=get_http_timeouts()
+                    )
+                except requests.exceptions.RequestException as e:
+                    raise DeepseekAPIError(f"Ошибка при запросе к DeepSeek API: {str(e)}", retryable=True) from e
+                
+                throttled = response.status_code == 429
+                if response.status_code >= 400:
+                    raise self._status_error(response.status_code, response.headers, response.text)
+                try:
+                    result = self._compact_response(response.json())
+                except ValueError as e:
+                    raise DeepseekAPIError(f"Некорректный ответ DeepSeek API: {str(e)}", retryable=True) from e
+                
+                failed = False
+                healthy = True
+                self.get_hedge_policy().tracker.record(time.monotonic() - started)
+                return result
+            except DeepseekAPIError as e:
+                # Ошибки запроса (4xx) не говорят о неисправности API
+                healthy = not e.retryable
+                raise
+            finally:
+                latency = time.monotonic() - started
+                limiter.release(latency, throttled=throttled, failed=failed)
+        finally:
+            breaker.record(latency, healthy, probe, self.model)
     
     async def generate_response_async(self, 
                                     prompt: str, 
                                     system_message: Optional[str] = None,
                                     temperature: float = 0.7,
-                                    max_tokens: int = 2000) -> Dict[str, Any]:
+                                    max_tokens: int = 2000,
+                                    json_mode: bool = False) -> Dict[str, Any]:
         """
-        Асинхронно отправляет запрос к DeepSeek API и возвращает ответ с кэшированием
+        Асинхронно отправляет запрос к DeepSeek API и возвращает ответ с кэшированием.
+        Одновременные одинаковые запросы объединяются в один вызов API.
         """
         # Формируем ключ кэша
-        cache_key = hashlib.md5((
-            f"{prompt}|{system_message}|{temperature}|{max_tokens}|{self.model}"
-        ).encode()).hexdigest()
+        cache_key = self._make_cache_key(prompt, system_message, temperature, max_tokens, json_mode)
+        
+        started = time.monotonic()
+        prompt_chars = len(prompt) + len(system_message or "")
         
         # Проверяем кэш
-        if cache_key in self._cache:
-            return self._cache[cache_key]
+        cached = await self.get_cache().get_async(cache_key)
+        if cached is not None:
+            record_llm_call(self.agent, time.monotonic() - started, "cache", prompt_chars)
+            return cached
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        payload = self._build_payload(prompt, system_message, temperature, max_tokens, json_mode)
+        sent = False
         
-        messages = []
-        if system_message:
-            messages.append({"role": "system", "content": system_message})
+        def request():
+            # Вызывается только для первого из одновременных одинаковых запросов
+            nonlocal sent
+            sent = True
+            return self._request_async(payload, cache_key)
         
-        messages.append({"role": "user", "content": prompt})
+        source = "error"
+        try:
+            result = await self._inflight.do_async(cache_key, request)
+            source = "api" if sent else "coalesced"
+            return result
+        finally:
+            record_llm_call(self.agent, time.monotonic() - started, source, prompt_chars)
+    
+    async def _request_async(self, payload: Dict[str, Any], cache_key: str) -> Dict[str, Any]:
+        """
+        Выполняет асинхронный запрос к API с повторами и хеджированием
+        и сохраняет ответ в кэш
+        """
+        cache = self.get_cache()
+        cached = await cache.get_async(cache_key)
+        if cached is not None:
+            return cached
         
-        payload = {
-            "model": self.model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens
-        }
+        attempt = 0
+        while True:
+            try:
+                result = await self._send_hedged_async(payload)
+                break
+            except DeepseekAPIError as e:
+                if not self.get_retry_policy().should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.get_retry_policy().delay(attempt, e.retry_after))
+                attempt += 1
+        
+        record_llm_tokens(self.agent, result.get("model", self.model), result.get("usage"))
+        
+        # Сохраняем в кэш
+        await cache.set_async(cache_key, result)
         
+        return result
+    
+    async def _send_hedged_async(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Выполняет попытку запроса; если ответ задерживается дольше p95
+        и позволяет бюджет, отправляет дубликат и берет первый успешный ответ
+        """
+        hedge_delay = self.get_hedge_policy().hedge_delay()
+        if hedge_delay is None:
+            return await self._send_async(payload)
+        
+        primary = asyncio.create_task(self._send_async(payload))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done or not self.get_hedge_policy().try_acquire():
+            return await primary
+        
+        # Дубликат - спекулятивный вызов: в очереди ограничителя он пропускает
+        # вперед основные вызовы других запросов (задача наследует контекст)
+        with llm_priority(PRIORITY_BACKGROUND):
+            hedge = asyncio.create_task(self._send_async(payload))
+        pending = {primary, hedge}
+        error = None
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.api_base}/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=60  # Увеличиваем таймаут для сложных запросов
-                )
-                response.raise_for_status()
-                result = response.json()
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.get_hedge_policy().record_win()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _send_async(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Выполняет одну асинхронную попытку запроса к API
+        """
+        # При разомкнутом выключателе вызов отклоняется сразу
+        breaker = self.get_breaker()
+        probe = breaker.before_call()
+        limiter = self.get_limiter()
+        healthy = None
+        latency = None
+        try:
+            # Ждем свободный слот с учетом приоритета вызова
+            await limiter.acquire_async()
+            started = time.monotonic()
+            throttled = False
+            failed = True
+            try:
+                try:
+                    # Используем общий клиент с пулом keep-alive соединений
+                    client = get_http_client()
+                    response = await client.post(
+                        f"{self.api_base}/chat/completions",
+                        headers=self._build_headers(),
+                        json=payload
+                    )
+                except httpx.HTTPError as e:
+                    raise DeepseekAPIError(
+                        f"Ошибка при асинхронном запросе к DeepSeek API: {str(e)}", retryable=True
+                    ) from e
                 
-                # Сохраняем в кэш
-                self._cache[cache_key] = result
+                throttled = response.status_code == 429
+                if response.status_code >= 400:
+                    raise self._status_error(response.status_code, response.headers, response.text, "асинхронном ")
+                try:
+                    result = self._compact_response(response.json())
+                except ValueError as e:
+                    raise DeepseekAPIError(f"Некорректный ответ DeepSeek API: {str(e)}", retryable=True) from e
                 
+                failed = False
+                healthy = True
+                self.get_hedge_policy().tracker.record(time.monotonic() - started)
                 return result
-        except httpx.HTTPError as e:
-            raise Exception(f"Ошибка при асинхронном запросе к DeepSeek API: {str(e)}")
+            except DeepseekAPIError as e:
+                # Ошибки запроса (4xx) не говорят о неисправности API
+                healthy = not e.retryable
+                raise
+            finally:
+                latency = time.monotonic() - started
+                limiter.release(latency, throttled=throttled, failed=failed)
+        finally:
+            breaker.record(latency, healthy, probe, self.model)
+    
+    async def generate_response_stream_async(self,
+                                             prompt: str,
+                                             system_message: Optional[str] = None,
+                                             temperature: float = 0.7,
+                                             max_tokens: int = 2000,
+                                             json_mode: bool = False) -> AsyncIterator[str]:
+        """
+        Получает ответ DeepSeek потоком (SSE) и отдает текст по мере генерации.
+        Собранный ответ сохраняется в тот же кэш, что и у обычных запросов;
+        при попадании в кэш весь текст отдается одним фрагментом.
+        Повтор возможен, только пока из потока не получено ни одного фрагмента.
+        
+        Yields:
+            Фрагменты текста ответа модели
+        """
+        cache_key = self._make_cache_key(prompt, system_message, temperature, max_tokens, json_mode)
+        call_started = time.monotonic()
+        prompt_chars = len(prompt) + len(system_message or "")
+        cache = self.get_cache()
+        cached = await cache.get_async(cache_key)
+        if cached is not None:
+            record_llm_call(self.agent, time.monotonic() - call_started, "cache", prompt_chars)
+            yield cached["choices"][0]["message"]["content"]
+            return
+        
+        payload = self._build_payload(prompt, system_message, temperature, max_tokens, json_mode)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        
+        content_parts: List[str] = []
+        usage = None
+        model = self.model
+        breaker = self.get_breaker()
+        limiter = self.get_limiter()
+        attempt = 0
+        while True:
+            # При разомкнутом выключателе вызов отклоняется сразу
+            probe = breaker.before_call()
+            try:
+                await limiter.acquire_async()
+            except BaseException:
+                breaker.record(None, None, probe)
+                raise
+            started = time.monotonic()
+            throttled = False
+            failed = True
+            healthy = None
+            error = None
+            try:
+                client = get_http_client()
+                async with client.stream(
+                    "POST",
+                    f"{self.api_base}/chat/completions",
+                    headers=self._build_headers(),
+                    json=payload
+                ) as response:
+                    throttled = response.status_code == 429
+                    if response.status_code >= 400:
+                        body = (await response.aread()).decode("utf-8", errors="replace")
+                        raise self._status_error(response.status_code, response.headers, body, "потоковом ")
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        
+                        chunk = json.loads(data)
+                        model = chunk.get("model", model)
+                        if chunk.get("usage"):
+                            usage = chunk["usage"]
+                        for choice in chunk.get("choices") or []:
+                            # reasoning_content моделей-рассуждателей в ответ не попадает
+                            delta = (choice.get("delta") or {}).get("content")
+                            if delta:
+                                content_parts.append(delta)
+                                yield delta
+                failed = False
+                healthy = True
+                self.get_hedge_policy().tracker.record(time.monotonic() - started)
+            except httpx.HTTPError as e:
+                error = DeepseekAPIError(f"Ошибка при потоковом запросе к DeepSeek API: {str(e)}", retryable=True)
+            except DeepseekAPIError as e:
+                error = e
+            finally:
+                latency = time.monotonic() - started
+                limiter.release(latency, throttled=throttled, failed=failed)
+                if error is not None:
+                    healthy = not error.retryable
+                breaker.record(latency, healthy, probe, self.model)
+            
+            if error is None:
+                break
+            if content_parts or not self.get_retry_policy().should_retry(error, attempt):
+                record_llm_call(self.agent, time.monotonic() - call_started, "error", prompt_chars)
+                raise error
+            await asyncio.sleep(self.get_retry_policy().delay(attempt, error.retry_after))
+            attempt += 1
+        
+        result = {
+            "choices": [{"message": {"role": "assistant", "content": "".join(content_parts)}}],
+            "model": model
+        }
+        if usage:
+            result["usage"] = usage
+        record_llm_tokens(self.agent, model, usage)
+        record_llm_call(self.agent, time.monotonic() - call_started, "api", prompt_chars)
+        await cache.set_async(cache_key, result)
+    
+    async def stream_json_fields_async(self,
+                                       prompt: str,
+                                       system_message: Optional[str] = None,
+                                       temperature: float = 0.7,
+                                       max_tokens: int = 2000,
+                                       json_mode: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Потоково запрашивает JSON-ответ и отдает поля верхнего уровня,
+        как только значение каждого из них полностью получено
+        
+        Yields:
+            Пары (имя поля, значение)
+        """
+        parser = IncrementalJSONParser()
+        content_parts: List[str] = []
+        
+        async for delta in self.generate_response_stream_async(
+            prompt=prompt,
+            system_message=system_message,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            json_mode=json_mode
+        ):
+            content_parts.append(delta)
+            for field, value in parser.feed(delta):
+                yield field, value
+        
+        # Если поток не удалось разобрать инкрементально, разбираем ответ целиком
+        if not parser.done:
+            response = {"choices": [{"message": {"content": "".join(content_parts)}}]}
+            for field, value in self.extract_json_from_response(response).items():
+                if field not in parser.fields:
+                    yield field, value
     
     def extract_json_from_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -140,33 +653,8 @@ class DeepseekAdapter:
         
         content = response["choices"][0]["message"]["content"]
         
-        # Попытка извлечь JSON из текста
-        try:
-            # Ищем JSON в тексте между ```json и ```
-            json_pattern_start = content.find("```json")
-            if json_pattern_start != -1:
-                json_pattern_start += 7  # Длина "```json"
-                json_pattern_end = content.find("```", json_pattern_start)
-                if json_pattern_end != -1:
-                    json_str = content[json_pattern_start:json_pattern_end].strip()
-                    return json.loads(json_str)
-            
-            # Поиск {...} в тексте
-            json_pattern_start = content.find("{")
-            if json_pattern_start != -1:
-                # Рекурсивный подсчет скобок для корректного извлечения
-                open_braces = 0
-                for i in range(json_pattern_start, len(content)):
-                    if content[i] == "{":
-                        open_braces += 1
-                    elif content[i] == "}":
-                        open_braces -= 1
-                        if open_braces == 0:
-                            json_str = content[json_pattern_start:i+1]
-                            return json.loads(json_str)
-            
-            # Если не нашли JSON, возвращаем весь текст
-            return {"content": content}
-            
-        except json.JSONDecodeError:
-            return {"content": content}
\ No newline at end of file
+        # Извлекаем JSON-объект (в том числе из ```json, с запятыми перед '}' и т.д.)
+        result = parse_json_object(content)
+        
+        # Если не нашли JSON, возвращаем весь текст
+        return result if result is not None else {"content": content}
\ No newline at end of file
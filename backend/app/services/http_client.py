@@ -0,0 +1,146 @@
+import os
+import asyncio
+import importlib.util
+from typing import Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+import httpx
+
+# Общие HTTP-клиенты процесса: один пул соединений на все адаптеры DeepSeek
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_session: Optional[requests.Session] = None
+
+
+def _env_flag(name: str, default: str = "false") -> bool:
+    """Читает булевый флаг из переменных окружения"""
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _http2_enabled() -> bool:
+    """
+    Проверяет, включен ли HTTP/2 и установлен ли пакет h2
+
+    Returns:
+        True, если можно использовать HTTP/2
+    """
+    if not _env_flag("DEEPSEEK_HTTP2"):
+        return False
+    # HTTP/2 в httpx требует необязательной зависимости h2
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_http_timeouts() -> Tuple[float, float]:
+    """
+    Возвращает таймауты запросов к DeepSeek из переменных окружения
+
+    Returns:
+        Кортеж (таймаут соединения, таймаут чтения/записи) в секундах
+    """
+    return (
+        float(os.getenv("DEEPSEEK_HTTP_CONNECT_TIMEOUT", "10")),
+        float(os.getenv("DEEPSEEK_HTTP_TIMEOUT", "60"))
+    )
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Создает асинхронный клиент с пулом keep-alive соединений
+
+    Returns:
+        Экземпляр httpx.AsyncClient с настроенными лимитами пула
+    """
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("DEEPSEEK_HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("DEEPSEEK_HTTP_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv("DEEPSEEK_HTTP_KEEPALIVE_EXPIRY", "120"))
+    )
+    connect, read = get_http_timeouts()
+    timeout = httpx.Timeout(read, connect=connect)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=_http2_enabled())
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Возвращает общий асинхронный клиент процесса, создавая его при необходимости
+
+    Returns:
+        Экземпляр httpx.AsyncClient
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = create_http_client()
+    return _async_client
+
+
+def get_http_session() -> requests.Session:
+    """
+    Возвращает общую синхронную сессию requests с пулом соединений
+
+    Returns:
+        Экземпляр requests.Session
+    """
+    global _sync_session
+    if _sync_session is None:
+        pool_size = int(os.getenv("DEEPSEEK_HTTP_MAX_KEEPALIVE", "20"))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session = requests.Session()
+        # У requests нет таймаута по умолчанию на уровне сессии: таймауты из
+        # get_http_timeouts() передаются в каждый запрос (см. DeepseekAdapter)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _sync_session = session
+    return _sync_session
+
+
+async def warmup_http_client(api_base: Optional[str] = None, connections: Optional[int] = None) -> int:
+    """
+    Заранее открывает соединения с DeepSeek API, чтобы первые запросы
+    не тратили время на установку TCP+TLS
+
+    Args:
+        api_base: Базовый URL API (по умолчанию DEEPSEEK_API_BASE)
+        connections: Количество соединений для прогрева
+
+    Returns:
+        Количество успешно открытых соединений
+    """
+    api_base = api_base or os.getenv("DEEPSEEK_API_BASE")
+    if connections is None:
+        connections = int(os.getenv("DEEPSEEK_HTTP_WARMUP_CONNECTIONS", "4"))
+    if not api_base or connections <= 0:
+        return 0
+
+    client = get_http_client()
+
+    async def _touch() -> bool:
+        try:
+            # Статус ответа не важен - нужно только установить соединение
+            await client.head(api_base, timeout=5)
+            return True
+        except httpx.HTTPError:
+            return False
+
+    results = await asyncio.gather(*(_touch() for _ in range(connections)))
+    return sum(1 for ok in results if ok)
+
+
+async def init_http_client() -> int:
+    """
+    Инициализирует общий клиент при запуске приложения и прогревает пул
+
+    Returns:
+        Количество прогретых соединений
+    """
+    get_http_client()
+    return await warmup_http_client()
+
+
+async def close_http_client():
+    """Закрывает общие HTTP-клиенты при остановке приложения"""
+    global _async_client, _sync_session
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_session is not None:
+        _sync_session.close()
+        _sync_session = None
@@ -0,0 +1,420 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+# Статусы HTTP, после которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# Длительность вызова (сек), после которой выключатель считает его сбоем, по моделям.
+# deepseek-reasoner генерирует рассуждение до ответа: обычный вызов с max_tokens
+# до 3000 длится больше минуты, поэтому порог для него значительно выше
+SLOW_CALL_THRESHOLDS = {
+    "deepseek-reasoner": 300.0,
+    "deepseek-chat": 60.0
+}
+DEFAULT_SLOW_CALL_THRESHOLD = 60.0
+
+
+class DeepseekAPIError(Exception):
+    """Ошибка обращения к DeepSeek API"""
+
+    def __init__(self,
+                 message: str,
+                 status_code: Optional[int] = None,
+                 retryable: bool = False,
+                 retry_after: Optional[float] = None):
+        """
+        Args:
+            message: Текст ошибки
+            status_code: HTTP-статус ответа (None для сетевых ошибок)
+            retryable: Можно ли повторить запрос
+            retry_after: Рекомендуемая сервером пауза перед повтором (сек)
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After, заданный в секундах"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class RetryPolicy:
+    """Повторы с экспоненциальной задержкой и полным джиттером"""
+
+    def __init__(self, max_retries: int = 2, base_delay: float = 0.5, max_delay: float = 8.0):
+        """
+        Args:
+            max_retries: Максимальное количество повторов
+            base_delay: Базовая задержка первого повтора (сек)
+            max_delay: Верхняя граница задержки (сек)
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.exhausted = 0
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """Создает политику с настройками из переменных окружения DEEPSEEK_RETRY_*"""
+        return cls(
+            max_retries=int(os.getenv("DEEPSEEK_MAX_RETRIES", "2")),
+            base_delay=float(os.getenv("DEEPSEEK_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("DEEPSEEK_RETRY_MAX_DELAY", "8"))
+        )
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        """
+        Решает, нужно ли повторить запрос после ошибки
+
+        Args:
+            error: Возникшая ошибка
+            attempt: Номер уже выполненной попытки (с нуля)
+        """
+        if not isinstance(error, DeepseekAPIError) or not error.retryable:
+            return False
+        if attempt >= self.max_retries:
+            self.exhausted += 1
+            return False
+        self.retries += 1
+        return True
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Вычисляет паузу перед повтором: случайное значение от 0 до
+        base_delay * 2^attempt, но не меньше Retry-After от сервера
+
+        Args:
+            attempt: Номер уже выполненной попытки (с нуля)
+            retry_after: Пауза, рекомендованная сервером
+        """
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(0, cap)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_retries": self.max_retries,
+            "retries": self.retries,
+            "exhausted": self.exhausted
+        }
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных вызовов для оценки перцентилей"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        Args:
+            window: Количество последних вызовов в окне
+            min_samples: Минимум наблюдений для оценки перцентилей
+        """
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Возвращает p-й перцентиль длительности или None, если данных мало
+
+        Args:
+            p: Перцентиль от 0 до 100
+        """
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self) -> Dict[str, Any]:
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        return {
+            "samples": len(self._samples),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+        }
+
+
+class HedgePolicy:
+    """
+    Хеджирование запросов: если ответ не пришел за p95 длительности,
+    отправляется дубликат, и используется первый полученный ответ.
+    Доля дубликатов ограничена бюджетом от общего числа запросов.
+    """
+
+    def __init__(self,
+                 enabled: bool = False,
+                 percentile: float = 95,
+                 budget_ratio: float = 0.05,
+                 min_delay: float = 1.0,
+                 tracker: Optional[LatencyTracker] = None):
+        """
+        Args:
+            enabled: Включено ли хеджирование
+            percentile: Перцентиль длительности, после которого отправляется дубликат
+            budget_ratio: Максимальная доля дубликатов от числа запросов
+            min_delay: Минимальная задержка перед дубликатом (сек)
+            tracker: Источник статистики длительностей
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.min_delay = min_delay
+        self.tracker = tracker or LatencyTracker()
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    @classmethod
+    def from_env(cls, tracker: Optional[LatencyTracker] = None) -> "HedgePolicy":
+        """Создает политику с настройками из переменных окружения DEEPSEEK_HEDGE_*"""
+        return cls(
+            enabled=os.getenv("DEEPSEEK_HEDGING", "false").lower() in ("1", "true", "yes"),
+            percentile=float(os.getenv("DEEPSEEK_HEDGE_PERCENTILE", "95")),
+            budget_ratio=float(os.getenv("DEEPSEEK_HEDGE_BUDGET", "0.05")),
+            min_delay=float(os.getenv("DEEPSEEK_HEDGE_MIN_DELAY", "1.0")),
+            tracker=tracker
+        )
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Учитывает запрос и возвращает задержку до отправки дубликата
+
+        Returns:
+            Задержка в секундах или None, если хеджирование не применяется
+        """
+        with self._lock:
+            self.requests += 1
+        if not self.enabled:
+            return None
+        threshold = self.tracker.percentile(self.percentile)
+        if threshold is None:
+            return None
+        return max(threshold, self.min_delay)
+
+    def try_acquire(self) -> bool:
+        """Проверяет бюджет и резервирует отправку одного дубликата"""
+        with self._lock:
+            if self.hedges + 1 > self.budget_ratio * self.requests:
+                self.budget_denied += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def record_win(self):
+        """Отмечает, что дубликат ответил раньше исходного запроса"""
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "budget_ratio": self.budget_ratio,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "budget_denied": self.budget_denied,
+            "latency": self.tracker.stats()
+        }
+
+
+class CircuitOpenError(DeepseekAPIError):
+    """Вызов отклонен: автоматический выключатель DeepSeek API разомкнут"""
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель вызовов LLM.
+
+    В замкнутом состоянии учитывает исходы последних вызовов; если доля сбоев
+    (ошибок сервера, сетевых ошибок и вызовов дольше порога медленного вызова модели)
+    превышает failure_rate, выключатель размыкается и вызовы сразу отклоняются.
+    Через open_seconds пропускается один пробный вызов (полуоткрытое состояние):
+    успех замыкает выключатель, сбой снова размыкает его.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self,
+                 enabled: bool = True,
+                 window: int = 20,
+                 min_calls: int = 5,
+                 failure_rate: float = 0.5,
+                 slow_call_threshold: Optional[float] = DEFAULT_SLOW_CALL_THRESHOLD,
+                 open_seconds: float = 30.0,
+                 slow_call_thresholds: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            enabled: Включен ли выключатель
+            window: Количество последних вызовов, по которым считается доля сбоев
+            min_calls: Минимум вызовов в окне для принятия решения
+            failure_rate: Доля сбоев, при которой выключатель размыкается
+            slow_call_threshold: Длительность вызова (сек), после которой он считается сбоем
+                (None - длительность не учитывается)
+            open_seconds: Время в разомкнутом состоянии до пробного вызова
+            slow_call_thresholds: Пороги медленного вызова для отдельных моделей
+                (остальные модели - slow_call_threshold)
+        """
+        self.enabled = enabled
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_threshold = slow_call_threshold
+        self.slow_call_thresholds = dict(slow_call_thresholds or {})
+        self.open_seconds = open_seconds
+
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        """
+        Создает выключатель с настройками из переменных окружения DEEPSEEK_BREAKER_*.
+        DEEPSEEK_BREAKER_SLOW_CALL задает один порог для всех моделей (0 - не учитывать
+        длительность), без него используются пороги SLOW_CALL_THRESHOLDS
+        """
+        slow_call_env = os.getenv("DEEPSEEK_BREAKER_SLOW_CALL")
+        slow_call = float(slow_call_env) if slow_call_env else DEFAULT_SLOW_CALL_THRESHOLD
+        return cls(
+            enabled=os.getenv("DEEPSEEK_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes"),
+            window=int(os.getenv("DEEPSEEK_BREAKER_WINDOW", "20")),
+            min_calls=int(os.getenv("DEEPSEEK_BREAKER_MIN_CALLS", "5")),
+            failure_rate=float(os.getenv("DEEPSEEK_BREAKER_FAILURE_RATE", "0.5")),
+            slow_call_threshold=slow_call if slow_call > 0 else None,
+            open_seconds=float(os.getenv("DEEPSEEK_BREAKER_OPEN_SECONDS", "30")),
+            slow_call_thresholds=None if slow_call_env else SLOW_CALL_THRESHOLDS
+        )
+
+    def slow_call_for(self, model: Optional[str] = None) -> Optional[float]:
+        """Возвращает порог медленного вызова для модели"""
+        if self.slow_call_threshold is None:
+            return None
+        return self.slow_call_thresholds.get(model, self.slow_call_threshold)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        """Состояние с учетом истечения времени размыкания (вызывается под self._lock)"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def is_open(self) -> bool:
+        """Проверяет, отклоняются ли сейчас вызовы (без резервирования пробного вызова)"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            state = self._current_state()
+            return state == self.OPEN or (state == self.HALF_OPEN and self._probe_in_flight)
+
+    def before_call(self) -> bool:
+        """
+        Разрешает вызов или отклоняет его
+
+        Returns:
+            True, если вызов является пробным (его исход решает судьбу выключателя)
+
+        Raises:
+            CircuitOpenError: Если выключатель разомкнут или пробный вызов уже выполняется
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return False
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+        raise CircuitOpenError("DeepSeek API временно недоступен (выключатель разомкнут)")
+
+    def record(self,
+               latency: Optional[float],
+               healthy: Optional[bool],
+               probe: bool = False,
+               model: Optional[str] = None):
+        """
+        Учитывает исход вызова, разрешенного before_call()
+
+        Args:
+            latency: Длительность обращения к API в секундах
+            healthy: True - API ответил, False - сбой API, None - запрос не был отправлен
+            probe: Результат before_call() для этого вызова
+            model: Модель вызова (определяет порог медленного вызова)
+        """
+        if not self.enabled:
+            return
+        slow_call = self.slow_call_for(model)
+        failed = healthy is False or (
+            healthy is True and latency is not None
+            and slow_call is not None and latency > slow_call
+        )
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+                if healthy is None:
+                    return
+                if failed:
+                    self._open()
+                else:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                return
+            if healthy is None or self._state != self.CLOSED:
+                return
+            self._outcomes.append(failed)
+            if (len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate):
+                self._open()
+
+    def _open(self):
+        """Размыкает выключатель (вызывается под self._lock)"""
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            outcomes = len(self._outcomes)
+            return {
+                "enabled": self.enabled,
+                "state": self._current_state(),
+                "window_calls": outcomes,
+                "window_failure_rate": round(sum(self._outcomes) / outcomes, 3) if outcomes else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected
+            }
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from typing import Dict, Any, Callable, Awaitable, Hashable
+
+
+class _Call:
+    """Выполняющийся синхронный вызов, результат которого ждут другие потоки"""
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые вызовы: пока вызов с ключом выполняется,
+    остальные вызовы с тем же ключом ждут его и получают тот же результат
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[tuple, asyncio.Task] = {}
+
+        # Счетчики для наблюдаемости
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Выполняет fn один раз для всех одновременных вызовов с ключом key
+
+        Args:
+            key: Ключ, определяющий одинаковые вызовы
+            fn: Функция без аргументов, выполняющая запрос
+
+        Returns:
+            Результат fn (общий для всех ожидающих)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Асинхронная версия do: корутина выполняется один раз в отдельной задаче,
+        поэтому отмена одного из ожидающих не отменяет запрос для остальных
+
+        Args:
+            key: Ключ, определяющий одинаковые вызовы
+            fn: Функция без аргументов, возвращающая корутину запроса
+
+        Returns:
+            Результат корутины (общий для всех ожидающих)
+        """
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key)
+
+        task = self._tasks.get(task_key)
+        if task is not None and not task.done():
+            self.coalesced += 1
+        else:
+            task = loop.create_task(fn())
+            self._tasks[task_key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda t: self._finish_task(task_key, t))
+
+        return await asyncio.shield(task)
+
+    def _finish_task(self, task_key: tuple, task: asyncio.Task):
+        """Убирает завершенную задачу и помечает ее исключение как обработанное"""
+        if self._tasks.get(task_key) is task:
+            del self._tasks[task_key]
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику объединения запросов
+
+        Returns:
+            Dictionary с количеством выполняющихся, исходных и объединенных вызовов
+        """
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "in_flight": in_flight + len(self._tasks),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
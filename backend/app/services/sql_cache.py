@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from typing import Dict, Any, Optional
+
+import pandas as pd
+
+from .cache import LRUCache
+
+# Представление, свежесть данных которого отслеживает водяной знак по умолчанию
+WATERMARK_RELATION = "test_staging.user_metrics_dashboard_optimized"
+
+# Запрос водяного знака свежести данных: счетчики записей в таблицы, от которых
+# (рекурсивно, через правила представлений) зависит {relation}, включая само представление,
+# если оно материализованное (REFRESH MATERIALIZED VIEW). Для представления с журналом
+# обновлений можно задать свой запрос в SQL_CACHE_WATERMARK_QUERY
+DEFAULT_WATERMARK_QUERY = """
+WITH RECURSIVE dependencies(relid) AS (
+    SELECT '{relation}'::regclass::oid
+    UNION
+    SELECT d.refobjid
+    FROM dependencies
+    JOIN pg_rewrite r ON r.ev_class = dependencies.relid
+    JOIN pg_depend d ON d.objid = r.oid
+        AND d.classid = 'pg_rewrite'::regclass
+        AND d.refclassid = 'pg_class'::regclass
+    WHERE d.refobjid <> dependencies.relid
+)
+SELECT COUNT(*)::text || ':' || COALESCE(SUM(s.n_tup_ins + s.n_tup_upd + s.n_tup_del), 0)::text AS watermark
+FROM pg_stat_user_tables s
+JOIN dependencies ON s.relid = dependencies.relid
+"""
+
+# Функции, результат которых зависит от момента выполнения, а не только от данных
+_VOLATILE = re.compile(
+    r"\b(now|random|current_date|current_time|current_timestamp|localtime|localtimestamp|"
+    r"clock_timestamp|statement_timestamp|timeofday|nextval|setval|setseed|gen_random_uuid)\b"
+)
+_READ_QUERY = re.compile(r"^\s*(select|with)\b")
+# Системные каталоги и статистика меняются без записи в пользовательские таблицы,
+# поэтому водяной знак не отражает их свежесть
+_CATALOG = re.compile(r"\b(pg_catalog|information_schema|pg_[a-z_]+)\b")
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Приводит SQL-запрос к каноническому виду: без комментариев, с одиночными пробелами,
+    ключевыми словами и идентификаторами в нижнем регистре и без завершающей точки с запятой.
+    Строковые литералы и идентификаторы в двойных кавычках не изменяются.
+
+    Args:
+        sql_query: SQL-запрос
+
+    Returns:
+        Нормализованный SQL-запрос
+    """
+    parts = []
+    i, length = 0, len(sql_query)
+    pending_space = False
+    while i < length:
+        char = sql_query[i]
+        if char in ("'", '"'):
+            # Литерал или идентификатор в кавычках ('' и "" внутри - экранированные кавычки)
+            end = i + 1
+            while end < length:
+                if sql_query[end] == char:
+                    if end + 1 < length and sql_query[end + 1] == char:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            token = sql_query[i:end + 1]
+            i = end + 1
+        elif sql_query.startswith("--", i):
+            end = sql_query.find("\n", i)
+            i = length if end == -1 else end
+            pending_space = True
+            continue
+        elif sql_query.startswith("/*", i):
+            end = sql_query.find("*/", i + 2)
+            i = length if end == -1 else end + 2
+            pending_space = True
+            continue
+        elif char.isspace():
+            pending_space = True
+            i += 1
+            continue
+        else:
+            end = i
+            while end < length and not sql_query[end].isspace() and sql_query[end] not in ("'", '"') \
+                    and not sql_query.startswith("--", end) and not sql_query.startswith("/*", end):
+                end += 1
+            token = sql_query[i:end].lower()
+            i = end
+        if pending_space and parts:
+            parts.append(" ")
+        pending_space = False
+        parts.append(token)
+    return "".join(parts).rstrip("; ")
+
+
+def sql_fingerprint(sql_query: str) -> str:
+    """Возвращает хэш нормализованного SQL-запроса"""
+    return hashlib.sha256(normalize_sql(sql_query).encode("utf-8")).hexdigest()[:32]
+
+
+def is_cacheable(sql_query: str) -> bool:
+    """
+    Проверяет, можно ли кэшировать результат запроса: только чтение (SELECT/WITH),
+    без функций, зависящих от времени выполнения (now(), CURRENT_DATE, random() и т.д.),
+    и без обращений к системным каталогам и статистике (pg_*, information_schema)
+    """
+    normalized = normalize_sql(sql_query)
+    # Литералы не проверяем: 'now' в строке не делает запрос изменчивым
+    code = re.sub(r"'(?:[^']|'')*'", "''", normalized)
+    return bool(_READ_QUERY.match(code)) and not _VOLATILE.search(code) and not _CATALOG.search(code)
+
+
+class SQLResultCache:
+    """
+    Кэш результатов SQL-запросов с ключом по отпечатку нормализованного запроса
+    и водяному знаку свежести данных.
+
+    Водяной знак запрашивается у базы не чаще раза в watermark_ttl секунд; когда данные
+    обновляются, знак меняется и старые записи перестают находиться (и вытесняются
+    по LRU). Если знак получить не удалось, результаты не кэшируются.
+    """
+
+    def __init__(self,
+                 max_entries: int = 256,
+                 max_bytes: int = 256 * 1024 * 1024,
+                 ttl: Optional[float] = 3600,
+                 watermark_ttl: float = 30,
+                 watermark_query: str = DEFAULT_WATERMARK_QUERY.format(relation=WATERMARK_RELATION)):
+        """
+        Args:
+            max_entries: Максимальное количество результатов в кэше
+            max_bytes: Максимальный суммарный объем результатов в байтах
+            ttl: Максимальное время жизни записи в секундах
+            watermark_ttl: Как долго (в секундах) используется полученный водяной знак
+            watermark_query: Запрос, возвращающий водяной знак одной строкой
+        """
+        self.watermark_ttl = watermark_ttl
+        self.watermark_query = watermark_query
+        self._cache = LRUCache(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            ttl=ttl,
+            size_fn=lambda frame: int(frame.memory_usage(index=True, deep=True).sum())
+        )
+        self._lock = threading.Lock()
+        # База (URL движка) -> (водяной знак или None, момент получения)
+        self._watermarks: Dict[str, tuple] = {}
+        self.bypassed = 0
+        self.watermark_errors = 0
+
+    @staticmethod
+    def _database_key(db_connection) -> str:
+        url = getattr(db_connection, "url", None)
+        return url.render_as_string(hide_password=True) if url is not None else str(id(db_connection))
+
+    def cached_watermark(self, db_connection) -> tuple:
+        """
+        Возвращает (действителен ли сохраненный водяной знак, значение)
+        """
+        with self._lock:
+            entry = self._watermarks.get(self._database_key(db_connection))
+        if entry is not None and time.monotonic() - entry[1] < self.watermark_ttl:
+            return True, entry[0]
+        return False, None
+
+    def store_watermark(self, db_connection, result: Dict[str, Any]) -> Optional[str]:
+        """
+        Сохраняет водяной знак из результата watermark_query
+
+        Args:
+            db_connection: Движок базы данных
+            result: Результат DatabaseTool.execute_query для watermark_query
+
+        Returns:
+            Водяной знак или None, если запрос не удался
+        """
+        watermark = None
+        if result["success"] and not result["data"].empty:
+            watermark = str(result["data"].iloc[0, 0])
+        else:
+            self.watermark_errors += 1
+            print(f"Не удалось получить водяной знак свежести данных, кэш SQL не используется: {result.get('error')}")
+        with self._lock:
+            self._watermarks[self._database_key(db_connection)] = (watermark, time.monotonic())
+        return watermark
+
+    def make_key(self, db_connection, sql_query: str, watermark: str) -> str:
+        """Формирует ключ записи по базе, отпечатку запроса и водяному знаку"""
+        database = hashlib.sha256(self._database_key(db_connection).encode("utf-8")).hexdigest()[:8]
+        return f"{database}:{sql_fingerprint(sql_query)}:{watermark}"
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Возвращает копию закэшированного результата или None"""
+        frame = self._cache.get(key)
+        return frame.copy() if frame is not None else None
+
+    def set(self, key: str, frame: pd.DataFrame):
+        """Сохраняет копию результата (вызывающий код может изменять свой DataFrame)"""
+        self._cache.set(key, frame.copy())
+
+    def bypass(self):
+        """Учитывает запрос, результат которого не кэшируется"""
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        """Очищает результаты и водяные знаки"""
+        self._cache.clear()
+        with self._lock:
+            self._watermarks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        with self._lock:
+            stats.update({
+                "bypassed": self.bypassed,
+                "watermark_errors": self.watermark_errors,
+                "watermark_ttl_seconds": self.watermark_ttl,
+                "watermarks": {database: value for database, (value, _) in self._watermarks.items()}
+            })
+        return stats
+
+
+# Общий кэш результатов SQL (создается при первом обращении)
+_sql_result_cache: Optional[SQLResultCache] = None
+_sql_result_cache_lock = threading.Lock()
+
+
+def get_sql_result_cache() -> Optional[SQLResultCache]:
+    """Возвращает общий кэш результатов SQL (None при SQL_CACHE_ENABLED=false)"""
+    global _sql_result_cache
+    if os.getenv("SQL_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    if _sql_result_cache is None:
+        with _sql_result_cache_lock:
+            if _sql_result_cache is None:
+                _sql_result_cache = SQLResultCache(
+                    max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", "256")),
+                    max_bytes=int(os.getenv("SQL_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+                    ttl=float(os.getenv("SQL_CACHE_TTL", "3600")),
+                    watermark_ttl=float(os.getenv("SQL_CACHE_WATERMARK_TTL", "30")),
+                    watermark_query=os.getenv("SQL_CACHE_WATERMARK_QUERY") or DEFAULT_WATERMARK_QUERY.format(
+                        relation=os.getenv("SQL_CACHE_WATERMARK_RELATION", WATERMARK_RELATION).replace("'", "''")
+                    )
+                )
+    return _sql_result_cache
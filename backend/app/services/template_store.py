@@ -0,0 +1,271 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+
+from ..metadata.dashboard_schema import COMMON_QUERIES
+from ..utils.query_normalizer import normalize_query, make_cache_key
+from .sql_cache import sql_fingerprint
+
+# Литерал даты (с необязательным временем, префиксом DATE/TIMESTAMP и приведением типа)
+_DATE_LITERAL = r"(?:(?:DATE|TIMESTAMP)\s+)?'\d{4}-\d{2}-\d{2}(?:[ T][0-9:.]+)?'(?:::\w+)?"
+_BETWEEN = re.compile(r"BETWEEN\s+" + _DATE_LITERAL + r"\s+AND\s+" + _DATE_LITERAL, re.IGNORECASE)
+_LOWER_BOUND = re.compile(r"(>=?)\s*" + _DATE_LITERAL)
+_UPPER_BOUND = re.compile(r"(<=?)\s*" + _DATE_LITERAL)
+_ANY_DATE = re.compile(_DATE_LITERAL)
+# Строгие границы, сохраненные ранними версиями parameterize_sql с параметрами включительного периода
+_LEGACY_STRICT_BOUNDS = ((re.compile(r"<\s*'\{end_date\}'"), "< '{end_date_next}'"),
+                         (re.compile(r">\s*'\{start_date\}'"), "> '{start_date_prev}'"))
+
+
+def parameterize_sql(sql_query: str) -> Optional[str]:
+    """
+    Заменяет границы периода в SQL-запросе на параметры шаблона. Период запроса
+    пользователя задается включительно ({start_date} - первый, {end_date} - последний день),
+    поэтому строгие границы заменяются соседними днями: "< дата" - на "< '{end_date_next}'",
+    "> дата" - на "> '{start_date_prev}'"
+
+    Args:
+        sql_query: SQL-запрос, сгенерированный моделью
+
+    Returns:
+        Шаблон SQL-запроса или None, если в запросе остались даты, которые
+        нельзя однозначно отнести к началу или концу периода
+    """
+    sql = sql_query.strip().rstrip(";")
+    if not re.match(r"^\s*(SELECT|WITH)\b", sql, re.IGNORECASE):
+        return None
+
+    # Фигурные скобки самого запроса экранируем для str.format
+    sql = sql.replace("{", "{{").replace("}", "}}")
+    sql = _BETWEEN.sub("BETWEEN '{start_date}' AND '{end_date}'", sql)
+    sql = _LOWER_BOUND.sub(
+        lambda m: ">= '{start_date}'" if m.group(1) == ">=" else "> '{start_date_prev}'", sql
+    )
+    sql = _UPPER_BOUND.sub(
+        lambda m: "<= '{end_date}'" if m.group(1) == "<=" else "< '{end_date_next}'", sql
+    )
+    if _ANY_DATE.search(sql):
+        return None
+    return sql
+
+
+def has_period_parameters(sql_template: str) -> bool:
+    """
+    Проверяет, задается ли период шаблона параметрами. Шаблон без них (SQL без дат
+    или с относительными датами) подходит только для запросов без периода
+    """
+    return "{start_date" in sql_template or "{end_date" in sql_template
+
+
+# SQL-запросы встроенных шаблонов: такой же выученный шаблон в быстрый путь не добавляется
+_BUILTIN_FINGERPRINTS = frozenset(sql_fingerprint(template["sql"]) for template in COMMON_QUERIES)
+
+
+class LearnedTemplateStore:
+    """
+    Хранилище шаблонов, выученных по успешным ответам LLM.
+
+    Каждый успешный SQL-запрос параметризуется по датам и учитывается вместе
+    с формулировкой запроса и типом визуализации. Когда один и тот же шаблон
+    встречается для запросов одного вида (нормализованный запрос без периода)
+    promote_after раз, он переводится в шаблоны быстрого пути: DashboardService
+    ищет по встроенным шаблонам схемы и по списку templates() хранилища.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 promote_after: int = 3,
+                 max_entries: int = 500,
+                 max_examples: int = 5):
+        """
+        Args:
+            path: JSON-файл для сохранения состояния между перезапусками (None - только в памяти)
+            promote_after: Число наблюдений, после которого шаблон используется в быстром пути
+            max_entries: Максимальное число отслеживаемых шаблонов (вытесняются давно не встречавшиеся)
+            max_examples: Максимальное число сохраняемых формулировок на шаблон
+        """
+        self.path = path
+        self.promote_after = promote_after
+        self.max_entries = max_entries
+        self.max_examples = max_examples
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Шаблоны быстрого пути и номер версии списка (растет при каждом добавлении)
+        self._templates: List[Dict[str, Any]] = []
+        self._version = 0
+        self._observed = 0
+        self._skipped = 0
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            for entry in entries:
+                for pattern, replacement in _LEGACY_STRICT_BOUNDS:
+                    entry["sql"] = pattern.sub(replacement, entry["sql"])
+                # Отпечаток SQL в ключе пересчитывается: он мог быть сохранен в другом формате
+                entry["key"] = entry["key"].rsplit(":", 1)[0] + ":" + sql_fingerprint(entry["sql"])
+                self._entries[entry["key"]] = entry
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Не удалось загрузить выученные шаблоны из {self.path}: {str(e)}")
+            self._entries.clear()
+            return
+        for entry in self._entries.values():
+            if entry["promoted"]:
+                self._add_template(entry)
+
+    def _add_template(self, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Добавляет шаблон записи в быстрый путь (вызывается под self._lock)
+
+        Returns:
+            Шаблон или None, если такой SQL-запрос уже есть среди шаблонов
+        """
+        fingerprint = sql_fingerprint(entry["sql"])
+        if fingerprint in _BUILTIN_FINGERPRINTS or any(
+                sql_fingerprint(template["sql"]) == fingerprint for template in self._templates):
+            return None
+        template = self._as_template(entry)
+        self._templates.append(template)
+        self._version += 1
+        return template
+
+    def _save(self):
+        """Сохраняет состояние в файл (вызывается под self._lock)"""
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self._entries.values()), f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Не удалось сохранить выученные шаблоны в {self.path}: {str(e)}")
+
+    def observe(self,
+                query_text: str,
+                sql_query: str,
+                visualization_type: str,
+                title: str) -> Optional[Dict[str, Any]]:
+        """
+        Учитывает успешный ответ LLM
+
+        Args:
+            query_text: Текстовый запрос пользователя
+            sql_query: Выполненный SQL-запрос
+            visualization_type: Тип визуализации
+            title: Заголовок результата
+
+        Returns:
+            Шаблон в формате common_queries, если он только что добавлен в быстрый путь, иначе None
+        """
+        sql = parameterize_sql(sql_query)
+        normalized = normalize_query(query_text)
+        periods = normalized.pop("period")
+        with self._lock:
+            self._observed += 1
+            # Период запроса, не выраженный параметрами шаблона, шаблон проигнорировал бы
+            if sql is None or (periods and not has_period_parameters(sql)):
+                self._skipped += 1
+                return None
+
+            key = make_cache_key(normalized, namespace="template") + ":" + sql_fingerprint(sql)
+
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {
+                    "key": key,
+                    "sql": sql,
+                    "visualization_type": visualization_type or "line",
+                    "title": title,
+                    "examples": [],
+                    "count": 0,
+                    "promoted": False
+                }
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            entry["count"] += 1
+            entry["last_seen"] = time.time()
+            if query_text not in entry["examples"] and len(entry["examples"]) < self.max_examples:
+                entry["examples"].append(query_text)
+
+            # Вытесняем давно не встречавшиеся шаблоны, кроме уже используемых
+            while len(self._entries) > self.max_entries:
+                for candidate_key, candidate in self._entries.items():
+                    if not candidate["promoted"]:
+                        del self._entries[candidate_key]
+                        break
+                else:
+                    break
+
+            promoted = None
+            if not entry["promoted"] and entry["count"] >= self.promote_after:
+                entry["promoted"] = True
+                promoted = self._add_template(entry)
+            self._save()
+            return promoted
+
+    @staticmethod
+    def _as_template(entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Преобразует запись в шаблон формата common_queries"""
+        return {
+            "name": entry["title"] or entry["examples"][0],
+            "sql": entry["sql"],
+            "visualization_type": entry["visualization_type"],
+            "keywords": [],
+            "examples": list(entry["examples"]),
+            "learned": True
+        }
+
+    def templates(self) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Возвращает шаблоны быстрого пути
+
+        Returns:
+            Кортеж (список шаблонов, версия списка) - по версии DashboardService
+            определяет, нужно ли перестроить индекс шаблонов
+        """
+        with self._lock:
+            return list(self._templates), self._version
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику хранилища"""
+        with self._lock:
+            return {
+                "observed": self._observed,
+                "skipped": self._skipped,
+                "entries": len(self._entries),
+                "promoted": sum(1 for entry in self._entries.values() if entry["promoted"]),
+                "templates": len(self._templates),
+                "promote_after": self.promote_after
+            }
+
+
+# Общее хранилище выученных шаблонов (создается при первом обращении)
+_template_store: Optional[LearnedTemplateStore] = None
+_template_store_lock = threading.Lock()
+
+
+def get_template_store() -> Optional[LearnedTemplateStore]:
+    """
+    Возвращает общее хранилище выученных шаблонов (None при LEARNED_TEMPLATES_ENABLED=false)
+    """
+    global _template_store
+    if os.getenv("LEARNED_TEMPLATES_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    if _template_store is None:
+        with _template_store_lock:
+            if _template_store is None:
+                _template_store = LearnedTemplateStore(
+                    path=os.getenv("LEARNED_TEMPLATES_PATH") or None,
+                    promote_after=int(os.getenv("LEARNED_TEMPLATES_PROMOTE_AFTER", "3")),
+                    max_entries=int(os.getenv("LEARNED_TEMPLATES_MAX_ENTRIES", "500"))
+                )
+    return _template_store
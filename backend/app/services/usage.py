@@ -0,0 +1,255 @@
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple
+
+from ..utils.column_selector import estimate_tokens
+
+# Маршрут обработки запроса (agents, deepseek и т.д.), к которому относятся вызовы LLM
+_llm_route: contextvars.ContextVar = contextvars.ContextVar("llm_route", default="direct")
+# Учет вызовов LLM в рамках текущего запроса пользователя
+_usage_recorder: contextvars.ContextVar = contextvars.ContextVar("usage_recorder", default=None)
+
+
+@contextmanager
+def llm_route(route: str):
+    """
+    Задает маршрут, к которому относятся все вызовы LLM внутри блока
+
+    Args:
+        route: Название маршрута обработки запроса
+    """
+    token = _llm_route.set(route)
+    try:
+        yield
+    finally:
+        _llm_route.reset(token)
+
+
+def current_llm_route() -> str:
+    """Возвращает маршрут вызовов LLM в текущем контексте"""
+    return _llm_route.get()
+
+
+def extract_token_usage(usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Приводит блок usage ответа API к единому набору счетчиков токенов
+
+    Args:
+        usage: Блок usage из ответа DeepSeek (OpenAI-совместимый формат)
+
+    Returns:
+        Dictionary с prompt, completion, cached и reasoning токенами
+    """
+    usage = usage or {}
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    completion_details = usage.get("completion_tokens_details") or {}
+    # DeepSeek сообщает попадания в кэш префикса отдельным полем
+    cached = usage.get("prompt_cache_hit_tokens", prompt_details.get("cached_tokens", 0))
+    return {
+        "prompt_tokens": int(usage.get("prompt_tokens") or 0),
+        "completion_tokens": int(usage.get("completion_tokens") or 0),
+        "cached_tokens": int(cached or 0),
+        "reasoning_tokens": int(completion_details.get("reasoning_tokens") or 0)
+    }
+
+
+class UsageStats:
+    """Накопительная статистика вызовов LLM в разрезе агентов и маршрутов"""
+
+    _COUNTERS = (
+        "calls", "cache_hits", "coalesced", "errors", "api_calls",
+        "prompt_tokens", "completion_tokens", "cached_tokens", "reasoning_tokens",
+        "prompt_chars", "prompt_chars_saved"
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def _bucket(self, agent: str, route: str) -> Dict[str, Any]:
+        """Возвращает счетчики пары (агент, маршрут) (вызывается под self._lock)"""
+        key = (agent, route)
+        bucket = self._totals.get(key)
+        if bucket is None:
+            bucket = {name: 0 for name in self._COUNTERS}
+            bucket.update({"latency_total": 0.0, "latency_max": 0.0, "max_prompt_tokens": 0, "models": set()})
+            self._totals[key] = bucket
+        return bucket
+
+    def record_call(self, agent: str, route: str, latency: float, source: str, prompt_chars: int):
+        """
+        Учитывает логический вызов LLM с точки зрения вызывающего кода
+
+        Args:
+            agent: Агент, выполнивший вызов
+            route: Маршрут обработки запроса
+            latency: Длительность вызова в секундах (с ожиданием в очереди и повторами)
+            source: "api", "cache", "coalesced" (ответ получен вместе с другим вызовом)
+                или "error"
+            prompt_chars: Размер промпта (системное сообщение + запрос) в символах
+        """
+        with self._lock:
+            bucket = self._bucket(agent, route)
+            bucket["calls"] += 1
+            if source == "cache":
+                bucket["cache_hits"] += 1
+            elif source == "coalesced":
+                bucket["coalesced"] += 1
+            elif source == "error":
+                bucket["errors"] += 1
+            bucket["prompt_chars"] += prompt_chars
+            bucket["latency_total"] += latency
+            bucket["latency_max"] = max(bucket["latency_max"], latency)
+
+    def record_prompt_savings(self, agent: str, route: str, chars_saved: int):
+        """
+        Учитывает сокращение промпта (например, за счет отбора столбцов)
+
+        Args:
+            agent: Агент, для которого собран промпт
+            route: Маршрут обработки запроса
+            chars_saved: На сколько символов промпт короче полного
+        """
+        with self._lock:
+            self._bucket(agent, route)["prompt_chars_saved"] += chars_saved
+
+    def record_tokens(self, agent: str, route: str, model: str, tokens: Dict[str, int]):
+        """
+        Учитывает токены фактического обращения к API
+
+        Args:
+            agent: Агент, выполнивший вызов
+            route: Маршрут обработки запроса
+            model: Модель, вернувшая ответ
+            tokens: Счетчики токенов из extract_token_usage
+        """
+        with self._lock:
+            bucket = self._bucket(agent, route)
+            bucket["api_calls"] += 1
+            for name, value in tokens.items():
+                bucket[name] += value
+            bucket["max_prompt_tokens"] = max(bucket["max_prompt_tokens"], tokens["prompt_tokens"])
+            bucket["models"].add(model)
+
+    @staticmethod
+    def _render(bucket: Dict[str, Any]) -> Dict[str, Any]:
+        rendered = {name: bucket[name] for name in UsageStats._COUNTERS}
+        rendered["max_prompt_tokens"] = bucket["max_prompt_tokens"]
+        rendered["prompt_tokens_saved_est"] = estimate_tokens(bucket["prompt_chars_saved"])
+        rendered["avg_latency_ms"] = (
+            round(bucket["latency_total"] / bucket["calls"] * 1000, 1) if bucket["calls"] else 0.0
+        )
+        rendered["max_latency_ms"] = round(bucket["latency_max"] * 1000, 1)
+        rendered["models"] = sorted(bucket["models"])
+        return rendered
+
+    def _merge(self, keys: List[Tuple[str, str]]) -> Dict[str, Any]:
+        """Суммирует счетчики нескольких пар (вызывается под self._lock)"""
+        merged = {name: 0 for name in self._COUNTERS}
+        merged.update({"latency_total": 0.0, "latency_max": 0.0, "max_prompt_tokens": 0, "models": set()})
+        for key in keys:
+            bucket = self._totals[key]
+            for name in self._COUNTERS:
+                merged[name] += bucket[name]
+            merged["latency_total"] += bucket["latency_total"]
+            merged["latency_max"] = max(merged["latency_max"], bucket["latency_max"])
+            merged["max_prompt_tokens"] = max(merged["max_prompt_tokens"], bucket["max_prompt_tokens"])
+            merged["models"] |= bucket["models"]
+        return self._render(merged)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Возвращает сводку по агентам, маршрутам и итог
+
+        Returns:
+            Dictionary с разделами by_agent, by_route и total
+        """
+        with self._lock:
+            keys = list(self._totals)
+            agents = sorted({agent for agent, _ in keys})
+            routes = sorted({route for _, route in keys})
+            return {
+                "by_agent": {a: self._merge([k for k in keys if k[0] == a]) for a in agents},
+                "by_route": {r: self._merge([k for k in keys if k[1] == r]) for r in routes},
+                "total": self._merge(keys)
+            }
+
+
+class UsageRecorder(UsageStats):
+    """Учет вызовов LLM одного запроса пользователя (с перечнем вызовов)"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: List[Dict[str, Any]] = []
+
+    def record_call(self, agent: str, route: str, latency: float, source: str, prompt_chars: int):
+        super().record_call(agent, route, latency, source, prompt_chars)
+        with self._lock:
+            self.calls.append({
+                "agent": agent,
+                "route": route,
+                "source": source,
+                "latency_ms": round(latency * 1000, 1),
+                "prompt_chars": prompt_chars
+            })
+
+    def summary(self) -> Dict[str, Any]:
+        summary = super().summary()
+        with self._lock:
+            summary["calls"] = list(self.calls)
+        return summary
+
+
+# Статистика вызовов LLM за время работы процесса
+_usage_stats = UsageStats()
+
+
+def get_usage_stats() -> UsageStats:
+    """Возвращает накопительную статистику вызовов LLM процесса"""
+    return _usage_stats
+
+
+@contextmanager
+def track_llm_usage():
+    """
+    Собирает вызовы LLM внутри блока (включая asyncio.to_thread и задачи,
+    которые наследуют контекст) в отдельный UsageRecorder
+
+    Yields:
+        UsageRecorder текущего блока
+    """
+    recorder = UsageRecorder()
+    token = _usage_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _usage_recorder.reset(token)
+
+
+def record_llm_call(agent: str, latency: float, source: str, prompt_chars: int):
+    """Учитывает логический вызов LLM в статистике процесса и текущего запроса"""
+    route = current_llm_route()
+    _usage_stats.record_call(agent, route, latency, source, prompt_chars)
+    recorder = _usage_recorder.get()
+    if recorder is not None:
+        recorder.record_call(agent, route, latency, source, prompt_chars)
+
+
+def record_prompt_savings(agent: str, chars_saved: int):
+    """Учитывает сокращение промпта в статистике процесса и текущего запроса"""
+    route = current_llm_route()
+    _usage_stats.record_prompt_savings(agent, route, chars_saved)
+    recorder = _usage_recorder.get()
+    if recorder is not None:
+        recorder.record_prompt_savings(agent, route, chars_saved)
+
+
+def record_llm_tokens(agent: str, model: str, usage: Optional[Dict[str, Any]]):
+    """Учитывает токены фактического обращения к API в статистике процесса и текущего запроса"""
+    route = current_llm_route()
+    tokens = extract_token_usage(usage)
+    _usage_stats.record_tokens(agent, route, model, tokens)
+    recorder = _usage_recorder.get()
+    if recorder is not None:
+        recorder.record_tokens(agent, route, model, tokens)
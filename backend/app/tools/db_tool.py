@@ -1,34 +1,124 @@
+import os
+import asyncio
 import pandas as pd
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import datetime
 import json
 
+from ..database.connection import get_async_pool, acquire_async_connection
+from ..services.sql_cache import get_sql_result_cache, is_cacheable
+
 class DatabaseTool:
     """Инструмент для выполнения запросов к базе данных"""
     
     def __init__(self, db_connection):
         self.db_connection = db_connection
+        # Число строк, получаемых с сервера за одно обращение курсора (execute_query_async)
+        self.fetch_size = int(os.getenv("DB_FETCH_SIZE", "1000"))
+        # Общий кэш результатов запросов (None - кэширование отключено)
+        self.result_cache = get_sql_result_cache()
+    
+    @staticmethod
+    def _prepare_frame(result: pd.DataFrame) -> pd.DataFrame:
+        """Преобразует типы данных результата для JSON-сериализации"""
+        for col in result.columns:
+            # Любая точность и временная зона (datetime64[us], datetime64[ns, UTC] и т.д.)
+            if pd.api.types.is_datetime64_any_dtype(result[col]) or pd.api.types.is_timedelta64_dtype(result[col]):
+                result[col] = result[col].astype(str)
+        return result
         
-    def execute_query(self, sql_query: str) -> Dict[str, Any]:
+    def _cache_key(self, sql_query: str, watermark: Optional[str]) -> Optional[str]:
+        """Возвращает ключ кэша результата или None, если результат не кэшируется"""
+        if watermark is None:
+            return None
+        return self.result_cache.make_key(self.db_connection, sql_query, watermark)
+    
+    def _cacheable(self, sql_query: str) -> bool:
+        if self.result_cache is None:
+            return False
+        if not is_cacheable(sql_query):
+            self.result_cache.bypass()
+            return False
+        return True
+    
+    def _watermark(self) -> Optional[str]:
+        """Водяной знак свежести данных (запрашивается не чаще раза в watermark_ttl)"""
+        valid, watermark = self.result_cache.cached_watermark(self.db_connection)
+        if valid:
+            return watermark
+        return self.result_cache.store_watermark(
+            self.db_connection, self._execute(self.result_cache.watermark_query)
+        )
+    
+    async def _watermark_async(self) -> Optional[str]:
+        """Асинхронная версия метода _watermark"""
+        valid, watermark = self.result_cache.cached_watermark(self.db_connection)
+        if valid:
+            return watermark
+        return self.result_cache.store_watermark(
+            self.db_connection, await self._execute_async(self.result_cache.watermark_query)
+        )
+    
+    def execute_query(self,
+                      sql_query: str,
+                      statement_timeout_ms: Optional[int] = None,
+                      use_cache: bool = True,
+                      read_only: bool = False) -> Dict[str, Any]:
         """
-        Выполняет SQL-запрос и возвращает результаты
+        Выполняет SQL-запрос и возвращает результаты. Результаты запросов на чтение
+        берутся из кэша, пока не изменился водяной знак свежести данных.
         
         Args:
             sql_query: SQL-запрос для выполнения
+            statement_timeout_ms: statement_timeout PostgreSQL для этого запроса
+                (None - настройка профиля пула)
+            use_cache: Использовать ли кэш результатов (False - для произвольных запросов,
+                свежесть которых водяной знак не отслеживает)
+            read_only: Выполнить запрос в транзакции READ ONLY (PostgreSQL): сервер
+                отклонит любую запись, в том числе из вызываемых запросом функций
             
         Returns:
             Dictionary с результатами и статусом запроса
         """
+        if not use_cache or not self._cacheable(sql_query):
+            return self._execute(sql_query, statement_timeout_ms, read_only)
+        
+        key = self._cache_key(sql_query, self._watermark())
+        cached = self.result_cache.get(key) if key else None
+        if cached is not None:
+            return {"success": True, "data": cached, "error": None}
+        
+        result = self._execute(sql_query, statement_timeout_ms, read_only)
+        if key and result["success"]:
+            self.result_cache.set(key, result["data"])
+        return result
+    
+    def _supports_statement_timeout(self) -> bool:
+        url = getattr(self.db_connection, "url", None)
+        return url is not None and url.get_backend_name() == "postgresql"
+    
+    def _execute(self,
+                 sql_query: str,
+                 statement_timeout_ms: Optional[int] = None,
+                 read_only: bool = False) -> Dict[str, Any]:
+        """Выполняет SQL-запрос без кэша"""
         try:
             # Выполнение запроса
-            result = pd.read_sql(sql_query, self.db_connection)
+            if (statement_timeout_ms or read_only) and self._supports_statement_timeout():
+                # SET TRANSACTION и SET LOCAL действуют до конца транзакции и не переходят
+                # на следующие запросы, получившие это соединение из пула
+                with self.db_connection.begin() as connection:
+                    if read_only:
+                        # Режим транзакции задается до первого запроса в ней
+                        connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+                    if statement_timeout_ms:
+                        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}")
+                    result = pd.read_sql(sql_query, connection)
+            else:
+                result = pd.read_sql(sql_query, self.db_connection)
             
             # Преобразование типов данных для JSON-сериализации
-            for col in result.columns:
-                if result[col].dtype == 'datetime64[ns]':
-                    result[col] = result[col].astype(str)
-                elif result[col].dtype == 'timedelta64[ns]':
-                    result[col] = result[col].astype(str)
+            result = self._prepare_frame(result)
             
             return {
                 "success": True,
@@ -42,6 +132,118 @@ class DatabaseTool:
                 "error": str(e)
             }
     
+    async def execute_query_async(self,
+                                  sql_query: str,
+                                  timeout: Optional[float] = None,
+                                  fetch_size: Optional[int] = None,
+                                  statement_timeout_ms: Optional[int] = None,
+                                  use_cache: bool = True,
+                                  read_only: bool = False) -> Dict[str, Any]:
+        """
+        Асинхронная версия метода execute_query: запрос выполняется через asyncpg
+        без занятия потока, а ожидание можно отменить (отмена задачи отменяет
+        запрос на сервере). Без asyncpg запрос выполняется в потоке.
+        Кэш результатов общий с execute_query.
+        
+        Args:
+            sql_query: SQL-запрос для выполнения
+            timeout: Максимальное время выполнения в секундах (None - без ограничения,
+                действует statement_timeout профиля пула)
+            fetch_size: Число строк за одно обращение курсора (по умолчанию DB_FETCH_SIZE)
+            statement_timeout_ms: statement_timeout PostgreSQL для этого запроса: в отличие
+                от timeout, запрос прерывается на сервере и при выполнении в потоке
+            use_cache: Использовать ли кэш результатов (как в execute_query)
+            read_only: Выполнить запрос в транзакции READ ONLY (как в execute_query)
+            
+        Returns:
+            Dictionary с результатами и статусом запроса (как в execute_query)
+        """
+        if not use_cache or not self._cacheable(sql_query):
+            return await self._execute_async(sql_query, timeout, fetch_size, statement_timeout_ms, read_only)
+        
+        key = self._cache_key(sql_query, await self._watermark_async())
+        cached = self.result_cache.get(key) if key else None
+        if cached is not None:
+            return {"success": True, "data": cached, "error": None}
+        
+        result = await self._execute_async(sql_query, timeout, fetch_size, statement_timeout_ms, read_only)
+        if key and result["success"]:
+            self.result_cache.set(key, result["data"])
+        return result
+    
+    async def _execute_async(self,
+                             sql_query: str,
+                             timeout: Optional[float] = None,
+                             fetch_size: Optional[int] = None,
+                             statement_timeout_ms: Optional[int] = None,
+                             read_only: bool = False) -> Dict[str, Any]:
+        """Выполняет SQL-запрос без кэша (asyncpg или поток)"""
+        try:
+            pool = await get_async_pool(self.db_connection)
+        except Exception as e:
+            print(f"Асинхронный пул БД недоступен, запрос выполняется в потоке: {str(e)}")
+            pool = None
+        if pool is None:
+            if timeout is None:
+                return await asyncio.to_thread(self._execute, sql_query, statement_timeout_ms, read_only)
+            try:
+                return await asyncio.wait_for(
+                    asyncio.to_thread(self._execute, sql_query, statement_timeout_ms, read_only), timeout
+                )
+            except asyncio.TimeoutError:
+                return {"success": False, "data": None,
+                        "error": f"Превышено время выполнения запроса ({timeout} с)"}
+        
+        try:
+            fetch = self._fetch_async(
+                pool, sql_query, fetch_size or self.fetch_size, statement_timeout_ms, read_only
+            )
+            columns, rows = await (asyncio.wait_for(fetch, timeout) if timeout is not None else fetch)
+            
+            # Преобразование типов данных для JSON-сериализации
+            # coerce_float: numeric (Decimal в asyncpg) -> float, как в pd.read_sql
+            result = self._prepare_frame(pd.DataFrame.from_records(rows, columns=columns, coerce_float=True))
+            
+            return {
+                "success": True,
+                "data": result,
+                "error": None
+            }
+        except asyncio.TimeoutError:
+            return {
+                "success": False,
+                "data": None,
+                "error": f"Превышено время выполнения запроса ({timeout} с)"
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "data": None,
+                "error": str(e)
+            }
+    
+    async def _fetch_async(self, pool, sql_query: str, fetch_size: int,
+                           statement_timeout_ms: Optional[int] = None,
+                           read_only: bool = False):
+        """
+        Выполняет запрос серверным курсором и получает строки порциями по fetch_size
+        
+        Returns:
+            Кортеж (имена столбцов, список строк)
+        """
+        connection = await acquire_async_connection(self.db_connection, pool)
+        try:
+            # Курсор asyncpg работает только внутри транзакции
+            async with connection.transaction(readonly=read_only):
+                if statement_timeout_ms:
+                    await connection.execute(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}")
+                statement = await connection.prepare(sql_query)
+                columns = [attribute.name for attribute in statement.get_attributes()]
+                rows = [tuple(record) async for record in statement.cursor(prefetch=fetch_size)]
+            return columns, rows
+        finally:
+            await pool.release(connection)
+    
     def get_metadata(self) -> Dict[str, Any]:
         """
         Получает метаданные базы данных
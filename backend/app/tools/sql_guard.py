@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import threading
+from typing import Dict, Any, Optional
+
+from ..services.cache import LRUCache
+from ..services.sql_cache import normalize_sql, sql_fingerprint
+
+# Запросы на чтение: сгенерированный моделью SQL не должен изменять данные
+_READ_QUERY = re.compile(r"^\s*(select|with)\b")
+_WRITE_STATEMENT = re.compile(
+    r"\b(insert|update|delete|merge|truncate|drop|alter|create|grant|revoke|copy|vacuum|call|do)\b"
+)
+# Функции, опасные и в транзакции READ ONLY: управление сеансами и настройками,
+# ожидание, доступ к файлам сервера и внешним соединениям
+_UNSAFE_FUNCTION = re.compile(
+    r"\b(pg_terminate_backend|pg_cancel_backend|pg_reload_conf|pg_rotate_logfile|set_config|"
+    r"pg_sleep\w*|pg_advisory\w*|pg_read_\w+|pg_ls_\w+|pg_stat_file|lo_\w+|dblink\w*)\s*\("
+)
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+class SQLGuard:
+    """
+    Предварительная проверка SQL-запросов, сгенерированных LLM, перед выполнением.
+
+    Для запроса выполняется EXPLAIN (FORMAT JSON) (только планирование, без выполнения).
+    Если планировщик ожидает больше max_rows строк, запрос оборачивается в
+    SELECT ... LIMIT row_limit и проверяется повторно; если оценка стоимости превышает
+    max_cost, запрос отклоняется. Разрешенный запрос выполняется с statement_timeout,
+    поэтому даже при ошибке оценки он не занимает соединение пула дольше лимита.
+    EXPLAIN и запрос выполняются в транзакции READ ONLY: запись запрещает сервер,
+    а validate() - лишь быстрый предварительный фильтр. Решения кэшируются
+    по отпечатку нормализованного запроса.
+    """
+
+    def __init__(self,
+                 db_tool,
+                 max_cost: float = 1000000,
+                 max_rows: int = 100000,
+                 row_limit: int = 10000,
+                 statement_timeout_ms: int = 15000,
+                 verdict_ttl: Optional[float] = 600):
+        """
+        Args:
+            db_tool: DatabaseTool, через который выполняются EXPLAIN и сам запрос
+            max_cost: Максимальная оценка стоимости плана (total_cost планировщика)
+            max_rows: Максимальная ожидаемая планировщиком длина результата
+            row_limit: LIMIT для запросов, результат которых длиннее max_rows
+            statement_timeout_ms: statement_timeout для EXPLAIN и запроса (0 - настройка пула)
+            verdict_ttl: Время жизни решения о запросе в секундах
+        """
+        self.db_tool = db_tool
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.row_limit = row_limit
+        self.statement_timeout_ms = statement_timeout_ms or None
+        self._verdicts = LRUCache(max_entries=512, max_bytes=4 * 1024 * 1024, ttl=verdict_ttl)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.limited = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls, db_tool) -> Optional["SQLGuard"]:
+        """
+        Создает проверку с настройками из переменных окружения
+
+        Returns:
+            SQLGuard или None при SQL_GUARD_ENABLED=false
+        """
+        if os.getenv("SQL_GUARD_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            db_tool,
+            max_cost=float(os.getenv("SQL_GUARD_MAX_COST", "1000000")),
+            max_rows=int(os.getenv("SQL_GUARD_MAX_ROWS", "100000")),
+            row_limit=int(os.getenv("SQL_GUARD_ROW_LIMIT", "10000")),
+            statement_timeout_ms=int(os.getenv("SQL_GUARD_STATEMENT_TIMEOUT_MS", "15000")),
+            verdict_ttl=float(os.getenv("SQL_GUARD_VERDICT_TTL", "600"))
+        )
+
+    @staticmethod
+    def validate(sql_query: str) -> Optional[str]:
+        """
+        Быстрый предварительный фильтр: запрос - один оператор чтения без опасных
+        функций. Запись надежно запрещает транзакция READ ONLY при выполнении
+
+        Returns:
+            Текст ошибки или None, если запрос допустим
+        """
+        code = _LITERAL.sub("''", normalize_sql(sql_query))
+        if not _READ_QUERY.match(code):
+            return "Разрешены только запросы SELECT/WITH"
+        if ";" in code:
+            return "Разрешен только один SQL-оператор"
+        if _WRITE_STATEMENT.search(code):
+            return "Запрос содержит операторы изменения данных"
+        if _UNSAFE_FUNCTION.search(code):
+            return "Запрос содержит недопустимые служебные функции"
+        return None
+
+    def limit_query(self, sql_query: str) -> str:
+        """Оборачивает запрос в SELECT с ограничением числа строк"""
+        body = sql_query.strip().rstrip(";").strip()
+        return f"SELECT * FROM (\n{body}\n) AS limited_query LIMIT {self.row_limit}"
+
+    @staticmethod
+    def parse_plan(frame) -> Dict[str, Any]:
+        """
+        Извлекает оценки из результата EXPLAIN (FORMAT JSON)
+
+        Args:
+            frame: DataFrame с единственной ячейкой плана (psycopg2 возвращает
+                разобранный JSON, asyncpg - строку)
+
+        Returns:
+            Dictionary с оценками стоимости и числа строк корневого узла плана
+        """
+        value = frame.iloc[0, 0]
+        if isinstance(value, (str, bytes)):
+            value = json.loads(value)
+        plan = value[0]["Plan"]
+        return {
+            "total_cost": float(plan["Total Cost"]),
+            "startup_cost": float(plan["Startup Cost"]),
+            "plan_rows": int(plan["Plan Rows"]),
+            "node_type": plan.get("Node Type")
+        }
+
+    def _applies(self) -> bool:
+        """EXPLAIN (FORMAT JSON) есть только в PostgreSQL"""
+        url = getattr(self.db_tool.db_connection, "url", None)
+        return url is not None and url.get_backend_name() == "postgresql"
+
+    async def _explain_async(self, sql_query: str) -> Dict[str, Any]:
+        # EXPLAIN выполняется мимо кэша результатов
+        result = await self.db_tool._execute_async(
+            f"EXPLAIN (FORMAT JSON) {sql_query.strip().rstrip(';')}",
+            statement_timeout_ms=self.statement_timeout_ms,
+            read_only=True
+        )
+        if not result["success"]:
+            raise Exception(result["error"])
+        return self.parse_plan(result["data"])
+
+    async def check_async(self, sql_query: str) -> Dict[str, Any]:
+        """
+        Проверяет запрос и при необходимости добавляет LIMIT
+
+        Args:
+            sql_query: SQL-запрос, сгенерированный LLM
+
+        Returns:
+            Dictionary с полями allowed, sql_query (запрос для выполнения),
+            cost_estimate и error
+        """
+        error = self.validate(sql_query)
+        if error:
+            return self._count(self._verdict(sql_query, None, error))
+        if not self._applies():
+            return self._verdict(sql_query, None)
+
+        key = sql_fingerprint(sql_query)
+        verdict = self._verdicts.get(key)
+        if verdict is not None:
+            return self._count(dict(verdict))
+
+        try:
+            estimate = await self._explain_async(sql_query)
+            checked_query = sql_query
+            if estimate["plan_rows"] > self.max_rows:
+                checked_query = self.limit_query(sql_query)
+                estimate = {**await self._explain_async(checked_query), "row_limit": self.row_limit}
+        except Exception as e:
+            # Запрос, который не удалось спланировать, не выполнится и сам
+            return self._count(self._verdict(sql_query, None, f"Ошибка проверки плана запроса: {str(e)}"))
+
+        error = None
+        if estimate["total_cost"] > self.max_cost:
+            error = (
+                f"Запрос отклонен: оценка стоимости {estimate['total_cost']:.0f} "
+                f"превышает допустимую {self.max_cost:.0f}"
+            )
+        verdict = self._verdict(checked_query, estimate, error)
+        self._verdicts.set(key, verdict)
+        return self._count(dict(verdict))
+
+    def _verdict(self, sql_query: str, estimate: Optional[Dict[str, Any]], error: Optional[str] = None):
+        cost_estimate = None
+        if estimate is not None:
+            cost_estimate = {
+                **estimate,
+                "limited": "row_limit" in estimate,
+                "max_cost": self.max_cost,
+                "max_rows": self.max_rows
+            }
+        return {
+            "allowed": error is None,
+            "sql_query": sql_query,
+            "cost_estimate": cost_estimate,
+            "error": error
+        }
+
+    def _count(self, verdict: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.checked += 1
+            if not verdict["allowed"]:
+                self.rejected += 1
+            elif verdict["cost_estimate"] and verdict["cost_estimate"]["limited"]:
+                self.limited += 1
+        return verdict
+
+    async def execute_async(self, sql_query: str) -> Dict[str, Any]:
+        """
+        Проверяет и выполняет запрос, сгенерированный LLM
+
+        Args:
+            sql_query: SQL-запрос
+
+        Returns:
+            Результат DatabaseTool.execute_query_async с дополнительными полями
+            sql_query (выполненный запрос) и cost_estimate
+        """
+        verdict = await self.check_async(sql_query)
+        if not verdict["allowed"]:
+            return {
+                "success": False,
+                "data": None,
+                "error": verdict["error"],
+                "sql_query": sql_query,
+                "cost_estimate": verdict["cost_estimate"]
+            }
+        result = await self.db_tool.execute_query_async(
+            verdict["sql_query"],
+            statement_timeout_ms=self.statement_timeout_ms,
+            read_only=True
+        )
+        return {**result, "sql_query": verdict["sql_query"], "cost_estimate": verdict["cost_estimate"]}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "limited": self.limited,
+                "rejected": self.rejected,
+                "max_cost": self.max_cost,
+                "max_rows": self.max_rows,
+                "row_limit": self.row_limit,
+                "statement_timeout_ms": self.statement_timeout_ms,
+                "cached_verdicts": len(self._verdicts)
+            }
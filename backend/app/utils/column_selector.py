@@ -0,0 +1,155 @@
+import re
+from typing import Dict, Any, Optional, Iterable, FrozenSet
+
+from ..metadata.dashboard_schema import COLUMN_DESCRIPTIONS, COLUMN_LABELS
+from .query_normalizer import normalize_query
+from .template_index import TemplateIndex
+
+# Столбцы, которые остаются в промпте при любом запросе
+CORE_COLUMNS = ("user_id", "cohort_month", "user_type")
+
+# Столбцы, соответствующие показателям normalize_query
+METRIC_COLUMNS = {
+    "users": [],
+    "cohort": [],
+    "activated": ["is_activated_user"],
+    "interested": ["is_interested_user"],
+    "subscribers": ["is_subscriber"],
+    "conversion": ["is_interested_user", "is_activated_user", "is_subscriber"],
+    "active": ["active_days", "total_sessions"],
+    "active_days": ["active_days"],
+    "retention": ["active_days", "total_sessions"],
+    "sessions": ["total_sessions", "avg_session_minutes", "technology_sessions"],
+    "technology": ["technology_views", "technology_sessions", "minutes_to_first_tech_view",
+                   "avg_tech_views_per_session"],
+    "views": ["technology_views", "discovery_views", "collection_views", "custom_business_plan_views"],
+    "search": ["search_queries", "avg_search_queries_per_session"],
+    "collections": ["collection_views"],
+    "business_plans": ["business_plan_clicks", "custom_business_plan_views",
+                       "avg_business_plan_clicks_per_session"],
+    "time": ["avg_session_minutes", "total_platform_minutes", "total_discover_minutes"]
+}
+
+# Грубая оценка числа символов на токен для отчета об экономии
+CHARS_PER_TOKEN = 4
+
+_COLUMN_DEFINITION = re.compile(r"^\s*-\s*(\w+)\s*\(")
+
+
+def estimate_tokens(chars: int) -> int:
+    """Оценивает число токенов по числу символов"""
+    return round(chars / CHARS_PER_TOKEN)
+
+
+class ColumnSelector:
+    """
+    Отбор столбцов представления, которые могут понадобиться для ответа на запрос.
+
+    Столбец выбирается, если он упомянут по имени, если показатель запроса
+    (по основам слов normalize_query) соответствует столбцу или если запрос близок
+    к подписи и описанию столбца по символьным n-граммам. Столбцы CORE_COLUMNS
+    выбираются всегда.
+    """
+
+    def __init__(self,
+                 descriptions: Optional[Dict[str, Dict[str, Any]]] = None,
+                 labels: Optional[Dict[str, str]] = None,
+                 core: Iterable[str] = CORE_COLUMNS,
+                 min_score: float = 0.35):
+        """
+        Args:
+            descriptions: Описания колонок представления (по умолчанию COLUMN_DESCRIPTIONS)
+            labels: Русские названия столбцов (по умолчанию COLUMN_LABELS)
+            core: Столбцы, которые выбираются всегда
+            min_score: Минимальная близость запроса к описанию столбца по n-граммам
+        """
+        self.descriptions = descriptions if descriptions is not None else COLUMN_DESCRIPTIONS
+        labels = labels if labels is not None else COLUMN_LABELS
+        self.columns = list(self.descriptions)
+        self.core = frozenset(column for column in core if column in self.descriptions)
+        self.min_score = min_score
+
+        # Каждый столбец - "шаблон" индекса: подпись, части имени и первое предложение описания
+        self._index = TemplateIndex([
+            {
+                "name": labels.get(column, column),
+                "keywords": column.split("_"),
+                "examples": [self.descriptions[column]["description"].split(". ")[0]],
+                "column": column
+            }
+            for column in self.columns
+        ])
+        self._mention = re.compile(r"\b(" + "|".join(map(re.escape, self.columns)) + r")\b")
+
+    def select(self, query_text: str) -> Optional[FrozenSet[str]]:
+        """
+        Отбирает столбцы для запроса
+
+        Args:
+            query_text: Текстовый запрос пользователя (или описание требуемых данных)
+
+        Returns:
+            Множество выбранных столбцов или None, если запрос не удалось сопоставить
+            со столбцами и промпт нужно оставить полным
+        """
+        normalized = normalize_query(query_text)
+        selected = set(self.core)
+        selected.update(self._mention.findall(query_text))
+        for metric in normalized["metrics"]:
+            selected.update(METRIC_COLUMNS.get(metric, []))
+        for template, score in self._index.search(query_text, top_k=5):
+            if score >= self.min_score:
+                selected.add(template["column"])
+
+        # В запросе есть нераспознанные слова, а ни один столбец кроме основных не найден
+        if selected == self.core and normalized["terms"]:
+            return None
+        return frozenset(column for column in selected if column in self.descriptions)
+
+    def dropped(self, selected: Optional[FrozenSet[str]]) -> FrozenSet[str]:
+        """Возвращает известные столбцы, не вошедшие в выборку"""
+        if selected is None:
+            return frozenset()
+        return frozenset(column for column in self.columns if column not in selected)
+
+    def prune(self, text: str, dropped: FrozenSet[str]) -> str:
+        """
+        Убирает из текста промпта строки, относящиеся только к невыбранным столбцам
+
+        Удаляются строки описания столбцов ("- имя (тип): ...") для невыбранных столбцов
+        и строки (например, примеры запросов), в которых упомянуты только невыбранные столбцы.
+        Столбцы, неизвестные селектору, не удаляются.
+
+        Args:
+            text: Текст промпта или описания представления
+            dropped: Столбцы, которые нужно убрать
+
+        Returns:
+            Текст без лишних строк
+        """
+        if not dropped:
+            return text
+        lines = []
+        for line in text.split("\n"):
+            definition = _COLUMN_DEFINITION.match(line)
+            if definition and definition.group(1) in self.descriptions:
+                if definition.group(1) in dropped:
+                    continue
+            else:
+                mentioned = set(self._mention.findall(line))
+                if mentioned and mentioned <= dropped:
+                    continue
+            lines.append(line)
+        return "\n".join(lines)
+
+
+# Общий экземпляр (описания колонок не меняются во время работы)
+_column_selector: Optional[ColumnSelector] = None
+
+
+def get_column_selector() -> ColumnSelector:
+    """Возвращает общий экземпляр ColumnSelector (создается при первом обращении)"""
+    global _column_selector
+    if _column_selector is None:
+        _column_selector = ColumnSelector()
+    return _column_selector
@@ -0,0 +1,272 @@
+import re
+import json
+from typing import Dict, Any, List, Tuple, Optional
+
+_WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser:
+    """
+    Инкрементальный разборщик JSON-объекта из потока текста модели.
+
+    Текст подается частями через feed(); как только значение очередного поля
+    верхнего уровня полностью получено, поле возвращается вызывающему коду.
+    Текст до первой '{' (пояснения, ```json) и после закрывающей '}' игнорируется.
+    Фигурные скобки внутри строк (например, в SQL) не влияют на разбор.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+
+        self._state = "seek_object"
+        self._key: List[str] = []
+        self._current_key: Optional[str] = None
+        self._value: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Обрабатывает очередную часть текста
+
+        Args:
+            chunk: Фрагмент ответа модели
+
+        Returns:
+            Список пар (поле, значение), завершенных в этом фрагменте
+        """
+        completed: List[Tuple[str, Any]] = []
+        for char in chunk:
+            if self.done:
+                break
+            self._consume(char, completed)
+        return completed
+
+    def _consume(self, char: str, completed: List[Tuple[str, Any]]):
+        state = self._state
+
+        if state == "seek_object":
+            if char == "{":
+                self._state = "seek_key"
+
+        elif state == "seek_key":
+            if char == '"':
+                self._key = []
+                self._escape = False
+                self._state = "in_key"
+            elif char == "}":
+                self.done = True
+
+        elif state == "in_key":
+            if self._escape:
+                self._key.append(char)
+                self._escape = False
+            elif char == "\\":
+                self._key.append(char)
+                self._escape = True
+            elif char == '"':
+                self._current_key = json.loads('"' + "".join(self._key) + '"')
+                self._state = "seek_colon"
+            else:
+                self._key.append(char)
+
+        elif state == "seek_colon":
+            if char == ":":
+                self._state = "seek_value"
+
+        elif state == "seek_value":
+            if char in _WHITESPACE:
+                return
+            self._value = [char]
+            self._depth = 1 if char in "{[" else 0
+            self._in_string = char == '"'
+            self._escape = False
+            self._state = "in_value"
+
+        elif state == "in_value":
+            self._consume_value(char, completed)
+
+        elif state == "after_value":
+            if char == ",":
+                self._state = "seek_key"
+            elif char == "}":
+                self.done = True
+
+    def _consume_value(self, char: str, completed: List[Tuple[str, Any]]):
+        if self._in_string:
+            self._value.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 0:
+                    # Строковое значение верхнего уровня завершено
+                    self._emit(completed)
+                    self._state = "after_value"
+            return
+
+        if self._depth > 0:
+            self._value.append(char)
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(completed)
+                    self._state = "after_value"
+            return
+
+        # Число или литерал (true/false/null): значение заканчивается разделителем
+        if char == "," or char == "}" or char in _WHITESPACE:
+            self._emit(completed)
+            self._state = "after_value"
+            if char in ",}":
+                self._consume(char, completed)
+        else:
+            self._value.append(char)
+
+    def _emit(self, completed: List[Tuple[str, Any]]):
+        raw = "".join(self._value)
+        try:
+            # strict=False допускает переводы строк внутри строк (частый случай для SQL)
+            value = json.loads(raw, strict=False)
+        except json.JSONDecodeError:
+            value = raw
+        self.fields[self._current_key] = value
+        completed.append((self._current_key, value))
+        self._value = []
+
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)```", re.DOTALL)
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _scan_object(text: str, start: int) -> int:
+    """
+    Находит конец JSON-объекта, начинающегося с '{' в позиции start,
+    не учитывая скобки внутри строк
+
+    Returns:
+        Индекс закрывающей '}' или -1, если объект не закрыт
+    """
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def _repair(text: str) -> str:
+    """
+    Исправляет типичные отклонения модели от JSON вне строк:
+    завершающие запятые перед '}' и ']' и литералы Python (True/False/None)
+    """
+    result: List[str] = []
+    in_string = False
+    escape = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            result.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            result.append(char)
+        elif char == ",":
+            # Пропускаем запятую, если за ней (после пробелов) закрывается объект или массив
+            j = i + 1
+            while j < len(text) and text[j] in _WHITESPACE:
+                j += 1
+            if j >= len(text) or text[j] not in "}]":
+                result.append(char)
+        else:
+            literal = next((word for word in _LITERALS if text.startswith(word, i)), None)
+            if literal and not (result and (result[-1].isalnum() or result[-1] == "_")):
+                result.append(_LITERALS[literal])
+                i += len(literal)
+                continue
+            result.append(char)
+        i += 1
+    return "".join(result)
+
+
+def _loads_object(text: str) -> Optional[Dict[str, Any]]:
+    """Разбирает текст как JSON-объект, при ошибке - после исправления типичных отклонений"""
+    for candidate in (text, _repair(text)):
+        try:
+            # strict=False допускает переводы строк внутри строк (частый случай для SQL)
+            value = json.loads(candidate, strict=False)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def parse_json_object(content: str) -> Optional[Dict[str, Any]]:
+    """
+    Извлекает JSON-объект из ответа модели
+
+    Допускает ответ целиком в формате JSON (режим response_format), блоки ```json,
+    пояснения до и после объекта, фигурные скобки внутри строк (SQL), завершающие
+    запятые и переводы строк внутри строк. Если объект оборван (ответ уперся
+    в max_tokens), возвращаются полностью полученные поля верхнего уровня.
+
+    Args:
+        content: Текст ответа модели
+
+    Returns:
+        Словарь с полями объекта или None, если объект не найден
+    """
+    content = content.strip().lstrip("﻿")
+    if content.startswith("{"):
+        value = _loads_object(content)
+        if value is not None:
+            return value
+
+    for block in _FENCE.findall(content):
+        value = _loads_object(block.strip())
+        if value is not None:
+            return value
+
+    start = content.find("{")
+    while start != -1:
+        end = _scan_object(content, start)
+        if end == -1:
+            # Объект не закрыт: берем поля, которые успели завершиться
+            parser = IncrementalJSONParser()
+            parser.feed(content[start:])
+            return dict(parser.fields) or None
+        value = _loads_object(content[start:end + 1])
+        if value is not None:
+            return value
+        start = content.find("{", start + 1)
+    return None
@@ -0,0 +1,213 @@
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+from ..metadata.dashboard_schema import COLUMN_DESCRIPTIONS, COLUMN_LABELS
+
+# Названия временных интервалов DATE_TRUNC и их группировки в заголовках
+GRAIN_LABELS = {
+    "day": ("День", "по дням"),
+    "week": ("Неделя", "по неделям"),
+    "month": ("Месяц", "по месяцам"),
+    "quarter": ("Квартал", "по кварталам"),
+    "year": ("Год", "по годам")
+}
+
+# Столбцы-периоды без явного интервала
+_TIME_COLUMNS = {"time_period", "period", "date", "cohort_month", "creation_week"}
+
+# Группировки по категориальным столбцам
+_CATEGORY_GROUPINGS = {
+    "user_type": "по типам пользователей",
+    "is_subscriber": "по признаку подписки",
+    "is_activated_user": "по признаку активации",
+    "is_interested_user": "по признаку заинтересованности"
+}
+
+# Агрегатные функции и префиксы имен столбцов с ними
+_AGGREGATES = {
+    "avg": "среднее",
+    "sum": "сумма",
+    "max": "максимум",
+    "min": "минимум"
+}
+_NAME_PREFIXES = {
+    "avg_": "среднее",
+    "average_": "среднее",
+    "sum_": "сумма",
+    "total_": "сумма",
+    "max_": "максимум",
+    "min_": "минимум"
+}
+
+_DATE_TRUNC = re.compile(r"DATE_TRUNC\s*\(\s*'(\w+)'", re.IGNORECASE)
+_AGGREGATE_CALL = re.compile(r"^\s*(\w+)\s*\(\s*(DISTINCT\s+)?([\w.*]+)\s*\)\s*$", re.IGNORECASE)
+
+
+class LabelEngine:
+    """
+    Детерминированный подбор заголовков, подписей осей и описаний визуализаций
+    по столбцам результата (именам и SQL-выражениям) и словарю подписей колонок.
+
+    Каждая подпись сопровождается уверенностью от 0 до 1: 1 - столбец есть в словаре,
+    меньше - подпись выведена по выражению или шаблону имени, около 0 - столбец неизвестен.
+    """
+
+    def __init__(self,
+                 labels: Optional[Dict[str, str]] = None,
+                 descriptions: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        Args:
+            labels: Русские названия столбцов (по умолчанию COLUMN_LABELS)
+            descriptions: Описания колонок представления (по умолчанию COLUMN_DESCRIPTIONS)
+        """
+        self.labels = labels if labels is not None else COLUMN_LABELS
+        self.descriptions = descriptions if descriptions is not None else COLUMN_DESCRIPTIONS
+
+    def _known_label(self, column: str) -> Optional[str]:
+        column = column.split(".")[-1].strip('"')
+        return self.labels.get(column)
+
+    def column_label(self, name: str, expression: Optional[str] = None) -> Tuple[str, float, str]:
+        """
+        Подбирает подпись столбца результата
+
+        Args:
+            name: Имя столбца результата
+            expression: SQL-выражение столбца (если известно)
+
+        Returns:
+            Кортеж (подпись, уверенность, вид столбца: time, category или metric)
+        """
+        grain = self._grain(name, expression)
+        if grain:
+            if name in self.labels and name not in GRAIN_LABELS:
+                return self.labels[name], 1.0, "time"
+            return GRAIN_LABELS[grain][0], 1.0, "time"
+        if name in _TIME_COLUMNS:
+            return self.labels.get(name, "Период"), 1.0, "time"
+
+        kind = "category" if name in _CATEGORY_GROUPINGS else "metric"
+        if name in self.labels:
+            return self.labels[name], 1.0, kind
+
+        # Подпись по выражению: COUNT(DISTINCT user_id), AVG(total_sessions) и т.д.
+        if expression:
+            call = _AGGREGATE_CALL.match(expression)
+            if call:
+                function, argument = call.group(1).lower(), call.group(3)
+                if function == "count":
+                    if argument.split(".")[-1] == "user_id":
+                        return "Количество пользователей", 0.9, "metric"
+                    return "Количество", 0.8, "metric"
+                base = self._known_label(argument)
+                if function in _AGGREGATES and base:
+                    return f"{base} ({_AGGREGATES[function]})", 0.8, "metric"
+            elif self._known_label(expression):
+                column = expression.split(".")[-1].strip('"')
+                return self.labels[column], 0.9, "category" if column in _CATEGORY_GROUPINGS else kind
+
+        # Подпись по шаблону имени: avg_<колонка>, total_<колонка>, <колонка>_count
+        for prefix, aggregate in _NAME_PREFIXES.items():
+            if name.startswith(prefix) and name[len(prefix):] in self.labels:
+                return f"{self.labels[name[len(prefix):]]} ({aggregate})", 0.75, "metric"
+        if name.endswith("_count") and name[:-len("_count")] in self.labels:
+            return f"Количество: {self.labels[name[:-len('_count')]].lower()}", 0.75, "metric"
+
+        # Столбец есть только в описании представления: берем первое предложение описания
+        if name in self.descriptions:
+            short = self.descriptions[name]["description"].split(".")[0].split(",")[0].strip()
+            if short and len(short) <= 60:
+                return short, 0.6, kind
+
+        return name.replace("_", " ").strip().capitalize() or name, 0.2, kind
+
+    @staticmethod
+    def _grain(name: str, expression: Optional[str]) -> Optional[str]:
+        """Определяет интервал времени столбца по DATE_TRUNC или по имени"""
+        if expression:
+            match = _DATE_TRUNC.search(expression)
+            if match and match.group(1).lower() in GRAIN_LABELS:
+                return match.group(1).lower()
+        if name in GRAIN_LABELS:
+            return name
+        return None
+
+    def label(self,
+              columns: List[Tuple[str, Optional[str]]],
+              visualization_type: str) -> Dict[str, Any]:
+        """
+        Подбирает заголовок, описание и подписи осей визуализации
+
+        Args:
+            columns: Столбцы результата в порядке выборки: пары (имя, SQL-выражение или None)
+            visualization_type: Тип визуализации (line, bar, pie, table)
+
+        Returns:
+            Dictionary с полями title, description, x_axis_title, y_axis_title и confidence
+        """
+        if not columns:
+            return {"title": "Результаты анализа", "description": "", "x_axis_title": "",
+                    "y_axis_title": "", "confidence": 0.0}
+
+        labelled = [(name, *self.column_label(name, expression)) for name, expression in columns]
+        x_name, x_label, x_confidence, x_kind = labelled[0]
+
+        if len(labelled) == 1:
+            return {
+                "title": x_label,
+                "description": f"Таблица содержит значения показателя «{x_label}».",
+                "x_axis_title": x_label,
+                "y_axis_title": "",
+                "confidence": x_confidence
+            }
+
+        metrics = [item for item in labelled[1:] if item[3] == "metric"] or labelled[1:2]
+        grouping, grouping_confidence = self._grouping(x_name, columns[0][1], x_label, x_kind)
+
+        if len(metrics) == 1:
+            y_label = metrics[0][1]
+            title = f"{y_label} {grouping}"
+            subject = f"показателя «{y_label}»"
+        else:
+            y_label = "Значение"
+            title = f"Показатели {grouping}"
+            subject = "показателей " + ", ".join(f"«{item[1]}»" for item in metrics)
+
+        descriptions = {
+            "line": f"График показывает динамику {subject} {grouping}.",
+            "bar": f"Столбчатая диаграмма сравнивает значения {subject} {grouping}.",
+            "pie": f"Круговая диаграмма показывает распределение {subject} {grouping}."
+        }
+        description = descriptions.get(visualization_type, f"Таблица содержит значения {subject} {grouping}.")
+
+        confidence = min([x_confidence, grouping_confidence] + [item[2] for item in metrics])
+        return {
+            "title": title,
+            "description": description,
+            "x_axis_title": x_label,
+            "y_axis_title": y_label,
+            "confidence": round(confidence, 2)
+        }
+
+    def _grouping(self, name: str, expression: Optional[str], label: str, kind: str) -> Tuple[str, float]:
+        """Формирует часть заголовка о группировке («по месяцам», «по типам пользователей»)"""
+        grain = self._grain(name, expression)
+        if grain:
+            return GRAIN_LABELS[grain][1], 1.0
+        if kind == "time":
+            return "по периодам", 0.9
+        column = expression.split(".")[-1].strip('"') if expression else name
+        for candidate in (name, column):
+            if candidate in _CATEGORY_GROUPINGS:
+                return _CATEGORY_GROUPINGS[candidate], 1.0
+        # Группировка по неизвестной категории: подпись есть, но формулировка общая
+        return f"в разрезе «{label}»", 0.6
+
+
+# Общий экземпляр (словарь подписей не меняется во время работы)
+_label_engine = LabelEngine()
+
+
+def get_label_engine() -> LabelEngine:
+    """Возвращает общий экземпляр LabelEngine"""
+    return _label_engine
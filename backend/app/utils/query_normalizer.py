@@ -0,0 +1,426 @@
+import re
+import json
+import hashlib
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+# Слова без аналитического смысла (команды, предлоги, вежливость)
+STOPWORDS = {
+    "покажи", "показать", "покажите", "выведи", "вывести", "построй", "построить", "нарисуй",
+    "сделай", "дай", "дайте", "хочу", "нужно", "нужен", "нужна", "мне", "нам", "пожалуйста",
+    "график", "графики", "графика", "диаграмма", "диаграмму", "диаграммы", "визуализация",
+    "визуализацию", "данные", "данных", "информация", "информацию", "статистика", "статистику",
+    "отчет", "отчёт", "какой", "какая", "какие", "каков", "какова", "каково", "как", "что", "это",
+    "за", "в", "во", "на", "по", "с", "со", "и", "а", "для", "о", "об", "от", "до", "из", "у",
+    "же", "ли", "бы", "все", "всех", "весь", "вся", "есть", "был", "была", "было", "были", "платформе",
+    "платформы", "atlantix"
+}
+
+# Окончания для облегченного стемминга (от длинных к коротким)
+_SUFFIXES = sorted([
+    "иями", "ями", "ами", "иях", "иям", "ого", "его", "ому", "ему", "ыми", "ими", "ией",
+    "ях", "ах", "ям", "ам", "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ых", "их",
+    "ов", "ев", "ом", "ем", "ую", "юю", "ию", "ью", "ии", "ия",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й"
+], key=len, reverse=True)
+
+# Основы слов, определяющие показатели запроса
+_METRIC_STEMS = {
+    "пользовател": "users",
+    "юзер": "users",
+    "клиент": "users",
+    "активирован": "activated",
+    "активн": "active",
+    "заинтересован": "interested",
+    "подписчик": "subscribers",
+    "подписк": "subscribers",
+    "сесс": "sessions",
+    "визит": "sessions",
+    "технолог": "technology",
+    "просмотр": "views",
+    "поиск": "search",
+    "коллекц": "collections",
+    "дн": "active_days",
+    "бизнес": "business_plans",
+    "план": "business_plans",
+    "врем": "time",
+    "минут": "time",
+    "продолжительн": "time",
+    "длительн": "time",
+    "конверс": "conversion",
+    "воронк": "conversion",
+    "когорт": "cohort",
+    "удержан": "retention"
+}
+
+# Основы слов, определяющие тип запроса
+_INTENT_STEMS = {
+    "средн": "average",
+    "скольк": "count",
+    "количеств": "count",
+    "числ": "count",
+    "распределен": "distribution",
+    "процент": "distribution",
+    "соотношен": "distribution",
+    "сравн": "comparison",
+    "динамик": "trend",
+    "тренд": "trend",
+    "изменен": "trend",
+    "рост": "trend",
+    "топ": "top",
+    "лучш": "top",
+    "сумм": "total",
+    "общ": "total"
+}
+# Короткие основы, которые сравниваются целиком (иначе "дол" совпадет с "долго",
+# а "всег" - основа слова "всего" после stem() - с "всегда")
+_INTENT_EXACT = {"дол": "distribution", "всег": "total"}
+
+# Явно указанный тип визуализации
+_CHART_STEMS = {
+    "кругов": "pie",
+    "столбчат": "bar",
+    "гистограмм": "bar",
+    "линейн": "line",
+    "таблиц": "table",
+    "точечн": "scatter"
+}
+
+# Интервалы группировки
+_GRAIN_PATTERNS = [
+    (re.compile(r"\bпо\s+дням\b|\bежедневн\w*|\bподневн\w*"), "day"),
+    (re.compile(r"\bпо\s+неделям\b|\bеженедельн\w*|\bпонедельн\w*"), "week"),
+    (re.compile(r"\bпо\s+месяцам\b|\bежемесячн\w*|\bпомесячн\w*"), "month"),
+    (re.compile(r"\bпо\s+кварталам\b|\bежеквартальн\w*|\bпоквартальн\w*"), "quarter"),
+    (re.compile(r"\bпо\s+годам\b|\bежегодн\w*"), "year")
+]
+
+# Разрезы (группировки по измерениям)
+_DIMENSION_PATTERNS = [
+    (re.compile(r"\bпо\s+тип\w*(?:\s+пользовател\w*)?"), "user_type"),
+    (re.compile(r"\bпо\s+когорт\w*"), "cohort"),
+    (re.compile(r"\bпо\s+технологи\w*"), "technology")
+]
+
+_MONTHS = {
+    "январ": 1, "феврал": 2, "март": 3, "апрел": 4, "ма": 5, "июн": 6,
+    "июл": 7, "август": 8, "сентябр": 9, "октябр": 10, "ноябр": 11, "декабр": 12
+}
+_MONTH_WORD = (
+    r"(январ\w*|феврал\w*|март\w*|апрел\w*|ма[йяе]|июн\w*|июл\w*|август\w*|"
+    r"сентябр\w*|октябр\w*|ноябр\w*|декабр\w*)"
+)
+_MONTH_PATTERN = re.compile(r"\b" + _MONTH_WORD + r"(?:\s+(\d{4})(?:\s*(?:года|год|г\.?))?)?")
+# Месяц без года перед месяцем с годом: «с января по март 2025», «январе и марте 2025»
+_MONTH_CHAIN = re.compile(
+    r"\b" + _MONTH_WORD + r"(\s*-\s*|\s+(?:(?:и|по|до)\s+)?)" + _MONTH_WORD + r"\s+(\d{4})\b"
+)
+_PREVIOUS = r"(?:прошл|предыдущ)\w*"
+_CURRENT = r"(?:эт|текущ)\w*"
+_UNITS = r"(дн\w*|день|недел\w*|месяц\w*|квартал\w*|год\w*|лет)"
+_LAST_N = re.compile(r"\b(?:последн|прошедш)\w*\s+(?:(\d+)\s+)?" + _UNITS)
+_RELATIVE = re.compile(r"\b(" + _PREVIOUS + "|" + _CURRENT + r")\s+(недел\w*|месяц\w*|квартал\w*|год\w*)")
+_QUARTER = re.compile(r"\b([1-4])\s*(?:-?(?:й|ый|ом))?\s+квартал\w*(?:\s+(\d{4})(?:\s*(?:года|год|г\.?))?)?")
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_YEAR = re.compile(r"\b(20\d{2})(?:\s*(?:года|году|год|г\.?))?\b")
+_DAY_WORDS = re.compile(r"\b(сегодня|вчера|позавчера)\b")
+# Найденный период заменяется в тексте меткой, по которой затем собираются диапазоны
+_MARK = r"§(\d+)§"
+_RANGE = re.compile(
+    r"\b(?:(?:с|со|от)\s+" + _MARK + r"\s+(?:по|до)|между\s+" + _MARK + r"\s+и)\s+" + _MARK
+)
+_RANGE_START = re.compile(r"\b(?:начиная\s+)?(?:с|со|от)\s+" + _MARK)
+_RANGE_END = re.compile(r"\b(?:по|до)\s+" + _MARK)
+
+
+def _shift_month(day: date, months: int) -> Tuple[int, int]:
+    """Возвращает (год, месяц), отстоящий от даты на указанное число месяцев"""
+    index = day.year * 12 + day.month - 1 + months
+    return index // 12, index % 12 + 1
+
+
+def _quarter(day: date) -> str:
+    return f"{day.year}-Q{(day.month - 1) // 3 + 1}"
+
+
+def _week(day: date) -> str:
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _unit(word: str) -> str:
+    if word.startswith("дн") or word == "день":
+        return "day"
+    if word.startswith("недел"):
+        return "week"
+    if word.startswith("месяц"):
+        return "month"
+    if word.startswith("квартал"):
+        return "quarter"
+    return "year"
+
+
+def _last_n(count: int, unit: str, today: date) -> str:
+    """Абсолютный диапазон для «последние N <единиц>» (включая текущую)"""
+    if unit == "day":
+        return f"{today - timedelta(days=count - 1)}..{today}"
+    if unit == "week":
+        return f"{today - timedelta(weeks=count) + timedelta(days=1)}..{today}"
+    if unit == "month":
+        year, month = _shift_month(today, -(count - 1))
+        return f"{year}-{month:02d}..{today.year}-{today.month:02d}"
+    if unit == "quarter":
+        year, month = _shift_month(today, -3 * (count - 1))
+        return f"{_quarter(date(year, month, 1))}..{_quarter(today)}"
+    return f"{today.year - count + 1}..{today.year}"
+
+
+def _relative(which: str, unit: str, today: date) -> str:
+    """Абсолютный период для «прошлый/текущий <единица>»"""
+    previous = not (which.startswith("эт") or which.startswith("текущ"))
+    if unit == "week":
+        return _week(today - timedelta(weeks=1) if previous else today)
+    if unit == "month":
+        year, month = _shift_month(today, -1 if previous else 0)
+        return f"{year}-{month:02d}"
+    if unit == "quarter":
+        year, month = _shift_month(today, -3 if previous else 0)
+        return _quarter(date(year, month, 1))
+    return str(today.year - 1 if previous else today.year)
+
+
+def _month_number(word: str) -> Optional[int]:
+    if word in ("май", "мая", "мае"):
+        return 5
+    for prefix, number in _MONTHS.items():
+        if prefix != "ма" and word.startswith(prefix):
+            return number
+    return None
+
+
+def _spread_year(match) -> str:
+    """Дописывает год следующего месяца месяцу без года (с переходом через новый год)"""
+    year = int(match.group(4))
+    if _month_number(match.group(1)) > _month_number(match.group(3)):
+        year -= 1
+    return f"{match.group(1)} {year}{match.group(2)}{match.group(3)} {match.group(4)}"
+
+
+def resolve_periods(text: str, today: Optional[date] = None) -> Tuple[List[str], str]:
+    """
+    Находит в тексте упоминания периодов и приводит их к абсолютным значениям.
+    Диапазон («с января по март 2025», «между 2023 и 2024») - один период
+    вида начало..конец, граница («до марта 2025», «с 2024 года») - период
+    с открытым концом (..2025-03, 2024..)
+
+    Args:
+        text: Запрос в нижнем регистре
+        today: Текущая дата (по умолчанию - сегодня)
+
+    Returns:
+        Кортеж (список периодов вида 2025-03, 2025-Q1, 2025, 2025-01-01..2025-03-31,
+        текст без упоминаний периодов)
+    """
+    today = today or date.today()
+    periods = []
+
+    def replace(pattern, resolver):
+        nonlocal text
+
+        def substitute(match):
+            periods.append(resolver(match))
+            return f" §{len(periods) - 1}§ "
+        text = pattern.sub(substitute, text)
+
+    # Год, указанный после последнего месяца перечисления или диапазона, относится ко всем
+    previous = None
+    while previous != text:
+        previous, text = text, _MONTH_CHAIN.sub(_spread_year, text)
+
+    replace(_ISO_DATE, lambda m: f"{m.group(1)}-{m.group(2)}-{m.group(3)}")
+    replace(_LAST_N, lambda m: _last_n(int(m.group(1) or 1), _unit(m.group(2)), today))
+    replace(_RELATIVE, lambda m: _relative(m.group(1), _unit(m.group(2)), today))
+    replace(_QUARTER, lambda m: f"{m.group(2) or today.year}-Q{m.group(1)}")
+
+    def month(match):
+        number = _month_number(match.group(1))
+        if match.group(2):
+            year = int(match.group(2))
+        else:
+            # Месяц без года - последний наступивший
+            year = today.year if number <= today.month else today.year - 1
+        return f"{year}-{number:02d}"
+    replace(_MONTH_PATTERN, month)
+    replace(_YEAR, lambda m: m.group(1))
+
+    days = {"сегодня": 0, "вчера": 1, "позавчера": 2}
+    replace(_DAY_WORDS, lambda m: str(today - timedelta(days=days[m.group(1)])))
+
+    # Собираем диапазоны и границы из найденных периодов; предлоги остаются в ключе
+    # в виде формы периода, поэтому «до марта» и «в марте» различаются
+    def start(index):
+        return periods[int(index)].split("..")[0]
+
+    def end(index):
+        return periods[int(index)].split("..")[-1]
+
+    combined = []
+
+    def combine(pattern, resolver):
+        nonlocal text
+
+        def substitute(match):
+            combined.append(resolver(match))
+            return " "
+        text = pattern.sub(substitute, text)
+
+    combine(_RANGE, lambda m: f"{start(m.group(1) or m.group(2))}..{end(m.group(3))}")
+    combine(_RANGE_START, lambda m: f"{start(m.group(1))}..")
+    combine(_RANGE_END, lambda m: f"..{end(m.group(1))}")
+    combine(re.compile(_MARK), lambda m: periods[int(m.group(1))])
+    return sorted(set(combined)), text
+
+
+def _period_start_end(period: str) -> Optional[Tuple[date, date]]:
+    """Первый и последний день одиночного периода или None, если дата некорректна"""
+    try:
+        return _period_bounds(period)
+    except ValueError:
+        return None
+
+
+def _period_bounds(period: str) -> Optional[Tuple[date, date]]:
+    """Первый и последний день одиночного периода (2025, 2025-03, 2025-Q1, 2025-W10, 2025-03-15)"""
+    match = re.fullmatch(r"(\d{4})(?:-(\d{2})(?:-(\d{2}))?|-Q([1-4])|-W(\d{2}))?", period)
+    if not match:
+        return None
+    year = int(match.group(1))
+    if match.group(3):
+        day = date(year, int(match.group(2)), int(match.group(3)))
+        return day, day
+    if match.group(2):
+        first_month = last_month = int(match.group(2))
+    elif match.group(4):
+        last_month = int(match.group(4)) * 3
+        first_month = last_month - 2
+    elif match.group(5):
+        monday = date.fromisocalendar(year, int(match.group(5)), 1)
+        return monday, monday + timedelta(days=6)
+    else:
+        first_month, last_month = 1, 12
+    next_year, next_month = _shift_month(date(year, last_month, 1), 1)
+    return date(year, first_month, 1), date(next_year, next_month, 1) - timedelta(days=1)
+
+
+def period_bounds(period: str, today: Optional[date] = None) -> Optional[Tuple[date, date]]:
+    """
+    Переводит период из normalize_query в первый и последний день (включительно)
+
+    Args:
+        period: Период вида 2025-03, 2025-Q1, 2025, 2025-01..2025-03 или ..2025-03
+        today: Текущая дата - конец периода с открытым концом (по умолчанию - сегодня)
+
+    Returns:
+        Кортеж (первый день, последний день) или None, если у периода нет начала
+        или его не удалось разобрать
+    """
+    if ".." not in period:
+        return _period_start_end(period)
+    start, end = period.split("..", 1)
+    first = _period_start_end(start) if start else None
+    last = _period_start_end(end) if end else (today or date.today(),) * 2
+    if first is None or last is None or first[0] > last[1]:
+        return None
+    return first[0], last[1]
+
+
+def stem(word: str) -> str:
+    """Облегченный стемминг: отбрасывает одно окончание, оставляя основу не короче 3 букв"""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def _match_stem(word_stem: str, stems: Dict[str, str]) -> Optional[str]:
+    for prefix in sorted(stems, key=len, reverse=True):
+        if word_stem.startswith(prefix):
+            return stems[prefix]
+    return None
+
+
+def normalize_query(query_text: str, today: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Приводит запрос пользователя к канонической форме для ключа кэша
+
+    Args:
+        query_text: Текстовый запрос пользователя
+        today: Текущая дата для разрешения относительных периодов (по умолчанию - сегодня)
+
+    Returns:
+        Dictionary с полями intent, metrics, grain, period, filters, chart
+        и terms (основы слов, не распознанные ни одним правилом)
+    """
+    text = query_text.lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s\-.]", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+
+    periods, text = resolve_periods(text, today)
+
+    grain = None
+    for pattern, value in _GRAIN_PATTERNS:
+        if pattern.search(text):
+            grain = grain or value
+            text = pattern.sub(" ", text)
+
+    filters = []
+    for pattern, dimension in _DIMENSION_PATTERNS:
+        if pattern.search(text):
+            filters.append(f"group_by:{dimension}")
+            text = pattern.sub(" ", text)
+
+    intents, metrics, charts, terms = set(), set(), set(), set()
+    for word in re.findall(r"[\w\-]+", text):
+        word = word.strip("-.")
+        if not word or word in STOPWORDS:
+            continue
+        if word.isdigit():
+            terms.add(word)
+            continue
+        word_stem = stem(word)
+        intent = _INTENT_EXACT.get(word_stem) or _match_stem(word_stem, _INTENT_STEMS)
+        metric = _match_stem(word_stem, _METRIC_STEMS)
+        chart = _match_stem(word_stem, _CHART_STEMS)
+        if intent:
+            intents.add(intent)
+        if metric:
+            metrics.add(metric)
+        if chart:
+            charts.add(chart)
+        if not (intent or metric or chart):
+            terms.add(word_stem)
+
+    return {
+        "intent": "+".join(sorted(intents)) or "general",
+        "metrics": sorted(metrics),
+        "grain": grain,
+        "period": periods,
+        "filters": sorted(filters),
+        "chart": "+".join(sorted(charts)) or None,
+        "terms": sorted(terms)
+    }
+
+
+def make_cache_key(normalized: Dict[str, Any], namespace: str = "analyze") -> str:
+    """
+    Формирует ключ кэша по нормализованному запросу
+
+    Args:
+        normalized: Результат normalize_query
+        namespace: Префикс ключа
+
+    Returns:
+        Строка ключа кэша
+    """
+    serialized = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+    return f"{namespace}:" + hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:32]
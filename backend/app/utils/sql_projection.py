@@ -0,0 +1,116 @@
+import re
+from typing import List, Tuple, Iterable
+
+_IDENTIFIER = re.compile(r'^"?([A-Za-z_][A-Za-z0-9_$]*)"?$')
+_QUALIFIED = re.compile(r'^(?:"?[A-Za-z_][A-Za-z0-9_$]*"?\.)+"?([A-Za-z_][A-Za-z0-9_$]*)"?$')
+_ALIAS = re.compile(r'\s+AS\s+"?([A-Za-z_Ѐ-ӿ][A-Za-z0-9_$Ѐ-ӿ ]*?)"?\s*$', re.IGNORECASE)
+_FUNCTION = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)\s*\(')
+_WORD = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def _split_top_level(text: str, separator: str = ",") -> List[str]:
+    """Делит текст по разделителю вне скобок и строковых литералов"""
+    parts, current = [], []
+    depth = 0
+    quote = None
+    for char in text:
+        if quote:
+            current.append(char)
+            if char == quote:
+                quote = None
+            continue
+        if char in ("'", '"'):
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    if current and "".join(current).strip():
+        parts.append("".join(current).strip())
+    return parts
+
+
+def _find_select_list(sql: str) -> str:
+    """Возвращает список выражений внешнего SELECT (между SELECT и FROM верхнего уровня)"""
+    upper = sql.upper()
+    depth = 0
+    quote = None
+    start = None
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0 and (i == 0 or not (sql[i - 1].isalnum() or sql[i - 1] == "_")):
+            if start is None and upper.startswith("SELECT", i) and not _is_word_char(sql, i + 6):
+                start = i + 6
+                i += 6
+                continue
+            if start is not None and upper.startswith("FROM", i) and not _is_word_char(sql, i + 4):
+                return sql[start:i]
+        i += 1
+    return sql[start:] if start is not None else ""
+
+
+def _is_word_char(text: str, index: int) -> bool:
+    return index < len(text) and (text[index].isalnum() or text[index] == "_")
+
+
+def extract_select_columns(sql: str) -> List[Tuple[str, str]]:
+    """
+    Определяет столбцы результата SQL-запроса без его выполнения
+
+    Args:
+        sql: SQL-запрос
+
+    Returns:
+        Список пар (имя столбца результата, выражение). Имена выводятся по правилам
+        PostgreSQL: псевдоним, имя столбца или имя функции для выражений без псевдонима.
+    """
+    select_list = _find_select_list(sql.strip().rstrip(";"))
+    select_list = re.sub(r"^\s*DISTINCT(\s+ON\s*\([^)]*\))?\s+", "", select_list, flags=re.IGNORECASE)
+
+    columns = []
+    for expression in _split_top_level(select_list):
+        alias = _ALIAS.search(expression)
+        if alias:
+            expression = expression[:alias.start()].strip()
+            columns.append((alias.group(1).strip(), expression))
+            continue
+
+        match = _IDENTIFIER.match(expression) or _QUALIFIED.match(expression)
+        if match:
+            columns.append((match.group(1), expression))
+            continue
+
+        function = _FUNCTION.match(expression)
+        columns.append((function.group(1).lower() if function else "?column?", expression))
+    return columns
+
+
+def referenced_columns(expression: str, known_columns: Iterable[str]) -> List[str]:
+    """
+    Возвращает известные столбцы, упомянутые в выражении (в порядке появления)
+
+    Args:
+        expression: SQL-выражение
+        known_columns: Имена столбцов, которые нужно искать
+    """
+    known = set(known_columns)
+    found = []
+    for word in _WORD.findall(expression):
+        if word in known and word not in found:
+            found.append(word)
+    return found
@@ -0,0 +1,139 @@
+import re
+import zlib
+from typing import Dict, Any, List, Tuple
+
+import numpy as np
+
+from .query_normalizer import STOPWORDS
+
+
+def _prepare_text(text: str) -> str:
+    """Нижний регистр, без пунктуации и служебных слов, с пробелами по краям слов"""
+    text = text.lower().replace("ё", "е")
+    words = [word for word in re.findall(r"\w+", text) if word not in STOPWORDS]
+    return " " + " ".join(words) + " " if words else ""
+
+
+class TemplateIndex:
+    """
+    Индекс шаблонов запросов по символьным n-граммам с весами TF-IDF.
+
+    Каждая формулировка шаблона (название, ключевые слова, примеры) - отдельная строка
+    разреженной матрицы (n-граммы хэшируются в признаки). Матрица хранится по столбцам,
+    поэтому оценка запроса - одно умножение матрицы на вектор запроса в NumPy,
+    затрагивающее только признаки самого запроса.
+    """
+
+    def __init__(self,
+                 templates: List[Dict[str, Any]],
+                 ngram_range: Tuple[int, int] = (3, 5),
+                 n_features: int = 2 ** 20):
+        """
+        Args:
+            templates: Шаблоны запросов (поля name, keywords и необязательное examples)
+            ngram_range: Минимальная и максимальная длина символьных n-грамм
+            n_features: Число признаков (размер пространства хэширования)
+        """
+        self.templates = list(templates)
+        self.ngram_range = ngram_range
+        self.n_features = n_features
+
+        rows, row_templates = [], []
+        for template_id, template in enumerate(self.templates):
+            phrasings = [template.get("name", ""), " ".join(template.get("keywords", []))]
+            phrasings += template.get("examples", [])
+            for phrasing in phrasings:
+                counts = self._ngram_counts(phrasing)
+                if counts:
+                    rows.append(counts)
+                    row_templates.append(template_id)
+        self.row_templates = np.array(row_templates, dtype=np.int32)
+
+        # Обратная частота признаков по всем формулировкам
+        n_rows = len(rows)
+        document_frequency: Dict[int, int] = {}
+        for counts in rows:
+            for feature in counts:
+                document_frequency[feature] = document_frequency.get(feature, 0) + 1
+        self._idf = {f: float(np.log((1 + n_rows) / (1 + df)) + 1) for f, df in document_frequency.items()}
+        self._unseen_idf = float(np.log(1 + n_rows) + 1)
+
+        # Нормированные строки матрицы в формате (признак, строка, вес), отсортированные по признаку
+        features, row_ids, weights = [], [], []
+        for row_id, counts in enumerate(rows):
+            row_features = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            row_weights = np.array([(1 + np.log(c)) * self._idf[f] for f, c in counts.items()], dtype=np.float32)
+            row_weights /= np.linalg.norm(row_weights)
+            features.append(row_features)
+            row_ids.append(np.full(len(counts), row_id, dtype=np.int32))
+            weights.append(row_weights)
+
+        if rows:
+            features = np.concatenate(features)
+            order = np.argsort(features, kind="stable")
+            self._rows = np.concatenate(row_ids)[order]
+            self._weights = np.concatenate(weights)[order]
+            # Начало списка строк каждого признака (как indptr в CSC-матрице)
+            self._indptr = np.searchsorted(features[order], np.arange(n_features + 1)).astype(np.int64)
+        else:
+            self._rows = np.zeros(0, dtype=np.int32)
+            self._weights = np.zeros(0, dtype=np.float32)
+            self._indptr = np.zeros(n_features + 1, dtype=np.int64)
+        self.n_rows = n_rows
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    def _ngram_counts(self, text: str) -> Dict[int, int]:
+        """Считает хэшированные символьные n-граммы текста"""
+        text = _prepare_text(text)
+        counts: Dict[int, int] = {}
+        low, high = self.ngram_range
+        for size in range(low, high + 1):
+            for start in range(len(text) - size + 1):
+                gram = text[start:start + size]
+                if gram.strip():
+                    feature = zlib.crc32(gram.encode("utf-8")) % self.n_features
+                    counts[feature] = counts.get(feature, 0) + 1
+        return counts
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Ранжирует шаблоны по косинусной близости к запросу
+
+        Args:
+            query: Текстовый запрос пользователя
+            top_k: Максимальное число шаблонов в ответе
+
+        Returns:
+            Список пар (шаблон, оценка от 0 до 1) по убыванию оценки
+        """
+        counts = self._ngram_counts(query)
+        if not counts or not self.n_rows:
+            return []
+
+        query_features = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        query_weights = np.array(
+            [(1 + np.log(c)) * self._idf.get(f, self._unseen_idf) for f, c in counts.items()],
+            dtype=np.float32
+        )
+        query_weights /= np.linalg.norm(query_weights)
+
+        # Произведение разреженной матрицы на вектор запроса: собираем строки
+        # всех признаков запроса и суммируем вклады по строкам
+        starts = self._indptr[query_features]
+        lengths = self._indptr[query_features + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return []
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        positions = np.arange(total) + offsets
+        contributions = self._weights[positions] * np.repeat(query_weights, lengths)
+        row_scores = np.bincount(self._rows[positions], weights=contributions, minlength=self.n_rows)
+
+        # Оценка шаблона - лучшая из оценок его формулировок
+        template_scores = np.zeros(len(self.templates))
+        np.maximum.at(template_scores, self.row_templates, row_scores)
+
+        top = np.argsort(-template_scores)[:top_k]
+        return [(self.templates[i], round(float(template_scores[i]), 4)) for i in top if template_scores[i] > 0]